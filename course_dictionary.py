@@ -1,10 +1,28 @@
+import hashlib
+import mmap
+import os
 import re
+import struct
+import sys
 from collections import namedtuple
-from openpyxl import load_workbook
 
 Course = namedtuple('Course', 'program, designation')
 CourseInfo = namedtuple('CourseInfo', 'credits, terms, prereqs')
 
+CATALOG_PATH = 'newcatalog.xlsx'
+SNAPSHOT_PATH = 'newcatalog.snapshot'
+SNAPSHOT_VERSION = 1
+
+# Snapshot layout (little endian, every section padded to 4 bytes):
+#   header   magic, version, sha256 of the xlsx, section counts
+#   strings  tag per string (see _TAG_*), offsets into the utf-8 blob, the blob itself
+#   keys     interned courses as (program, designation) string ids; the first n_rows are catalog rows
+#   rows     credits string id, term string id ranges and prereq clause ranges per catalog row
+#   clauses  member ranges per clause, members are key ids (the prereq DNF as integer-id arrays)
+_MAGIC = b'CDSNAP'
+_HEADER = struct.Struct('<6sH32s7I')
+_TAG_STR, _TAG_INT, _TAG_NONE = 0, 1, 2
+
 
 def create_course_dict():
     """
@@ -12,8 +30,23 @@ def create_course_dict():
     Keys: namedtuple of the form ('program, designation')
     Values: namedtuple of the form('name, prereqs, credits')
             prereqs is a tuple of prereqs where each prereq has the same form as the keys
+    The catalog is loaded from its compiled snapshot, which is rebuilt whenever the xlsx changes.
     """
-    wb = load_workbook('newcatalog.xlsx')
+    digest = catalog_digest()
+    course_dict = load_course_dict(digest)
+    if course_dict is None:
+        course_dict = parse_course_dict()
+        try:
+            compile_course_dict(course_dict, digest)
+        except OSError:  # Read-only checkout, the parsed dict is still good
+            pass
+    return course_dict
+
+
+def parse_course_dict(path=CATALOG_PATH):
+    """Reads the course dictionary straight out of the xlsx catalog. This is slow, prefer create_course_dict."""
+    from openpyxl import load_workbook
+    wb = load_workbook(path)
     catalog = wb.get_sheet_by_name('catalog')
     course_dict = {}
     for row in range(1, catalog.max_row + 1):
@@ -25,6 +58,126 @@ def create_course_dict():
     return course_dict
 
 
+def catalog_digest(path=CATALOG_PATH):
+    """Returns the sha256 of the xlsx catalog, or None if it isn't available."""
+    try:
+        with open(path, 'rb') as catalog:
+            return hashlib.sha256(catalog.read()).digest()
+    except OSError:
+        return None
+
+
+def compile_course_dict(course_dict, digest, path=SNAPSHOT_PATH):
+    """
+    Writes the course dictionary to a binary snapshot stamped with the catalog digest.
+    Strings and courses are interned so each appears once, and prereqs are stored as arrays of course ids.
+    """
+    strings, string_ids = [], {}
+    keys, key_ids = [], {}
+
+    def string_id(val):
+        if (type(val), val) not in string_ids:
+            string_ids[(type(val), val)] = len(strings)
+            strings.append(val)
+        return string_ids[(type(val), val)]
+
+    def key_id(course):
+        course = tuple(course)
+        if course not in key_ids:
+            key_ids[course] = len(keys)
+            keys.append((string_id(course[0]), string_id(course[1])))
+        return key_ids[course]
+
+    for course in course_dict:
+        key_id(course)
+    credits, term_starts, terms, clause_starts, member_starts, members = [], [0], [], [0], [0], []
+    for info in course_dict.values():
+        credits.append(string_id(info.credits))
+        terms.extend(string_id(term) for term in info.terms)
+        term_starts.append(len(terms))
+        for clause in info.prereqs:
+            members.extend(key_id(req) for req in clause)
+            member_starts.append(len(members))
+        clause_starts.append(len(member_starts) - 1)
+
+    tags = bytearray(_TAG_STR if isinstance(val, str) else _TAG_INT if isinstance(val, int) else _TAG_NONE
+                     for val in strings)
+    blob = b''.join(b'' if val is None else str(val).encode('utf-8') for val in strings)
+    string_starts = [0]
+    for val in strings:
+        string_starts.append(string_starts[-1] + (0 if val is None else len(str(val).encode('utf-8'))))
+
+    sections = [bytes(tags), _pack(string_starts), blob, _pack(key for pair in keys for key in pair), _pack(credits),
+                _pack(term_starts), _pack(terms), _pack(clause_starts), _pack(member_starts), _pack(members)]
+    header = _HEADER.pack(_MAGIC, SNAPSHOT_VERSION, digest or bytes(32), len(strings), len(blob), len(keys),
+                          len(course_dict), len(terms), len(member_starts) - 1, len(members))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())  # Per process, so concurrent writers don't share one
+    with open(tmp_path, 'wb') as snapshot:
+        snapshot.write(header)
+        for section in sections:
+            snapshot.write(section)
+            snapshot.write(bytes(-len(section) % 4))
+    os.replace(tmp_path, path)  # Readers never see a half written snapshot
+
+
+def load_course_dict(digest, path=SNAPSHOT_PATH):
+    """
+    Loads the course dictionary from a snapshot written by compile_course_dict.
+    Returns None if there is no snapshot or it is stale (another version or catalog digest).
+    A None digest means the xlsx isn't available, so any snapshot of the current version is accepted.
+    """
+    try:
+        with open(path, 'rb') as snapshot:
+            buf = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        if len(buf) < _HEADER.size:
+            return None
+        magic, version, snapshot_digest, n_strings, n_blob, n_keys, n_rows, n_terms, n_clauses, n_members = \
+            _HEADER.unpack_from(buf)
+        if magic != _MAGIC or version != SNAPSHOT_VERSION or (digest is not None and snapshot_digest != digest):
+            return None
+        sections = []
+        offset = _HEADER.size
+        for length, fmt in ((n_strings, 'B'), (n_strings + 1, 'I'), (n_blob, 'B'), (2 * n_keys, 'I'),
+                            (n_rows, 'I'), (n_rows + 1, 'I'), (n_terms, 'I'), (n_rows + 1, 'I'),
+                            (n_clauses + 1, 'I'), (n_members, 'I')):
+            size = length * struct.calcsize('<' + fmt)
+            if fmt == 'B':
+                sections.append(buf[offset:offset + size])
+            else:  # Little endian whatever the machine, as _pack wrote them
+                sections.append(struct.unpack_from('<%dI' % length, buf, offset))
+            offset += size + (-size % 4)
+        tags, string_starts, blob, key_pairs, credits, term_starts, terms, clause_starts, member_starts, members = \
+            sections
+
+        strings = []
+        for i in range(n_strings):
+            text = str(blob[string_starts[i]:string_starts[i + 1]], 'utf-8')
+            strings.append(sys.intern(text) if tags[i] == _TAG_STR else int(text) if tags[i] == _TAG_INT else None)
+        refs = [(strings[key_pairs[2 * i]], strings[key_pairs[2 * i + 1]]) for i in range(n_keys)]
+        clauses = [tuple(refs[member] for member in members[member_starts[i]:member_starts[i + 1]])
+                   for i in range(n_clauses)]
+        course_dict = {}
+        for row in range(n_rows):
+            course_dict[Course(*refs[row])] = CourseInfo(
+                strings[credits[row]],
+                tuple(strings[term] for term in terms[term_starts[row]:term_starts[row + 1]]),
+                tuple(clauses[clause_starts[row]:clause_starts[row + 1]]))
+        return course_dict
+    except (struct.error, ValueError, IndexError, TypeError, UnicodeDecodeError):  # Truncated or corrupt snapshot
+        return None
+    finally:
+        buf.close()
+
+
+def _pack(ints):
+    """Packs unsigned ints into a little endian uint32 array."""
+    ints = list(ints)
+    return struct.pack('<%dI' % len(ints), *ints)
+
+
 def get_split_course(course):
     """
     Parses a course from programdesignation into the ('program, designation') form.
@@ -51,3 +204,8 @@ def print_dict(dict):
     """Simply prints a dictionary's key and values line by line."""
     for key in dict:
         print(key, dict[key])
+
+
+if __name__ == '__main__':
+    compile_course_dict(parse_course_dict(), catalog_digest())
+    print('Compiled', CATALOG_PATH, 'to', SNAPSHOT_PATH)
@@ -0,0 +1,25 @@
+# gunicorn picks this file up from the working directory: gunicorn sameerpuri_flaskui:app
+# The app is built once in the master and shared with the workers, see sameerpuri_preload. One worker serves requests
+# on threads: schedule jobs live in the memory of the process they were submitted to, and an event stream then holds a
+# thread instead of a whole worker. With more than one worker (GUNICORN_WORKERS or --workers N) the jobs API is turned
+# off, and only then does preloading share memory between workers.
+import os
+
+import sameerpuri_preload as spp
+
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+preload_app = True
+
+
+def when_ready(server):
+    spp.preload()
+
+
+def post_fork(server, worker):
+    import sameerpuri_flaskui
+    spp.report_memory('worker')
+    sameerpuri_flaskui.start_batch_pool()  # Before the worker starts its threads, so forking it is safe
+    if server.cfg.workers > 1:
+        sameerpuri_flaskui.disable_jobs('jobs are kept in one process, but %d workers are running' % server.cfg.workers)
@@ -0,0 +1,161 @@
+#!/bin/python
+# Approximate nearest neighbour search for the recommender, an inverted file (IVF) index built with NumPy. The course
+# vectors are clustered with k-means, and a query only scores the courses in the clusters whose centroids are closest
+# to it, so the work per query grows with the square root of the catalog instead of with the catalog.
+# Run as a script it builds the index of the current catalog into the vector cache, or with --bench measures recall
+# and latency against exact scoring, on the catalog or on a larger one made by jittering copies of it.
+# Usage: python sameerpuri_ann.py [--bench] [--scale N] [--queries N] [--nprobe 1,2,4,8,16,32]
+
+import argparse
+import math
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+KMEANS_ITERATIONS = 12
+ASSIGN_CHUNK = 4096  # Rows scored against the centroids at once while clustering, bounding the score matrix
+
+
+class IVFIndex:
+    """
+    An inverted file index for maximum inner product search. Every row of the indexed matrix is in the list of the
+    centroid it has the highest inner product with, and the lists are stored back to back: the rows of list c are
+    order[offsets[c]:offsets[c + 1]]. The index only keeps row ids, scoring reads the vectors from the caller's
+    matrices, so it adds a few bytes per row. Never changed once built, so it can be shared between threads.
+    """
+
+    FILES = ('centroids', 'order', 'offsets')
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, lists: int = None, seed: int = 0) -> 'IVFIndex':
+        """Clusters the rows of vectors with spherical k-means, about sqrt(rows) lists by default."""
+        rows = len(vectors)
+        lists = max(1, min(lists or int(math.sqrt(rows)), rows))
+        centroids = _normalized(np.array(vectors[np.random.default_rng(seed).choice(rows, lists, replace=False)], dtype=np.float32))
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = _assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            empty = np.bincount(assignment, minlength=lists) == 0
+            sums[empty] = centroids[empty]  # An empty list keeps its centroid rather than vanishing
+            centroids = _normalized(sums)
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind='stable').astype(np.int32)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=lists)))).astype(np.int64)
+        return cls(centroids, order, offsets)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """The row ids in the nprobe lists whose centroids have the highest inner product with query."""
+        nprobe = min(nprobe, len(self.centroids))
+        closeness = self.centroids @ query
+        probed = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probed])
+
+    def save(self, directory: Path):
+        """Writes the index to a scratch directory and renames it into place, so readers never see half of one."""
+        scratch = directory.with_name('%s.%d.tmp' % (directory.name, os.getpid()))
+        try:
+            scratch.mkdir(parents=True, exist_ok=True)
+            for name in self.FILES:
+                np.save(scratch / (name + '.npy'), getattr(self, name))
+            os.replace(scratch, directory)
+        except OSError:  # Another process got there first, or the cache isn't writable
+            pass
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional['IVFIndex']:
+        """Loads a saved index memory mapped, or returns None if there isn't one."""
+        try:
+            return cls(*(np.load(directory / (name + '.npy'), mmap_mode='r') for name in cls.FILES))
+        except (OSError, ValueError):
+            return None
+
+
+def _normalized(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        assignment[start:start + ASSIGN_CHUNK] = np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return assignment
+
+
+def top_ids(ids: np.ndarray, scores: np.ndarray, num: int) -> np.ndarray:
+    """The num ids with the highest scores, best first, ties going to the lower id."""
+    if num < len(ids):
+        kept = np.argpartition(-scores, num - 1)[:num]
+        kth = scores[kept].min()
+        kept = np.flatnonzero(scores >= kth)  # Everything tied with the last one kept, so ties break by id below
+        ids, scores = ids[kept], scores[kept]
+    return ids[np.lexsort((ids, -scores))][:num]
+
+
+def benchmark(name_matrix: np.ndarray, desc_matrix: np.ndarray, queries: int, nprobes: Sequence[int], num: int = 10,
+              seed: int = 0):
+    """Prints the recall and latency of liked course queries at each nprobe, against exact scoring of every course."""
+    rng = np.random.default_rng(seed)
+    vectors = np.hstack((name_matrix, desc_matrix))
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors)
+    print('%d courses, %d lists, built in %.2fs' % (len(vectors), len(index.centroids), time.perf_counter() - start))
+    liked_lists = [rng.choice(len(vectors), rng.integers(1, 6), replace=False) for _ in range(queries)]
+    query_vectors = [np.concatenate((name_matrix[liked].mean(axis=0), 2 * desc_matrix[liked].mean(axis=0))) / 3
+                     for liked in liked_lists]
+    exact: List[set] = []
+    start = time.perf_counter()
+    for liked, query in zip(liked_lists, query_vectors):
+        scores = vectors @ query
+        scores[liked] = -np.inf
+        exact.append(set(top_ids(np.arange(len(vectors)), scores, num).tolist()))
+    print('%-8s %8s %10s %10s' % ('nprobe', 'recall', 'ms/query', 'scored'))
+    print('%-8s %8.3f %10.3f %10d' % ('exact', 1.0, (time.perf_counter() - start) / queries * 1e3, len(vectors)))
+    for nprobe in nprobes:
+        found, scored = 0, 0
+        start = time.perf_counter()
+        for liked, query, truth in zip(liked_lists, query_vectors, exact):
+            ids = index.candidates(query, nprobe)
+            scores = vectors[ids] @ query
+            scores[np.isin(ids, liked)] = -np.inf
+            found += len(truth.intersection(top_ids(ids, scores, num).tolist()))
+            scored += len(ids)
+        seconds = time.perf_counter() - start
+        print('%-8d %8.3f %10.3f %10d' % (nprobe, found / (num * queries), seconds / queries * 1e3, scored // queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds or benchmarks the recommender\'s nearest neighbour index.')
+    parser.add_argument('--bench', action='store_true', help='measure recall and latency instead of building')
+    parser.add_argument('--scale', type=int, default=1, help='benchmark on this many jittered copies of the catalog')
+    parser.add_argument('--queries', type=int, default=200, help='liked course lists to benchmark with')
+    parser.add_argument('--nprobe', default='1,2,4,8,16,32', help='comma separated numbers of lists to probe')
+    args = parser.parse_args()
+    import sameerpuri_context as spc
+    ctx = spc.context()
+    if not args.bench:
+        ctx.ann_index = ctx.build_ann_index()
+        print('Index of %d courses saved' % len(ctx.course_keys))
+        return
+    name_matrix, desc_matrix = np.asarray(ctx.course_name_matrix), np.asarray(ctx.course_desc_matrix)
+    if args.scale > 1:
+        rng = np.random.default_rng(1)
+        jitter = lambda m: _normalized((np.tile(m, (args.scale, 1)) + rng.normal(0, 0.02, (len(m) * args.scale, m.shape[1]))).astype(np.float32))
+        name_matrix, desc_matrix = jitter(name_matrix), jitter(desc_matrix)
+    benchmark(name_matrix, desc_matrix, args.queries, [int(n) for n in args.nprobe.split(',')])
+
+
+if __name__ == '__main__':
+    main()
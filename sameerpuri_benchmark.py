@@ -0,0 +1,604 @@
+#!/bin/python
+# Benchmarks the scheduler on a set of hard cases: majors with their open electives, foreign language tracks with long
+# prerequisite chains, and goal sets that may not fit in four years. Each case is timed, the number of search nodes is
+# reported, and any schedule found is checked against the catalog. A case that runs past the time limit is reported
+# as a timeout instead of holding up the rest.
+# With --check it runs each case both with and without merging equivalent courses instead, checks every schedule with
+# check_schedule and exits with status 1 if any has a problem or the two disagree on whether there is one. It first
+# compares the search, with every heuristic, with an exhaustive one on small catalogs, where every answer can be
+# checked, including whether there is no plan.
+# With --micro it instead times the value types the scheduler makes, Term and ScheduledCourse, reporting the time
+# and memory of each, and the time and peak memory per search node of every case.
+# With --workers it runs the portfolio scheduler on the cases whose time depends most on the heuristic instead, once
+# per number of workers given.
+# With --startup it measures each entry point in a fresh interpreter instead: the import time python -X importtime
+# reports for its module, and the time to answer a first request, which includes building whatever that request needs.
+# With --suite it runs a fixed corpus of scheduler and recommender requests instead, many times each, reporting latency
+# percentiles, peak memory and search nodes, and compares them with the baseline stored in benchmark_baseline.json,
+# exiting with status 1 if any got worse by more than the tolerance. --save-baseline stores the results instead.
+# With --scaling it runs the scheduler and the recommender on synthetic catalogs of each size given instead, see
+# sameerpuri_synthetic.py for the shape options, printing the time of each step per size and optionally a CSV of them.
+# Their vectors are computed with the spaCy model into a temporary cache, so it must be installed unless --no-recommender.
+# Usage: python sameerpuri_benchmark.py [--timeout SECONDS] [--no-equivalence] [--check] [--micro] [--workers 1,2,4,8]
+#                                      [--startup]
+#                                      [--suite [--save-baseline] [--baseline FILE] [--repeat N] [--tolerance 0.25]]
+#                                      [--scaling 1000,5000,20000 [--depth 4] [--width 2] [--requirements 0.06]
+#                                       [--both-terms 0.3] [--summer 0.05] [--seed 0] [--no-recommender] [--csv FILE]]
+#                                      [CASE ...]
+
+import argparse
+import contextlib
+import csv
+import gc
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import course_dictionary as cd
+import sameerpuri_context as spc
+import sameerpuri_scheduler as sps
+import sameerpuri_synthetic as spsy
+
+
+def courses(text: str) -> List[cd.Course]:
+    """Parses semicolon separated courses, e.g. 'CS major;JAPN 3891'."""
+    return [cd.Course(*course.split(' ')) for course in text.split(';') if course]
+
+
+# name: (goal conditions, initial state)
+CASES: Dict[str, Tuple[List[cd.Course], List[cd.Course]]] = {
+    'cs_major_japn': (courses('CS major;JAPN 3891'), courses('CS 1101')),
+    'cs_major_empty': (courses('CS major'), courses('')),
+    'cs_major_two_languages': (courses('CS major;JAPN 3891;CHIN 3302'), courses('CS 1101')),
+    'cs_major_chin_ger': (courses('CS major;CHIN 4401;GER 4576'), courses('')),
+    'deep_mix': (courses('CE 4951;CHBE 4951W;MATH 4710;CS 4287'), courses('')),
+    'cs_major_deep': (courses('CS major;MATH 4710;CS 4287;CHEM 4230'), courses('')),
+    'cs_major_many': (courses('CS major;JAPN 3891;MATH 4710;CE 4951;CHBE 4951W'), courses('CS 1101')),
+    'cs_major_courses': (courses('CS major;CS 3282;CS 4285;CS 4287;CS 4269;CS 4279'), courses('CS 1101;MATH 1300')),
+    'cs_major_loaded': (courses('CS major;CHBE 3200;PSCI 3235;BSSN 4200;GER 2321;BSCI 3256;DIV 2717;LAT 3040;REL 3336;'
+                                'ECON 4220'), courses('CS 1101')),
+    'cs_major_ten_goals_a': (courses('CS major;CHEM 3315;BSCI 3258;CHBE 4830;NSC 3245;ENVE 4610;CHBE 4850;PORT 3301;'
+                                     'DIV 3351;HIST 2457'), courses('CS 1101')),
+    'cs_major_ten_goals_b': (courses('CS major;ECON 3110;RLST 3753;CS 2212;PORT 4350;ARTS 2102;CHIN 3302;RLST 4593;'
+                                     'MUED 2160;MHS 3050W'), courses('CS 1101')),
+    'cs_major_ten_goals_c': (courses('CS major;ECON 4110;HODI 3260;PORT 4420;HODL 3204;CHBE 3250;SSED 3900;HOD 2051;'
+                                     'MUTH 3110;ECON 3020'), courses('CS 1101')),
+}
+
+# A catalog the search once found no plan for although there is one: it met P 1003 with the clause of P 1002, already
+# required as a goal, which puts P 1003 after P 1002 and leaves no term for P 1006. Taking P 1003 right after P 1000
+# fits: Fall 1 P 1000, Spring 1 P 1001 and P 1003, Fall 2 P 1005, Spring 2 P 1002, Fall 3 P 1004, Fall 4 P 1006.
+# (credits, terms, prereqs) by number, goals
+SMALL_CASES: Dict[str, Tuple[Dict[int, Tuple[str, Tuple[str, ...], Tuple[Tuple[int, ...], ...]]], List[int]]] = {
+    'free_clause_too_late': ({1000: ('9', ('Fall',), ()),
+                              1001: ('6', ('Fall', 'Spring'), ((1000,),)),
+                              1002: ('6', ('Spring',), ((1001, 1000), (1001,))),
+                              1003: ('9', ('Spring',), ((1000,), (1002,))),
+                              1004: ('9', ('Fall',), ((1002,),)),
+                              1005: ('6', ('Fall',), ((1004, 1003), (1003,))),
+                              1006: ('18', ('Fall',), ((1004,), (1003, 1004)))},
+                             [1006, 1003, 1005, 1002]),
+}
+# Random catalogs like it that --check compares with an exhaustive search
+SMALL_CATALOGS = 1000
+SMALL_CATALOG_SIZE = 7
+
+# The cases whose search time depends most on the heuristic, for the portfolio benchmark
+PORTFOLIO_CASES = ['cs_major_many', 'cs_major_loaded', 'cs_major_ten_goals_a', 'cs_major_ten_goals_b',
+                   'cs_major_ten_goals_c']
+
+
+# name: (module imported, first request made with it imported as m)
+ENTRY_POINTS: Dict[str, Tuple[str, str]] = {
+    'scheduler': ('sameerpuri_scheduler', "m.course_scheduler(spc.context().course_dict, [cd.Course('CS', '3251')], "
+                                          "[cd.Course('CS', '1101')])"),
+    'recommender': ('sameerpuri_recommender', "m.recommend_courses_using_liked_courses([cd.Course('CS', '2201')], 10)"),
+    'search': ('sameerpuri_recommender', "m.recommend_courses_using_search_text('japanese language', 10)"),
+    'flaskui_scheduler': ('sameerpuri_flaskui', "m.app.test_client().post('/scheduler', data={'initial_state': 'CS 1101', "
+                                                "'goal_conditions': 'CS 3251'})"),
+    'flaskui_recommender': ('sameerpuri_flaskui', "m.app.test_client().post('/recommender', data={'num': '10', "
+                                                  "'courses': 'CS 2201'})"),
+}
+
+_STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import %s as m
+imported = time.perf_counter()
+import json, course_dictionary as cd, sameerpuri_context as spc
+%s
+print(json.dumps({'import': imported - start, 'first': time.perf_counter() - imported}))
+"""
+
+
+# The benchmark suite: scheduler cases from CASES that finish well within any timeout, so their node counts are exact,
+# and the recommender requests of its command line examples
+SUITE_SCHEDULER_CASES = ['cs_major_japn', 'cs_major_empty', 'cs_major_two_languages', 'cs_major_chin_ger', 'deep_mix',
+                         'cs_major_deep', 'cs_major_courses', 'cs_major_loaded']
+SUITE_LIKED_COURSES = {
+    'liked_cs_bus': (courses('CS 2201;EECE 2116;SC 3260;EES 4760;CS 3251;CS 2231;CS 4260;CS 3281;CS 3270;BUS 2100;BUS 2400'), 20),
+    'liked_cs': (courses('CS 2201;CS 3251'), 10),
+}
+SUITE_SEARCHES = {'search_japanese': ('japanese language', 10), 'search_chemistry': ('organic chemistry laboratory', 10)}
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# Slack on top of the relative tolerance, so timer noise on requests taking a millisecond or two isn't a regression
+LATENCY_SLACK = 0.002
+MEMORY_SLACK = 64 * 1024
+
+
+class CaseTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise CaseTimeout()
+
+
+def run_case(course_dict: Dict[cd.Course, cd.CourseInfo], goal_conditions: List[cd.Course],
+             initial_state: List[cd.Course], timeout: float, merge_equivalent: bool = True) -> dict:
+    """Schedules one case, returning its outcome ('solved', 'no plan' or 'timeout'), time, nodes and problems."""
+    search = sps.ScheduleSearch(course_dict, goal_conditions, initial_state, merge_equivalent)
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    try:
+        outcome = 'solved' if search.run() else 'no plan'  # Not a proof that there is none
+    except CaseTimeout:
+        outcome = 'timeout'
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+    seconds = time.perf_counter() - start
+    problems = []
+    if outcome == 'solved':
+        schedule = sps.to_schedule_dict(course_dict, search.plan(), initial_state)  # The plan this search found
+        problems = sps.check_schedule(course_dict, schedule, goal_conditions, initial_state)
+    return {'outcome': outcome, 'seconds': seconds, 'nodes': search.nodes, 'problems': problems}
+
+
+def check_cases(course_dict: Dict[cd.Course, cd.CourseInfo], names: List[str], timeout: float) -> int:
+    """
+    Runs each case with and without merging equivalent courses and checks every schedule found with check_schedule,
+    printing what's wrong. Returns 1 if a schedule has problems or the two searches disagree on whether one exists.
+    """
+    failed = 0
+    print('%-24s %-10s %-10s %s' % ('case', 'merged', 'separate', 'problems'))
+    for name in names:
+        goal_conditions, initial_state = CASES[name]
+        merged, separate = (run_case(course_dict, goal_conditions, initial_state, timeout, merge_equivalent)
+                            for merge_equivalent in (True, False))
+        errors = ['%s: %s' % (label, problem) for label, result in (('merged', merged), ('separate', separate))
+                  for problem in result['problems']]
+        if 'timeout' not in (merged['outcome'], separate['outcome']) and merged['outcome'] != separate['outcome']:
+            errors.append('merged is %s but separate is %s' % (merged['outcome'], separate['outcome']))
+        print('%-24s %-10s %-10s %s' % (name, merged['outcome'], separate['outcome'], '; '.join(errors) or 'ok'))
+        failed |= bool(errors)
+    return int(failed)
+
+
+def small_catalog(courses: Dict[int, Tuple[str, Tuple[str, ...], Tuple[Tuple[int, ...], ...]]]) -> Dict[cd.Course, cd.CourseInfo]:
+    """Makes a catalog of courses in program P from (credits, terms, prereqs) by number."""
+    return {cd.Course('P', str(n)): cd.CourseInfo(credits, terms, tuple(tuple(cd.Course('P', str(req)) for req in clause)
+                                                                        for clause in prereqs))
+            for n, (credits, terms, prereqs) in courses.items()}
+
+
+def random_small_case(seed: int, size: int = SMALL_CATALOG_SIZE) -> Tuple[Dict[cd.Course, cd.CourseInfo], List[cd.Course]]:
+    """
+    A random catalog of size heavy courses in a few chains, each needing one of the two courses before it and maybe
+    another earlier one, so terms fill up and the order of clauses matters, and a few of its courses as goals.
+    """
+    rng = random.Random(seed)
+    courses = {}
+    for i in range(size):
+        clauses = set()
+        for _ in range(rng.randint(1, 2) if i else 0):
+            clause = {1000 + rng.randrange(max(0, i - 2), i)}
+            if rng.random() < 0.5:
+                clause.add(1000 + rng.randrange(i))
+            clauses.add(tuple(sorted(clause, reverse=True)))
+        courses[1000 + i] = (rng.choice(('6', '6', '9', '9', '18')), rng.choice((('Fall',), ('Spring',), ('Fall', 'Spring'))),
+                             tuple(sorted(clauses)))
+    return small_catalog(courses), [cd.Course('P', str(n)) for n in rng.sample(sorted(courses), rng.randint(3, 5))]
+
+
+def exhaustive_schedule(course_dict: Dict[cd.Course, cd.CourseInfo],
+                        goal_conditions: List[cd.Course]) -> Optional[Dict[cd.Course, cd.CourseInfo]]:
+    """
+    Finds a schedule by trying every term, or not taking it, for every course of a tiny catalog whose prereqs come
+    before the courses needing them. Returns None if there is none. Summer isn't used, as in the scheduler.
+    """
+    courses = list(course_dict)
+    term_of: Dict[cd.Course, int] = {}
+    hours = [0] * (sps.MAX_TERM + 1)
+
+    def place(i: int) -> bool:
+        if i == len(courses):
+            return True
+        course = courses[i]
+        info = course_dict[course]
+        if course not in goal_conditions and place(i + 1):
+            return True
+        for height in range(1, sps.MAX_TERM + 1):
+            if sps.height_to_term(height).semester.name not in info.terms or hours[height] + int(info.credits) > sps.MAX_HOURS:
+                continue
+            if info.prereqs and not any(all(term_of.get(req, sps.MAX_TERM + 1) < height for req in clause)
+                                        for clause in info.prereqs):
+                continue
+            term_of[course] = height
+            hours[height] += int(info.credits)
+            if place(i + 1):
+                return True
+            del term_of[course]
+            hours[height] -= int(info.credits)
+        return False
+    if not place(0):
+        return None
+    return {course: cd.CourseInfo(course_dict[course].credits, sps.height_to_term(height), course_dict[course].prereqs)
+            for course, height in term_of.items()}
+
+
+def check_small_cases(count: int) -> int:
+    """
+    Compares ScheduleSearch, with and without merging equivalent courses and with every heuristic, with an exhaustive
+    search on SMALL_CASES and count random catalogs, printing every disagreement. Returns 1 if there was one.
+    """
+    searches = [('merged', {}), ('separate', {'merge_equivalent': False})]
+    searches += [(heuristic.name, {'heuristic': heuristic}) for heuristic in sps.HEURISTICS[1:]]
+    cases = [(name, small_catalog(courses), [cd.Course('P', str(n)) for n in goals])
+             for name, (courses, goals) in SMALL_CASES.items()]
+    cases += [('random %d' % seed,) + random_small_case(seed) for seed in range(count)]
+    failed = 0
+    for name, course_dict, goal_conditions in cases:
+        expected = exhaustive_schedule(course_dict, goal_conditions)
+        assert expected is None or not sps.check_schedule(course_dict, expected, goal_conditions, [])
+        for label, options in searches:
+            search = sps.ScheduleSearch(course_dict, goal_conditions, [], **options)
+            found = search.run()
+            if found:
+                problems = sps.check_schedule(course_dict, sps.to_schedule_dict(course_dict, search.plan(), []),
+                                              goal_conditions, [])
+            else:
+                problems = [] if expected is None else ['no plan found, but there is one']
+            if found and expected is None:
+                problems.append('a plan was found, but the exhaustive search has none')
+            if problems:
+                print('%-24s %-10s %s' % (name, label, '; '.join(problems)))
+                failed = 1
+    print('%d small catalogs, %s' % (len(cases), 'disagreements above' if failed else 'all agree'))
+    return failed
+
+
+def retained_bytes(make, count: int = 10000) -> float:
+    """The memory that each object made by make keeps allocated, on average over count of them."""
+    tracemalloc.start()
+    try:
+        kept = [None] * count
+        base = tracemalloc.get_traced_memory()[0]
+        for i in range(count):
+            kept[i] = make()
+        return (tracemalloc.get_traced_memory()[0] - base) / count
+    finally:
+        tracemalloc.stop()
+
+
+def micro_benchmark(course_dict: Dict[cd.Course, cd.CourseInfo], names: List[str]):
+    """Prints the time and retained memory of making the scheduler's value types, then the cost per node of each case."""
+    info = course_dict[cd.Course('CS', '1101')]
+    makers = [('Term()', lambda: sps.Term(sps.Semester.Fall, sps.Year.Junior)),
+              ('Term.initFromTermNo()', lambda: sps.Term.initFromTermNo(7)),
+              ('height_to_term()', lambda: sps.height_to_term(5)),
+              ('ScheduledCourse()', lambda: sps.ScheduledCourse(cd.Course('CS', '1101'), info, sps.height_to_term(1), []))]
+    print('%-24s %10s %10s' % ('operation', 'ns/call', 'bytes/obj'))
+    for name, make in makers:
+        timer = timeit.Timer(make)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(3, number)) / number
+        print('%-24s %10.0f %10.1f' % (name, seconds * 1e9, retained_bytes(make)))
+    print()
+    print('%-24s %10s %10s %8s' % ('case', 'us/node', 'peak KiB', 'nodes'))
+    for name in names:
+        goal_conditions, initial_state = CASES[name]
+        sps.course_scheduler(course_dict, goal_conditions, initial_state)  # Warm the prereq index
+        start = time.perf_counter()
+        search = sps.ScheduleSearch(course_dict, goal_conditions, initial_state)
+        if search.run():
+            search.plan()
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        search = sps.ScheduleSearch(course_dict, goal_conditions, initial_state)
+        if search.run():
+            search.plan()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-24s %10.1f %10.1f %8d' % (name, seconds / search.nodes * 1e6, peak / 1024, search.nodes))
+
+
+def portfolio_benchmark(course_dict: Dict[cd.Course, cd.CourseInfo], names: List[str], worker_counts: List[int],
+                        timeout: float):
+    """Prints the time the portfolio scheduler takes on each case with each number of workers."""
+    print('%-24s %7s %-10s %9s  %s' % ('case', 'workers', 'outcome', 'seconds', 'heuristic'))
+    for name in names:
+        goal_conditions, initial_state = CASES[name]
+        for workers in worker_counts:
+            schedule, report = sps.portfolio_scheduler(course_dict, goal_conditions, initial_state, workers, timeout)
+            outcome = 'timeout' if report['exhausted'] else 'solved' if report['found'] else 'no plan'
+            print('%-24s %7d %-10s %9.3f  %s' % (name, report['workers'], outcome, report['seconds'], report['heuristic']))
+
+
+def measure_startup(module: str, first_request: str) -> dict:
+    """Runs an entry point in a fresh interpreter, returning its import times and time to answer a first request."""
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', _STARTUP_SCRIPT % (module, first_request)],
+                             capture_output=True, text=True, check=True)
+    total = time.perf_counter() - start
+    # Lines of -X importtime look like 'import time:   self [us] | cumulative | package', nested packages indented
+    importtime = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                importtime[name.strip()] = int(cumulative) / 1e6
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    return {'importtime': importtime.get(module, 0.0), 'import': timings['import'], 'first': timings['first'],
+            'total': total, 'heaviest': sorted((name for name in importtime if '.' not in name and name not in (module, 'site')),
+                                               key=importtime.get, reverse=True)[:3]}
+
+
+def startup_benchmark(names: List[str], runs: int = 3):
+    """Prints the median import time, time to first response and process lifetime of each entry point."""
+    print('%-20s %11s %11s %11s  %s' % ('entry point', 'import s', 'first s', 'process s', 'heaviest imports'))
+    for name in names:
+        module, first_request = ENTRY_POINTS[name]
+        results = [measure_startup(module, first_request) for _ in range(runs)]
+        median = lambda key: statistics.median(result[key] for result in results)
+        print('%-20s %11.3f %11.3f %11.3f  %s' % (name, median('importtime'), median('first'), median('total'),
+                                                   ', '.join(results[-1]['heaviest'])))
+
+
+def suite_requests() -> Dict[str, object]:
+    """The requests of the benchmark suite as functions of no arguments, returning the search nodes or None."""
+    import sameerpuri_recommender as spr
+    course_dict = spc.context().course_dict
+
+    def schedule(goal_conditions, initial_state):
+        search = sps.ScheduleSearch(course_dict, goal_conditions, initial_state)
+        if search.run():
+            sps.to_schedule_dict(course_dict, search.plan(), initial_state)
+        return search.nodes
+    requests = {}
+    for name in SUITE_SCHEDULER_CASES:
+        requests[name] = lambda case=CASES[name]: schedule(*case)
+    for name, (liked, num) in SUITE_LIKED_COURSES.items():
+        requests[name] = lambda liked=liked, num=num: spr.recommend_courses_using_liked_courses(liked, num) and None
+    for name, (text, num) in SUITE_SEARCHES.items():
+        requests[name] = lambda text=text, num=num: spr.recommend_courses_using_search_text(text, num) and None
+    return requests
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """The nearest rank percentile of sorted values."""
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def run_suite(repeat: int) -> Dict[str, dict]:
+    """Runs every request of the suite once to warm up, then repeat times timed and once more for its peak memory."""
+    results = {}
+    for name, run in suite_requests().items():
+        nodes = run()
+        seconds = []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        seconds.sort()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {'p50': percentile(seconds, 0.5), 'p90': percentile(seconds, 0.9),
+                         'p99': percentile(seconds, 0.99), 'peak_bytes': peak, 'nodes': nodes}
+    return results
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Describes every way results are worse than the baseline: more nodes, or slower or bigger beyond the tolerance."""
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['nodes'] is not None and base['nodes'] is not None and result['nodes'] > base['nodes']:
+            found.append('%s: %d nodes, baseline %d' % (name, result['nodes'], base['nodes']))
+        for key in ('p50', 'p90'):
+            if result[key] > base[key] * (1 + tolerance) + LATENCY_SLACK:
+                found.append('%s: %s %.4fs, baseline %.4fs' % (name, key, result[key], base[key]))
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance) + MEMORY_SLACK:
+            found.append('%s: peak %d bytes, baseline %d' % (name, result['peak_bytes'], base['peak_bytes']))
+    return found
+
+
+def suite_benchmark(repeat: int, baseline_path: str, save: bool, tolerance: float) -> int:
+    """Runs the suite, then saves it as the baseline or compares it with the baseline. Returns the exit status."""
+    results = run_suite(repeat)
+    try:
+        with open(baseline_path) as stored:
+            baseline = json.load(stored)['results']
+    except (OSError, ValueError, KeyError):
+        baseline = {}
+    print('%-24s %9s %9s %9s %10s %8s  %s' % ('request', 'p50 ms', 'p90 ms', 'p99 ms', 'peak KiB', 'nodes', 'baseline p50 ms'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        print('%-24s %9.2f %9.2f %9.2f %10.1f %8s  %s' % (
+            name, result['p50'] * 1e3, result['p90'] * 1e3, result['p99'] * 1e3, result['peak_bytes'] / 1024,
+            '-' if result['nodes'] is None else result['nodes'], '-' if base is None else '%.2f' % (base['p50'] * 1e3)))
+    if save:
+        with open(baseline_path, 'w') as stored:
+            json.dump({'python': sys.version.split()[0], 'repeat': repeat, 'results': results}, stored, indent=2, sort_keys=True)
+            stored.write('\n')
+        print('Saved baseline to %s' % baseline_path)
+        return 0
+    if not baseline:
+        print('No baseline in %s, run with --save-baseline first' % baseline_path)
+        return 0
+    found = regressions(results, baseline, tolerance)
+    for regression in found:
+        print('REGRESSION ' + regression)
+    return 1 if found else 0
+
+
+SCALING_SEARCH = 'history of computation'
+
+
+@contextlib.contextmanager
+def scratch_vector_cache():
+    """Points the vector cache at a temporary directory for the duration, so synthetic catalogs stay out of nlp_cache."""
+    import sameerpuri_vectorcache as spv
+    cache_dir = spv.CACHE_DIR
+    with tempfile.TemporaryDirectory(prefix='nlp_cache.') as scratch:
+        spv.CACHE_DIR = Path(scratch)
+        try:
+            yield
+        finally:
+            spv.CACHE_DIR = cache_dir
+
+
+def scaling_benchmark(sizes: List[int], shape: spsy.CatalogShape, timeout: float, repeat: int, recommender: bool,
+                      csv_path: str = None):
+    """
+    Prints, for a synthetic catalog of each size, the time to build its prerequisite index, the outcome, time and
+    nodes of scheduling the first program's major alone and with the deepest course of the second, and unless
+    recommender is off the time to compute its vectors and the median time of a liked course and a search request.
+    The vectors are computed with the spaCy model every time, into a temporary cache removed afterwards.
+    """
+    import numpy as np
+    import sameerpuri_prereqs as spq
+    import sameerpuri_recommender as spr
+    if recommender:
+        import spacy
+        if not spacy.util.is_package(spr.MODEL_NAME):
+            sys.exit('The recommender needs the spaCy model %s to compute vectors of synthetic catalogs, install it or '
+                     'pass --no-recommender' % spr.MODEL_NAME)
+    columns = ['courses', 'generate_s', 'index_s', 'major', 'major_s', 'major_nodes', 'deep', 'deep_s', 'deep_nodes']
+    if recommender:
+        columns += ['vectors_s', 'liked_ms', 'search_ms']
+    rows = []
+    print(' '.join('%11s' % column for column in columns))
+    for size in sizes:
+        start = time.perf_counter()
+        course_dict, course_descs = spsy.generate_catalog(shape._replace(courses=size))
+        row = {'courses': len(course_dict), 'generate_s': time.perf_counter() - start}
+        start = time.perf_counter()
+        spq.prereq_index(course_dict)
+        row['index_s'] = time.perf_counter() - start
+        major = cd.Course(spsy.program_name(0), 'major')
+        deepest = cd.Course(spsy.program_name(1 if size > spsy.COURSES_PER_PROGRAM else 0), '%d000' % (shape.depth + 1))
+        for name, goal_conditions in (('major', [major]), ('deep', [major, deepest])):
+            result = run_case(course_dict, goal_conditions, [], timeout)
+            row.update({name: result['outcome'], name + '_s': result['seconds'], name + '_nodes': result['nodes']})
+        if recommender:
+            with scratch_vector_cache(), spc.using(spc.catalog_context(course_dict, course_descs)) as ctx:
+                start = time.perf_counter()
+                ctx.course_desc_matrix
+                if len(ctx.course_keys) >= spr.ANN_MIN_COURSES:
+                    ctx.ann_index
+                row['vectors_s'] = time.perf_counter() - start
+                liked = [ctx.course_keys[i] for i in np.random.default_rng(shape.seed).choice(len(ctx.course_keys), 3)]
+                for name, request in (('liked_ms', lambda: spr.recommend_courses_using_liked_courses(liked, 10)),
+                                      ('search_ms', lambda: spr.recommend_courses_using_search_text(SCALING_SEARCH, 10))):
+                    request()
+                    seconds = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        request()
+                        seconds.append(time.perf_counter() - start)
+                    row[name] = statistics.median(seconds) * 1e3
+        rows.append(row)
+        print(' '.join('%11.3f' % row[column] if isinstance(row[column], float) else '%11s' % row[column]
+                       for column in columns))
+        spq.prereq_indexes.discard(course_dict)  # So the next size is measured without this catalog resident
+        sps.filler_pools.discard(course_dict)
+        del course_dict, course_descs
+        gc.collect()
+    if csv_path:
+        with open(csv_path, 'w', newline='') as out:
+            writer = csv.DictWriter(out, columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the scheduler on hard cases.')
+    parser.add_argument('cases', nargs='*', help='cases to run, all by default: ' + ', '.join(CASES))
+    parser.add_argument('--timeout', type=float, default=10, help='seconds allowed per case')
+    parser.add_argument('--no-equivalence', action='store_true', help='branch on interchangeable courses separately')
+    parser.add_argument('--workers', help='run the portfolio scheduler with these comma separated worker counts')
+    parser.add_argument('--check', action='store_true',
+                        help='check the schedules found with and without --no-equivalence, exiting with status 1 on a problem')
+    parser.add_argument('--micro', action='store_true', help='time the value types and the cost per search node')
+    parser.add_argument('--startup', action='store_true',
+                        help='time importing and answering a first request for these entry points: ' + ', '.join(ENTRY_POINTS))
+    parser.add_argument('--suite', action='store_true', help='run the fixed suite and compare it with the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store the suite results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file of the suite')
+    parser.add_argument('--repeat', type=int, default=15, help='timed runs of each suite request')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slowdown or growth allowed over the baseline')
+    parser.add_argument('--scaling', help='run on synthetic catalogs of these comma separated sizes')
+    defaults = spsy.CatalogShape()
+    parser.add_argument('--depth', type=int, default=defaults.depth, help='levels of prerequisites of synthetic catalogs')
+    parser.add_argument('--width', type=int, default=defaults.width, help='most clauses and courses per clause')
+    parser.add_argument('--requirements', type=float, default=defaults.requirements, help='part that are requirement nodes')
+    parser.add_argument('--both-terms', type=float, default=defaults.both_terms, help='part offered in Fall and Spring')
+    parser.add_argument('--summer', type=float, default=defaults.summer, help='part also offered in Summer')
+    parser.add_argument('--seed', type=int, default=defaults.seed, help='seed of synthetic catalogs')
+    parser.add_argument('--no-recommender', action='store_true', help='only run the scheduler on synthetic catalogs')
+    parser.add_argument('--csv', help='write the scaling results to this CSV file')
+    args = parser.parse_args()
+    if args.scaling:
+        shape = spsy.CatalogShape(width=args.width, depth=args.depth, requirements=args.requirements,
+                                  both_terms=args.both_terms, summer=args.summer, seed=args.seed)
+        scaling_benchmark([int(n) for n in args.scaling.split(',')], shape, args.timeout, args.repeat,
+                          not args.no_recommender, args.csv)
+        return
+    if args.suite:
+        sys.exit(suite_benchmark(args.repeat, args.baseline, args.save_baseline, args.tolerance))
+    if args.startup:
+        for name in args.cases:
+            if name not in ENTRY_POINTS:
+                parser.error('unknown entry point %s' % name)
+        startup_benchmark(args.cases or list(ENTRY_POINTS))
+        return
+    for name in args.cases:
+        if name not in CASES:
+            parser.error('unknown case %s' % name)
+    course_dict = spc.context().course_dict
+    if args.check:
+        sys.exit(check_small_cases(SMALL_CATALOGS) | check_cases(course_dict, args.cases or list(CASES), args.timeout))
+    if args.micro:
+        micro_benchmark(course_dict, args.cases or list(CASES))
+        return
+    if args.workers:
+        portfolio_benchmark(course_dict, args.cases or PORTFOLIO_CASES, [int(n) for n in args.workers.split(',')],
+                            args.timeout)
+        return
+    print('%-24s %-10s %9s %8s  %s' % ('case', 'outcome', 'seconds', 'nodes', 'problems'))
+    for name in args.cases or CASES:
+        goal_conditions, initial_state = CASES[name]
+        result = run_case(course_dict, goal_conditions, initial_state, args.timeout, not args.no_equivalence)
+        print('%-24s %-10s %9.3f %8d  %s' % (name, result['outcome'], result['seconds'], result['nodes'],
+                                              '; '.join(result['problems']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# The state every entry point shares, the course catalog and everything built from it, created on first use instead of
+# at import. Importing a module of the project does no work beyond defining things, so a script that only schedules
+# never parses course descriptions, and one that only recommends never builds the prerequisite index. Whichever entry
+# point needs a piece first builds it, and the rest reuse it.
+# Usage: ctx = context(); ctx.course_dict, ctx.course_desc_matrix, ...
+#        with using(catalog_context(course_dict, course_descs)): ... for another catalog
+
+import contextlib
+import os
+import threading
+from typing import Dict, List
+
+import course_dictionary as cd
+
+
+class lazy_property:
+    """
+    A property computed on first access and then stored on the instance, so later reads are plain attribute lookups.
+    Computing it holds the instance's lock, so threads racing for it get the same value and it is only built once.
+    The lock is reentrant, so one lazy property can use another. Assigning the attribute replaces the value.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with instance._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.build(instance)
+            return instance.__dict__[self.name]
+
+
+class CatalogContext:
+    """
+    The catalog and everything derived from it, each built on first use. The heavy modules are only imported by the
+    properties that need them. Several contexts can exist, e.g. for another catalog in a benchmark, but entry points
+    share the one context() returns.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    @lazy_property
+    def course_dict(self) -> Dict[cd.Course, cd.CourseInfo]:
+        return cd.create_course_dict()
+
+    @lazy_property
+    def course_descs(self) -> dict:
+        import sameerpuri_matcher as spm
+        return spm.create_course_desc_dict(self.course_dict)
+
+    @lazy_property
+    def prereq_index(self):
+        import sameerpuri_prereqs as spq
+        return spq.prereq_index(self.course_dict)
+
+    # The recommender's vectors. Row i of each matrix holds the vector of course_keys[i].
+    @lazy_property
+    def course_keys(self) -> List[cd.Course]:
+        return list(self.course_descs.keys())
+
+    @lazy_property
+    def course_index(self) -> Dict[cd.Course, int]:
+        return {course: i for i, course in enumerate(self.course_keys)}
+
+    @lazy_property
+    def vectors_key(self) -> str:
+        import sameerpuri_recommender as spr
+        import sameerpuri_vectorcache as spv
+        return spv.cache_key(self.course_descs, spr.MODEL_NAME)
+
+    @lazy_property
+    def course_vectors(self):
+        """The (description, name) matrices, from the vector cache or computed with the spaCy model on a miss."""
+        import sameerpuri_recommender as spr
+        return spr.load_course_vectors(self)
+
+    @lazy_property
+    def course_desc_matrix(self):
+        return self.course_vectors[0]
+
+    @lazy_property
+    def course_name_matrix(self):
+        return self.course_vectors[1]
+
+    @lazy_property
+    def nlp(self):
+        """
+        The spaCy model, only needed when the vector cache is cold or to render dependency trees. Every context uses
+        the same one, since it doesn't depend on the catalog.
+        """
+        global _nlp
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                import sameerpuri_recommender as spr
+                print('Reading english word vector information...')
+                _nlp = spacy.load(spr.MODEL_NAME)
+            return _nlp
+
+    @lazy_property
+    def course_nlp_descs(self) -> dict:
+        """The parsed descriptions, only loaded to render dependency trees."""
+        import sameerpuri_vectorcache as spv
+        docs = spv.load_docs(self.vectors_key, self.nlp.vocab)
+        if docs is None:  # Cache was cleared since startup
+            docs = list(self.nlp.pipe(self.course_descs[course].summary for course in self.course_keys))
+        return dict(zip(self.course_keys, docs))
+
+    @lazy_property
+    def word_vectors(self):
+        """The model's word vectors that search text can use."""
+        import sameerpuri_recommender as spr
+        import sameerpuri_vectorcache as spv
+        import sameerpuri_wordvectors as spw
+        return spw.WordVectors.load(spv.word_vectors_path(self.vectors_key)) or spr.export_word_vectors(self)
+
+    @lazy_property
+    def search_index(self):
+        """Keyword index of course names and summaries."""
+        import sameerpuri_recommender as spr
+        import sameerpuri_search as spse
+        return spse.BM25Index(((self.course_descs[course].name, self.course_descs[course].summary) for course in self.course_keys),
+                              (spr.SEARCH_NAME_WEIGHT, 1.0))
+
+    @lazy_property
+    def ann_index(self):
+        """Nearest neighbour index of the name and description vectors, built and saved if the cache has none."""
+        import sameerpuri_ann as spa
+        import sameerpuri_vectorcache as spv
+        return spa.IVFIndex.load(spv.ann_path(self.vectors_key)) or self.build_ann_index()
+
+    def build_ann_index(self):
+        import numpy as np
+        import sameerpuri_ann as spa
+        import sameerpuri_vectorcache as spv
+        index = spa.IVFIndex.build(np.hstack((self.course_name_matrix, self.course_desc_matrix)))
+        index.save(spv.ann_path(self.vectors_key))
+        return index
+
+    # Results of repeated requests, keyed by their sorted and deduplicated courses. Set RESULT_CACHE_DB to a file to keep
+    # them across restarts and share them between workers. Anything computed from another catalog is never returned.
+    @lazy_property
+    def result_cache(self):
+        import sameerpuri_resultcache as sprc
+        return sprc.ResultCache(sprc.catalog_version(self.vectors_key),
+                                max_entries=int(os.environ.get('RESULT_CACHE_SIZE', '1024')),
+                                ttl=float(os.environ.get('RESULT_CACHE_TTL', '3600')),
+                                path=os.environ.get('RESULT_CACHE_DB') or None)
+
+
+_context: CatalogContext = None
+_context_lock = threading.Lock()
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def context() -> CatalogContext:
+    """The context every entry point shares, created on the first call."""
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = CatalogContext()
+    return _context
+
+
+@contextlib.contextmanager
+def using(ctx: CatalogContext):
+    """
+    Makes context() return ctx inside the with block, so the entry points work on another catalog, e.g. a synthetic
+    one in a benchmark. The switch is seen by every thread, so it is not for use while serving requests.
+    """
+    global _context
+    previous, _context = _context, ctx
+    try:
+        yield ctx
+    finally:
+        _context = previous
+
+
+def catalog_context(course_dict: Dict[cd.Course, cd.CourseInfo], course_descs: dict) -> CatalogContext:
+    """A context of another catalog, built from it the same way the shared one is built from the xlsx."""
+    ctx = CatalogContext()
+    ctx.course_dict = course_dict
+    ctx.course_descs = course_descs
+    return ctx
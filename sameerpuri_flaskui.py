@@ -1,4 +1,8 @@
-from flask import Flask, jsonify, render_template, request
+import json
+import os
+import threading
+from collections import OrderedDict
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 from typing import List, Tuple
 import course_dictionary as cd
 
@@ -6,22 +10,36 @@ import click
 click.disable_unicode_literals_warning = True
 
 import sameerpuri_scheduler as sps
+import sameerpuri_context as spc
+import sameerpuri_jobs as spj
 import sameerpuri_matcher as spm
+import sameerpuri_preload as spp
 import sameerpuri_recommender as spr
+import sameerpuri_resultcache as sprc
+import sameerpuri_trace as spt
 
 app = Flask(__name__)
 
-course_dict = cd.create_course_dict()
-course_desc_dict = spm.create_course_desc_dict(course_dict)
+# The catalog, vectors and result cache, built by whichever request needs them first and shared with the scripts
+ctx = spc.context()
+
+# Seconds a schedule search may take before the best partial plan is returned, so slow searches can't hold a worker
+SCHEDULER_TIME_BUDGET = float(os.environ.get('SCHEDULER_TIME_BUDGET', '5'))
+
+# The latest schedules made, by (goal conditions, initial state), so a slightly changed request can repair one of them
+RECENT_SCHEDULES_SIZE = 128
+recent_schedules: 'OrderedDict[Tuple, dict]' = OrderedDict()
+recent_schedules_lock = threading.Lock()
+
 
 
 @app.route('/course/<program>/<int:designation>/<reqtype>')
 def get_course_desc(program: str, designation: int, reqtype: str):
     res = {
-        'summary': lambda course: course_desc_dict[course].summary,
-        'name': lambda course: course_desc_dict[course].name,
-        'formerly': lambda course: course_desc_dict[course].formerly,
-        'creditbracket': lambda course: course_desc_dict[course].creditbracket
+        'summary': lambda course: ctx.course_descs[course].summary,
+        'name': lambda course: ctx.course_descs[course].name,
+        'formerly': lambda course: ctx.course_descs[course].formerly,
+        'creditbracket': lambda course: ctx.course_descs[course].creditbracket
     }[reqtype](cd.Course(program, str(designation)))
     return jsonify(res)
 
@@ -38,8 +56,8 @@ def informer():
     course_info: spm.CourseDesc = None
     if request.method == 'POST':
         form_course: cd.Course = cd.Course(request.form['program'].strip(), request.form['designation'].strip())
-        if form_course in course_desc_dict:
-            course_info = course_desc_dict[form_course]
+        if form_course in ctx.course_descs:
+            course_info = ctx.course_descs[form_course]
             course = form_course
         else:
             error = 'Course not found: ' + form_course
@@ -59,33 +77,377 @@ def recommender():
             for course_str in str_course_list:
                 course_split: List[str] = course_str.strip().split(' ')
                 courses.append(cd.Course(course_split[0], course_split[1]))
-            recommendation_list = spr.recommend_courses_using_liked_courses(courses, num)
+            courses = sprc.canonical_courses(courses)
+            key = sprc.request_key('recommender', courses=courses, num=num)
+            recommendation_list = ctx.result_cache.get(key)
+            if recommendation_list is None:
+                recommendation_list = spr.recommend_courses_using_liked_courses(courses, num)
+                ctx.result_cache.put(key, recommendation_list)
         except KeyError as e:
             error = 'Course not found: ' + str(e)
-    return render_template('recommender.html', error=error, recommendation_list=recommendation_list, course_desc_dict=course_desc_dict, course_dict=course_dict)
+    return render_template('recommender.html', error=error, recommendation_list=recommendation_list, course_desc_dict=ctx.course_descs, course_dict=ctx.course_dict)
 
 
 @app.route('/scheduler', methods=['GET', 'POST'])
 def scheduler():
     error = None
     result_plan: List[Tuple] = None
+    report: dict = None
     if request.method == 'POST':
         str_initial_state: str = request.form['initial_state']
         str_goal_conditions: str = request.form['goal_conditions']
         try:
-            initial_state: List[cd.Course] = []
-            goal_conditions: List[cd.Course] = []
-            for course_str in str_initial_state.split(';'):
-                course_split: List[str] = course_str.strip().split(' ')
-                initial_state.append(cd.Course(course_split[0].strip(), course_split[1].strip()))
-            for course_str in str_goal_conditions.split(';'):
-                course_split: List[str] = course_str.strip().split(' ')
-                goal_conditions.append(cd.Course(course_split[0].strip(), course_split[1].strip()))
-            result_dict = sps.course_scheduler(course_dict, goal_conditions, initial_state)
+            # Canonical order, so the same courses in any order get the same (cached) schedule
+            initial_state: List[cd.Course] = sprc.canonical_courses(parse_courses(str_initial_state))
+            goal_conditions: List[cd.Course] = sprc.canonical_courses(parse_courses(str_goal_conditions))
+            # The form sends back what was scheduled last, if that schedule is still around only the change is redone
+            previous_initial_state = sprc.canonical_courses(parse_courses(request.form.get('previous_initial_state', '')))
+            previous_goal_conditions = sprc.canonical_courses(parse_courses(request.form.get('previous_goal_conditions', '')))
+            if request.args.get('debug') in ('trace', 'folded'):
+                return traced_schedule(goal_conditions, initial_state, request.args['debug'])
+            key = sprc.request_key('scheduler', goal_conditions=goal_conditions, initial_state=initial_state)
+            with recent_schedules_lock:
+                previous = recent_schedules.get((tuple(previous_goal_conditions), tuple(previous_initial_state)))
+            cached = ctx.result_cache.get(key) if previous is None else None
+            if cached is not None:
+                result_dict, report = cached
+            elif previous is not None and goal_conditions:
+                result_dict, report = sps.reschedule(ctx.course_dict, previous, previous_goal_conditions, previous_initial_state,
+                                                     added_initial=[c for c in initial_state if c not in previous_initial_state],
+                                                     removed_initial=[c for c in previous_initial_state if c not in initial_state],
+                                                     added_goals=[c for c in goal_conditions if c not in previous_goal_conditions],
+                                                     removed_goals=[c for c in previous_goal_conditions if c not in goal_conditions],
+                                                     time_budget=SCHEDULER_TIME_BUDGET)
+            else:
+                result_dict, report = sps.anytime_scheduler(ctx.course_dict, goal_conditions, initial_state, time_budget=SCHEDULER_TIME_BUDGET)
+                # Only a fresh search is cached, a repaired schedule depends on the previous one and isn't what the key asks
+                if not report['exhausted']:  # Out of time gives a different answer under other load
+                    ctx.result_cache.put(key, (result_dict, report))
+            if report['complete']:
+                with recent_schedules_lock:
+                    recent_schedules[(tuple(goal_conditions), tuple(initial_state))] = result_dict
+                    while len(recent_schedules) > RECENT_SCHEDULES_SIZE:
+                        recent_schedules.popitem(last=False)
             result_plan = list(sorted([(k,v) for k,v in result_dict.items()], key=lambda tuple: tuple[1].terms))
         except KeyError as e:
             error = 'Course not found: ' + str(e)
-    return render_template('scheduler.html', error=error, result_plan=result_plan, course_desc_dict=course_desc_dict)
+    return render_template('scheduler.html', error=error, result_plan=result_plan, report=report, course_desc_dict=ctx.course_descs,
+                           initial_state=request.form.get('initial_state', ''), goal_conditions=request.form.get('goal_conditions', ''))
+
+
+def traced_schedule(goal_conditions: List[cd.Course], initial_state: List[cd.Course], form: str):
+    """
+    Answers POST /scheduler?debug=trace with the search's trace as JSON, and ?debug=folded with folded stacks for a
+    flame graph, see sameerpuri_trace. The search runs afresh, never from the cache, and slower for being traced.
+    """
+    tracer = spt.SearchTracer()
+    result_dict, report = sps.anytime_scheduler(ctx.course_dict, goal_conditions, initial_state,
+                                                time_budget=SCHEDULER_TIME_BUDGET, tracer=tracer)
+    if form == 'folded':
+        return Response(tracer.to_folded(), mimetype='text/plain')
+    return jsonify(trace=tracer.to_dict(), **schedule_json(result_dict, report))
+
+
+def parse_courses(text: str) -> List[cd.Course]:
+    """Parses semicolon separated courses, e.g. 'CS 1101;CS 3251', skipping blanks."""
+    courses: List[cd.Course] = []
+    for course_str in text.split(';'):
+        course_split: List[str] = course_str.strip().split(' ')
+        if len(course_split) >= 2:
+            courses.append(cd.Course(course_split[0].strip(), course_split[-1].strip()))
+    return courses
+
+
+# Worker processes the batch and cohort APIs fan schedules out to. They are forked once by start_batch_pool(), which
+# gunicorn.conf.py calls before the server starts any threads; until then, or with 1, schedules are made in-process.
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '1'))
+batch_pool = None
+
+
+def start_batch_pool():
+    global batch_pool
+    if BATCH_WORKERS > 1 and batch_pool is None:
+        batch_pool = sps.worker_pool(ctx.course_dict, BATCH_WORKERS)
+
+
+def batch_workers() -> int:
+    return BATCH_WORKERS if batch_pool is not None else 1
+
+
+# The batch API takes a JSON object holding a list of requests and streams back one JSON object per line (NDJSON) for
+# each, tagged with its position in the list, as soon as it is ready. Courses are written 'CS 1101' both ways.
+@app.route('/api/recommend', methods=['POST'])
+def api_recommend():
+    """Takes {"requests": [{"courses": [...], "num": 10}, ...]}, scoring every uncached request in one batch."""
+    requests, error = batch_requests()
+    if error is not None:
+        return error
+
+    def results():
+        keys, todo = {}, []
+        for i, req in enumerate(requests):
+            try:
+                courses = sprc.canonical_courses(json_course(course) for course in req.get('courses', []))
+                num = int(req.get('num', 10))
+                unknown = [course for course in courses if course not in ctx.course_index]
+                if unknown:
+                    raise ValueError('unknown course ' + course_json(unknown[0]))
+            except (TypeError, ValueError, AttributeError) as e:
+                yield ndjson(index=i, error='Bad request: ' + str(e))
+                continue
+            keys[i] = sprc.request_key('recommender', courses=courses, num=num)
+            cached = ctx.result_cache.get(keys[i])
+            if cached is not None:
+                yield ndjson(index=i, recommendations=recommendations_json(cached))
+            else:
+                todo.append((i, courses, num))
+        if todo:
+            batch = spr.recommend_courses_using_liked_courses_batch([courses for _, courses, _ in todo], [num for _, _, num in todo])
+            for (i, _, _), recommendation_list in zip(todo, batch):
+                ctx.result_cache.put(keys[i], recommendation_list)
+                yield ndjson(index=i, recommendations=recommendations_json(recommendation_list))
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/schedule', methods=['POST'])
+def api_schedule():
+    """Takes {"requests": [{"goal_conditions": [...], "initial_state": [...]}, ...]}, scheduling them in parallel."""
+    requests, error = batch_requests()
+    if error is not None:
+        return error
+
+    def results():
+        keys, todo = {}, []
+        for i, req in enumerate(requests):
+            try:
+                goal_conditions = sprc.canonical_courses(json_course(course) for course in req.get('goal_conditions', []))
+                initial_state = sprc.canonical_courses(json_course(course) for course in req.get('initial_state', []))
+                unknown = [course for course in goal_conditions if course not in ctx.course_dict]
+                if unknown:
+                    raise ValueError('unknown course ' + course_json(unknown[0]))
+            except (TypeError, ValueError, AttributeError) as e:
+                yield ndjson(index=i, error='Bad request: ' + str(e))
+                continue
+            keys[i] = sprc.request_key('scheduler', goal_conditions=goal_conditions, initial_state=initial_state)
+            cached = ctx.result_cache.get(keys[i])
+            if cached is not None:
+                yield ndjson(index=i, **schedule_json(*cached))
+            else:
+                todo.append((i, goal_conditions, initial_state))
+        for j, result_dict, report in sps.schedule_many(ctx.course_dict, [(goals, initial) for _, goals, initial in todo],
+                                                        workers=batch_workers(), time_budget=SCHEDULER_TIME_BUDGET,
+                                                        pool=batch_pool):
+            i = todo[j][0]
+            if not report['exhausted']:
+                ctx.result_cache.put(keys[i], (result_dict, report))
+            yield ndjson(index=i, **schedule_json(result_dict, report))
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/cohort', methods=['POST'])
+def api_cohort():
+    """
+    Takes {"requests": [{"goal_conditions": [...], "initial_state": [...]}, ...], "capacity": {"CS 2201": 30,
+    "CS 3251": {"5": 25, "7": 25}, ...}}, one request per student and the seats of courses in every term or by term
+    number (1 to 8), and schedules the students together so no course-term gets more of them than it has seats.
+    """
+    requests, error = batch_requests()
+    if error is not None:
+        return error
+    try:
+        students = []
+        for i, req in enumerate(requests):
+            goal_conditions = [json_course(course) for course in req.get('goal_conditions', [])]
+            initial_state = [json_course(course) for course in req.get('initial_state', [])]
+            unknown = [course for course in goal_conditions if course not in ctx.course_dict]
+            if unknown:
+                raise ValueError('unknown course %s in request %d' % (course_json(unknown[0]), i))
+            students.append((goal_conditions, initial_state))
+        capacity = {}
+        for course, seats in (request.get_json().get('capacity') or {}).items():
+            capacity[json_course(course)] = {int(term): int(term_seats) for term, term_seats in seats.items()} \
+                if isinstance(seats, dict) else int(seats)
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify(error='Bad request: ' + str(e)), 400
+    schedules, report = sps.cohort_scheduler(ctx.course_dict, students, capacity, workers=batch_workers(),
+                                             time_budget=SCHEDULER_TIME_BUDGET, pool=batch_pool)
+    over_capacity, failed = set(report['over_capacity']), set(report['failed'])
+    return jsonify(
+        schedules=[{'index': i, 'schedule': schedule_list(schedule),
+                    'status': 'failed' if i in failed else 'over_capacity' if i in over_capacity else 'scheduled'}
+                   for i, schedule in enumerate(schedules)],
+        overloaded=[{'course': course_json(course), 'semester': term.semester.name, 'year': term.year.name,
+                     'students': count, 'seats': seats} for course, term, count, seats in report['overloaded']],
+        rounds=report['rounds'], searches=report['searches'], seconds=report['seconds'])
+
+
+def batch_requests():
+    """Reads the list of requests out of a batch API call, or returns an error response."""
+    body = request.get_json(silent=True)
+    requests = body.get('requests') if isinstance(body, dict) else None
+    if not isinstance(requests, list) or not all(isinstance(req, dict) for req in requests):
+        return None, (jsonify(error='Expected a JSON object with a list of request objects under "requests"'), 400)
+    return requests, None
+
+
+def json_course(value) -> cd.Course:
+    """Reads a course given as 'CS 1101' or ['CS', '1101']."""
+    program, designation = value.split() if isinstance(value, str) else value
+    return cd.Course(str(program), str(designation))
+
+
+def course_json(course: cd.Course) -> str:
+    return course[0] + ' ' + course[1]
+
+
+def ndjson(**fields) -> str:
+    return json.dumps(fields) + '\n'
+
+
+def recommendations_json(recommendation_list: List[Tuple]) -> List[dict]:
+    return [{'course': course_json(course), 'score': score} for course, score in recommendation_list]
+
+
+def schedule_list(result_dict: dict) -> List[dict]:
+    return [{'course': course_json(course), 'credits': int(info.credits), 'semester': info.terms.semester.name,
+             'year': info.terms.year.name} for course, info in sorted(result_dict.items(), key=lambda item: item[1].terms)]
+
+
+def schedule_json(result_dict: dict, report: dict) -> dict:
+    return {'schedule': schedule_list(result_dict), 'complete': report['complete'], 'goals_missed': [course_json(course) for course in report['goals_missed']],
+            'exhausted': report['exhausted'], 'nodes': report['nodes'], 'seconds': report['seconds']}
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """Searches course names and descriptions, e.g. /api/search?q=organic+chemistry&num=10&offset=20 for page three."""
+    try:
+        num, offset = int(request.args.get('num', 10)), int(request.args.get('offset', 0))
+    except ValueError as e:
+        return jsonify(error='Bad request: ' + str(e)), 400
+    courses = spr.recommend_courses_using_search_text(request.args.get('q', ''), num, offset)
+    return jsonify(offset=offset, courses=[{'course': course_json(course), 'name': ctx.course_descs[course].name} for course in courses])
+
+
+# Schedule searches can also be submitted as jobs, so no request waits on one. POST /api/jobs queues a search and returns
+# its id right away, then GET /api/jobs/<id> polls it, GET /api/jobs/<id>/events streams its status as server-sent
+# events until it finishes, and DELETE /api/jobs/<id> cancels it. Submitting a search that is already queued or running
+# joins that job. Jobs live in the process they were submitted to, so the API only runs in a single server process:
+# gunicorn.conf.py runs one threaded worker, and turns the API off with disable_jobs() if more are started.
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT', '30'))  # Seconds a job searches for unless it asks for less
+JOB_MAX_TIMEOUT = float(os.environ.get('JOB_MAX_TIMEOUT', '120'))
+SSE_KEEPALIVE = 15  # Seconds between comments that keep an idle event stream open
+
+
+def run_schedule_job(key: str, goal_conditions: List[cd.Course], initial_state: List[cd.Course], timeout: float, cancel) -> Tuple[dict, dict]:
+    result_dict, report = sps.anytime_scheduler(ctx.course_dict, goal_conditions, initial_state, time_budget=timeout, cancel=cancel)
+    if not report['exhausted']:
+        ctx.result_cache.put(key, (result_dict, report))
+    return result_dict, report
+
+
+job_queue = spj.JobQueue(run_schedule_job, workers=int(os.environ.get('JOB_WORKERS', '1')))
+jobs_disabled: str = None  # Why the jobs API is off, if it is
+
+
+def disable_jobs(reason: str):
+    """Turns the jobs API off, e.g. in a server with several worker processes, where a job is only in one of them."""
+    global jobs_disabled
+    jobs_disabled = reason
+
+
+def jobs_unavailable():
+    """The response to every jobs API call while it is off, otherwise None."""
+    if jobs_disabled is not None:
+        return jsonify(error='The jobs API is off: ' + jobs_disabled), 503
+    return None
+
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def api_jobs():
+    """Takes {"goal_conditions": [...], "initial_state": [...], "timeout": seconds}, or lists the queue's counters."""
+    unavailable = jobs_unavailable()
+    if unavailable is not None:
+        return unavailable
+    if request.method == 'GET':
+        return jsonify(pid=os.getpid(), **job_queue.stats())
+    body = request.get_json(silent=True)
+    try:
+        if not isinstance(body, dict):
+            raise ValueError('expected a JSON object')
+        goal_conditions = sprc.canonical_courses(json_course(course) for course in body.get('goal_conditions', []))
+        initial_state = sprc.canonical_courses(json_course(course) for course in body.get('initial_state', []))
+        unknown = [course for course in goal_conditions if course not in ctx.course_dict]
+        if unknown:
+            raise ValueError('unknown course ' + course_json(unknown[0]))
+        timeout = min(float(body.get('timeout', JOB_TIMEOUT)), JOB_MAX_TIMEOUT)
+        if not timeout > 0:
+            raise ValueError('timeout must be positive')
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify(error='Bad request: ' + str(e)), 400
+    key = sprc.request_key('scheduler', goal_conditions=goal_conditions, initial_state=initial_state)
+    cached = ctx.result_cache.get(key)
+    if cached is not None:
+        return jsonify(job_json(job_queue.completed(key, cached))), 200
+    job, _ = job_queue.submit(key, (key, goal_conditions, initial_state), timeout)
+    return jsonify(job_json(job)), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job(job_id: str):
+    unavailable = jobs_unavailable()
+    if unavailable is not None:
+        return unavailable
+    job = job_queue.cancel(job_id) if request.method == 'DELETE' else job_queue.get(job_id)
+    if job is None:
+        return jsonify(error='No such job, it may have finished too long ago'), 404
+    return jsonify(job_json(job))
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def api_job_events(job_id: str):
+    """Sends a status event whenever the job's status changes, the last one with its result."""
+    unavailable = jobs_unavailable()
+    if unavailable is not None:
+        return unavailable
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error='No such job, it may have finished too long ago'), 404
+
+    def events():
+        status, idle = None, 0.0
+        while True:
+            finished = job.finished.wait(1)
+            if job.status != status:
+                status, idle = job.status, 0.0
+                yield 'event: status\ndata: %s\n\n' % json.dumps(job_json(job))
+            elif idle >= SSE_KEEPALIVE:
+                idle = 0.0
+                yield ': keepalive\n\n'
+            if finished:
+                return
+            idle += 1
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def job_json(job: spj.Job) -> dict:
+    fields = job.describe()
+    if job.status in (spj.DONE, spj.CANCELLED) and job.result is not None:
+        fields.update(schedule_json(*job.result))
+    if job.error is not None:
+        fields['error'] = job.error
+    return fields
+
+
+@app.route('/cache', methods=['GET'])
+def cache():
+    return jsonify(pid=os.getpid(), **ctx.result_cache.stats())
+
+
+@app.route('/memory', methods=['GET'])
+def memory():
+    return jsonify(pid=os.getpid(), **spp.memory_usage())
+
 
 @app.route('/about', methods=['GET'])
 def about():
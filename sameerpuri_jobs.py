@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """
+    One submitted search. Its status goes from queued to running to done, failed or cancelled, and finished is set
+    once it gets to one of the last three. Submitting a job with the same key as one still queued or running returns
+    that job instead, so submitters counts how many are waiting on it.
+    """
+
+    def __init__(self, key: str, args: tuple, timeout: float):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.args = args
+        self.timeout = timeout
+        self.status = QUEUED
+        self.result = None
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.ended: Optional[float] = None
+        self.submitters = 1
+        self.cancel = threading.Event()  # Passed to the search, which stops soon after it is set
+        self.finished = threading.Event()
+
+    def describe(self) -> dict:
+        return {'id': self.id, 'status': self.status, 'submitters': self.submitters, 'timeout': self.timeout,
+                'queued_seconds': (self.started or self.ended or time.time()) - self.submitted,
+                'run_seconds': None if self.started is None else (self.ended or time.time()) - self.started}
+
+
+class JobQueue:
+    """
+    An in-process queue of jobs run by a few daemon threads, started with the first job so none are made before a
+    server forks its workers. run(*job.args, timeout=, cancel=) does the work and its return value is the result.
+    Jobs are only known to the process they were submitted to. Finished jobs are kept for keep_seconds, and at most
+    keep_jobs of them, for clients to collect.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, run: Callable, workers: int = 1, keep_jobs: int = 256, keep_seconds: float = 600):
+        self.run = run
+        self.workers = workers
+        self.keep_jobs = keep_jobs
+        self.keep_seconds = keep_seconds
+        self.jobs: 'OrderedDict[str, Job]' = OrderedDict()  # Every job by id, in the order submitted
+        self.in_flight: Dict[str, Job] = {}  # Queued and running jobs by key
+        self.counters: Dict[str, int] = {'submitted': 0, 'deduplicated': 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        self._pending: 'queue.Queue[Job]' = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, args: tuple, timeout: float) -> Tuple[Job, bool]:
+        """Queues a job, or joins the one in flight with the same key. Returns it and whether it is new."""
+        with self._lock:
+            self._forget_old()
+            job = self.in_flight.get(key)
+            if job is not None:
+                job.submitters += 1
+                self.counters['deduplicated'] += 1
+                return job, False
+            job = Job(key, args, timeout)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+            self.counters['submitted'] += 1
+            self._start_workers()
+        self._pending.put(job)
+        return job, True
+
+    def completed(self, key: str, result) -> Job:
+        """Records a job that is already done, e.g. one whose result was cached, so it can be collected like the rest."""
+        job = Job(key, (), 0)
+        job.status, job.result = DONE, result
+        job.started = job.ended = job.submitted
+        job.finished.set()
+        with self._lock:
+            self._forget_old()
+            self.jobs[job.id] = job
+            self.counters['submitted'] += 1
+            self.counters[DONE] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Withdraws one submission of a job. The job itself is only cancelled once every submitter has withdrawn, so
+        one client can't cancel a search another is waiting for. A running search stops within a few nodes.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job.submitters -= 1
+            if job.submitters > 0:
+                return job
+            job.cancel.set()
+            if job.status == QUEUED:  # The worker that takes it off the queue skips it
+                self._finish(job, CANCELLED)
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats[QUEUED] = sum(job.status == QUEUED for job in self.in_flight.values())
+            stats[RUNNING] = sum(job.status == RUNNING for job in self.in_flight.values())
+            stats['kept'] = len(self.jobs)
+        return stats
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name='job-worker-%d' % len(self._threads), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._pending.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    continue
+                job.status, job.started = RUNNING, time.time()
+            try:
+                result, status, error = self.run(*job.args, timeout=job.timeout, cancel=job.cancel), DONE, None
+            except Exception as e:  # Reported to whoever collects the job instead of killing the worker
+                result, status, error = None, FAILED, '%s: %s' % (type(e).__name__, e)
+            with self._lock:
+                job.result, job.error = result, error
+                self._finish(job, CANCELLED if job.cancel.is_set() else status)
+
+    def _finish(self, job: Job, status: str):
+        job.status, job.ended = status, time.time()
+        job.args = ()
+        if self.in_flight.get(job.key) is job:
+            del self.in_flight[job.key]
+        self.counters[status] += 1
+        job.finished.set()
+
+    def _forget_old(self):
+        # Jobs are in submission order, so stop at the first one that is still wanted
+        now = time.time()
+        finished = len(self.jobs) - len(self.in_flight)
+        for job_id, job in list(self.jobs.items()):
+            if job.status not in FINISHED:
+                continue
+            if finished <= self.keep_jobs and now - job.ended <= self.keep_seconds:
+                break
+            del self.jobs[job_id]
+            finished -= 1
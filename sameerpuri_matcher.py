@@ -1,39 +1,95 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from pprint import pprint
 
 import re
+import string
 from collections import namedtuple
 
 import course_dictionary as cd
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 p = re.compile(r'([A-Z-]{2,5}[ ]\d{4}[WL]{0,1})[.] ([\w:\-,’\'\s]+?[.])[ ]{0,1}(?:[\[(](Formerly[\s\S]+?)[\])][.]{0,1}){0,1}([\S\s]*?[.]*) ([\[][\s\S]+?[\]])')
 
-fixcontinuednewlines = re.compile(r'([A-Za-z0-9])[\n]([a-z0-9])')
+# A line that closes a bracket, such as the [3] credit bracket ending most course entries
+record_end = re.compile(r'(?:^| )\[[^\[\]]+\][ \t]*$')
+course_start = re.compile(r'[A-Z-]{2,5} \d{4}[WL]?[.] ')
+bracket_after_name = re.compile(r'[A-Z-]{2,5}[ ]\d{4}[WL]{0,1}[.] [\w:\-,’\'\s]+?[.] [\[][^\[\]]+[\]][ \t]*$')
 CourseDesc = namedtuple('CourseDesc', ['name', 'formerly', 'summary', 'creditbracket'])
 
+word_chars = frozenset(string.ascii_letters + string.digits)
+continuation_chars = frozenset(string.ascii_lowercase + string.digits)
 
-def create_course_desc_dict(course_dict: Dict[cd.Course, cd.CourseInfo]) -> Dict[cd.Course, CourseDesc]:
-    data: str
-
-    with open('ugad.txt', 'r') as ugad:
-        # TODO: consider case where newline is a continuation of character from previous line
-        data = ugad.read()
-        # Handles cases where a word is continued from previous line in ugad catalog
-        for match in fixcontinuednewlines.findall(data):
-            data = data.replace(match[0]+'\n'+match[1], match[0] + match[1])
-        data = data.replace('\n', ' ')
 
+def create_course_desc_dict(course_dict: Dict[cd.Course, cd.CourseInfo]) -> Dict[cd.Course, CourseDesc]:
     course_desc_dict: Dict[cd.Course, CourseDesc] = {}
-    for match in p.findall(data):
-        course: cd.Course = cd.Course(*match[0].split(' '))
-        if course in course_dict:
-            course_desc_dict[course] = CourseDesc(*match[1:5])
+    with open('ugad.txt', 'r') as ugad:
+        for course, desc in iter_course_descs(ugad):
+            if course in course_dict:
+                course_desc_dict[course] = desc
     return course_desc_dict
 
 
+def iter_course_descs(lines: Iterable[str]) -> Iterator[Tuple[cd.Course, CourseDesc]]:
+    """
+    Parses catalog lines into course descriptions in a single pass, yielding each one as soon as its entry is read.
+    Lines are grouped into chunks that end on a closing bracket right before the next course header, so no match of
+    p can straddle two chunks and p only ever runs over a handful of entries at a time.
+    """
+    chunk: List[str] = []
+    can_cut = False
+    for piece, line in join_continued_lines(lines):
+        if can_cut and course_start.match(line):
+            text = ''.join(chunk)
+            if is_safe_cut(text):
+                yield from parse_chunk(text)
+                chunk = []
+            else:
+                chunk = [text]
+        chunk.append(piece)
+        can_cut = line.rstrip().endswith(']') and record_end.search(line) is not None
+    yield from parse_chunk(''.join(chunk))
+
+
+def join_continued_lines(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (piece, line) pairs where the pieces concatenate to the catalog text on a single line. A word continued
+    from the previous line in the ugad catalog (a line ending in 'pro' followed by one starting with 'gramming') is
+    joined back together, every other newline becomes a space.
+    """
+    prev: str = None
+    for line in lines:
+        if prev is not None:
+            yield prev + ('' if prev[-1:] in word_chars and line[:1] in continuation_chars else ' '), prev
+        prev = line[:-1] if line.endswith('\n') else line
+        ended = line.endswith('\n')
+    if prev is not None:
+        yield prev + (' ' if ended else ''), prev
+
+
+def is_safe_cut(text: str) -> bool:
+    """
+    Checks that no match of p can read past the bracket that ends the text. That happens when the last [Formerly ...]
+    note is only closed by that bracket, or when the bracket directly follows a course name (e.g. 'MSE 1500. Lab. [1]'),
+    since p then prefers to look for a later bracket over leaving the summary empty.
+    """
+    formerly = text.rfind('Formerly')
+    if formerly != -1:
+        close = min((i for i in (text.find(']', formerly), text.find(')', formerly)) if i != -1), default=-1)
+        if close == text.rfind(']'):
+            return False
+    # Neither the course number nor the name contain a period, so only the text after the third to last one matters
+    start = text.rfind('[')
+    for _ in range(3):
+        start = text.rfind('.', 0, max(start, 0))
+    return bracket_after_name.search(text, start + 1) is None
+
+
+def parse_chunk(text: str) -> Iterator[Tuple[cd.Course, CourseDesc]]:
+    for match in p.findall(text):
+        yield cd.Course(*match[0].split(' ')), CourseDesc(*match[1:5])
+
+
 if __name__ == '__main__':
     print('*** Course Matcher ***')
     course_desc_dict: Dict[cd.Course, CourseDesc] = create_course_desc_dict(cd.create_course_dict())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Preload mode for running the Flask UI under a forking server such as gunicorn. The master process builds the course
+# dictionaries and vector matrices once, then moves the matrices into shared memory and freezes the garbage collector,
+# so that forked workers read the same physical pages instead of each building (or copy-on-write copying) their own.
+# Python objects can't be attached zero-copy, so the dictionaries are inherited from the master; gc.freeze keeps the
+# collector from writing to them, which is what otherwise unshares their pages.
+# The sharing only saves memory with more than one worker. gunicorn.conf.py runs a single threaded worker by default,
+# since schedule jobs live in the memory of one process, so nothing is shared unless GUNICORN_WORKERS (or --workers) is
+# raised, which turns the jobs API off. Run as a script, this module forks its own workers to measure the saving.
+
+import gc
+import mmap
+import os
+import sys
+from typing import Dict
+
+import numpy as np
+
+
+def share_array(array: np.ndarray) -> np.ndarray:
+    """
+    Copies an array into an anonymous shared mapping and returns a read-only view of it. The mapping is inherited by
+    forked children and never copied, since nothing writes to it.
+    """
+    if isinstance(array, np.memmap) or isinstance(getattr(array, 'base', None), mmap.mmap):
+        return array  # Already backed by a file mapping, which the page cache shares between processes
+    array = np.ascontiguousarray(array)
+    buf = mmap.mmap(-1, max(array.nbytes, 1))
+    shared = np.frombuffer(buf, dtype=array.dtype, count=array.size).reshape(array.shape)
+    shared[...] = array
+    shared.flags.writeable = False
+    return shared
+
+
+def preload():
+    """Builds everything the Flask UI needs in this process and prepares it to be shared with forked workers."""
+    import sameerpuri_flaskui
+    import sameerpuri_context as spc
+    ctx = spc.context()
+    # The context only builds things on first use, so build everything the workers use here for them to inherit
+    for name in ('prereq_index', 'word_vectors', 'search_index', 'result_cache'):
+        getattr(ctx, name)
+    ctx.course_desc_matrix = share_array(ctx.course_desc_matrix)
+    ctx.course_name_matrix = share_array(ctx.course_name_matrix)
+    freeze()
+    report_memory('master')
+    return sameerpuri_flaskui.app
+
+
+def freeze():
+    """Moves every object allocated so far out of the collector's reach, so workers don't touch their pages."""
+    gc.collect()
+    gc.freeze()
+
+
+def memory_usage(pid: int = None) -> Dict[str, int]:
+    """
+    Returns the memory of a process in kB: rss and its anonymous/file/shmem parts from /proc/<pid>/status, plus pss,
+    which splits shared pages between the processes mapping them and so shows what preloading saves. Linux only.
+    """
+    proc = '/proc/%s' % (pid or 'self')
+    usage: Dict[str, int] = {}
+    fields = {'VmRSS:': 'rss', 'RssAnon:': 'rss_anon', 'RssFile:': 'rss_file', 'RssShmem:': 'rss_shmem'}
+    try:
+        with open(proc + '/status') as status:
+            for line in status:
+                parts = line.split()
+                if parts and parts[0] in fields:
+                    usage[fields[parts[0]]] = int(parts[1])
+        with open(proc + '/smaps_rollup') as smaps:
+            for line in smaps:
+                parts = line.split()
+                if parts and parts[0] == 'Pss:':
+                    usage['pss'] = int(parts[1])
+    except OSError:  # Not on Linux, or the process is gone
+        pass
+    return usage
+
+
+def report_memory(label: str, pid: int = None):
+    usage = memory_usage(pid)
+    print('[%s %d] %s' % (label, pid or os.getpid(), ' '.join('%s=%dkB' % item for item in sorted(usage.items()))),
+          file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    # Measures the saving: forks the given number of workers from a preloaded master, has each serve a request, and
+    # reports the RSS and PSS of every worker.
+    import time
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    app = preload()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            client = app.test_client()
+            client.post('/recommender', data={'num': '10', 'courses': 'CS 2201;CS 3251'})
+            client.post('/scheduler', data={'initial_state': 'CS 1101', 'goal_conditions': 'CS 3251'})
+            report_memory('worker')
+            time.sleep(1)  # Stay alive until every worker has reported, so pss is split between all of them
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
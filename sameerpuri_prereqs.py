@@ -0,0 +1,243 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+import course_dictionary as cd
+
+# Terms are numbered like tree heights: 1 is Fall of freshman year and 8 is Spring of senior year. Term 0 is the
+# initial state, the courses taken before freshman year.
+MAX_TERM = 8
+MAX_HOURS = 18
+UNREACHABLE = MAX_TERM + 1
+UNREACHABLE_HOURS = MAX_TERM * MAX_HOURS
+
+
+def semester_name(term: int) -> str:
+    """The semester of a term number, odd terms are Fall."""
+    return 'Fall' if term % 2 == 1 else 'Spring'
+
+
+class PrereqIndex:
+    """
+    Precomputed prerequisite structure of a catalog. Courses get integer ids in topological order, so every course
+    comes after the courses in its prereq clauses, and sets of courses are bitmasks of those ids. The closure of a
+    course is the mask of every course any of its clauses can lead to.
+    Courses are interchangeable if they have the same credits, offerings and prereq clauses, and every clause one of
+    them is in has a twin with the other in its place. classes maps each course to the smallest id of its class.
+    The heuristics depend on the initial state as well, so they live in PrereqViews made by view(), each derived from
+    a cached view by recomputing only the courses whose closure meets the courses that were added or removed.
+    """
+
+    VIEW_CACHE_SIZE = 32
+
+    def __init__(self, course_descriptions: Dict[cd.Course, cd.CourseInfo]):
+        self.course_descriptions = course_descriptions
+        self.courses: List[cd.Course] = self._topological_order()
+        self.ids: Dict[cd.Course, int] = {course: i for i, course in enumerate(self.courses)}
+        self.credits: List[int] = []
+        self.offered: List[Tuple[int, ...]] = []  # The terms, 1 to 8, each course is offered in
+        self.clauses: List[Tuple[tuple, ...]] = []  # The prereq clauses as courses
+        self.prereqs: List[Tuple[Tuple[int, ...], ...]] = []  # The prereq clauses as ids
+        for course in self.courses:
+            info = course_descriptions[course]
+            self.credits.append(int(info.credits))
+            self.offered.append(tuple(t for t in range(1, MAX_TERM + 1) if semester_name(t) in info.terms))
+            self.clauses.append(tuple(tuple(clause) for clause in info.prereqs))
+            self.prereqs.append(tuple(tuple(self.ids[req] for req in clause) for clause in info.prereqs))
+        self.closure: List[int] = self._closures()
+        self.classes: List[int] = self._equivalence_classes()
+        self.base = PrereqView(self, 0, None, (1 << len(self.courses)) - 1)
+        self._views: 'OrderedDict[int, PrereqView]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _topological_order(self) -> List[cd.Course]:
+        # Depth first postorder over the prereq edges. An edge back to a course still being visited is on a cycle and is
+        # left out of the order; PrereqView treats it as unreachable.
+        order, state = [], {}
+        for root in self.course_descriptions:
+            if root in state:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self._reqs(root)))]
+            while stack:
+                course, reqs = stack[-1]
+                req = next(reqs, None)
+                if req is None:
+                    stack.pop()
+                    state[course] = 2
+                    order.append(course)
+                elif req not in state:
+                    state[req] = 1
+                    stack.append((req, iter(self._reqs(req))))
+        return order
+
+    def _reqs(self, course: cd.Course) -> Iterable[cd.Course]:
+        return (cd.Course(*req) for clause in self.course_descriptions[course].prereqs for req in clause)
+
+    def _closures(self) -> List[int]:
+        closure = [0] * len(self.courses)
+        changed = True
+        while changed:  # One pass suffices unless the catalog has cycles
+            changed = False
+            for i, clauses in enumerate(self.prereqs):
+                mask = closure[i]
+                for clause in clauses:
+                    for req in clause:
+                        mask |= closure[req] | 1 << req
+                if mask != closure[i]:
+                    closure[i], changed = mask, True
+        return closure
+
+    def _equivalence_classes(self) -> List[int]:
+        contexts: List[set] = [set() for _ in self.courses]  # Every clause each course is in, with itself left out
+        for parent, clauses in enumerate(self.prereqs):
+            for clause in clauses:
+                for req in clause:
+                    contexts[req].add((parent, tuple(sorted(-1 if other == req else other for other in clause))))
+        representatives: Dict[tuple, int] = {}
+        classes = []
+        for i in range(len(self.courses)):
+            key = (self.credits[i], self.offered[i], self.prereqs[i], frozenset(contexts[i]))
+            classes.append(representatives.setdefault(key, i))
+        return classes
+
+    def mask(self, courses: Iterable[cd.Course]) -> int:
+        """The bitmask of the given courses, ignoring any that aren't in the catalog."""
+        mask = 0
+        for course in courses:
+            i = self.ids.get(course)
+            if i is not None:
+                mask |= 1 << i
+        return mask
+
+    def courses_of(self, mask: int) -> List[cd.Course]:
+        """The courses in a bitmask, in topological order."""
+        courses = []
+        while mask:
+            low = mask & -mask
+            courses.append(self.courses[low.bit_length() - 1])
+            mask ^= low
+        return courses
+
+    def view(self, initial_state: Iterable[cd.Course]) -> 'PrereqView':
+        """Returns the heuristics for an initial state, derived from the cached view closest to it."""
+        taken = self.mask(initial_state)
+        with self._lock:
+            view = self._views.get(taken)
+            if view is not None:
+                self._views.move_to_end(taken)
+                return view
+            nearest = min([self.base] + list(self._views.values()), key=lambda v: bin(v.taken ^ taken).count('1'))
+        view = nearest.with_taken(taken)
+        with self._lock:
+            self._views[taken] = view
+            while len(self._views) > self.VIEW_CACHE_SIZE:
+                self._views.popitem(last=False)
+        return view
+
+
+class PrereqView:
+    """
+    The heuristics of every course in a PrereqIndex for one initial state, indexed by course id:
+      height     the minimum requirement tree height, the earliest term a course can be done in given the terms its
+                 prerequisite chain is offered in, 0 if taken, UNREACHABLE if it can't be done
+      min_hours  the hours of the cheapest way to complete a course, counting shared prereqs more than once
+      mandatory  the mask of courses with credits that have to be taken whichever clauses complete a course
+    Views are never changed once built, so they can be shared between threads.
+    """
+
+    def __init__(self, index: PrereqIndex, taken: int, parent: 'PrereqView', dirty: int):
+        self.index = index
+        self.taken = taken
+        if parent is None:
+            n = len(index.courses)
+            self.height, self.min_hours, self.mandatory = [0] * n, [0] * n, [0] * n
+        else:
+            self.height, self.min_hours, self.mandatory = parent.height[:], parent.min_hours[:], parent.mandatory[:]
+        closure = index.closure
+        for i in range(len(index.courses)):  # Topological order, so prereqs are always recomputed first
+            if dirty >> i & 1 or closure[i] & dirty:
+                self._compute(i)
+
+    def with_taken(self, taken: int) -> 'PrereqView':
+        """A view for another initial state, recomputing only the courses that depend on what changed."""
+        return PrereqView(self.index, taken, self, self.taken ^ taken)
+
+    def _compute(self, i: int):
+        if self.taken >> i & 1:
+            self.height[i] = self.min_hours[i] = self.mandatory[i] = 0
+            return
+        index = self.index
+        credits = index.credits[i]
+        base, hours, needed = None, None, None
+        for clause in index.prereqs[i]:
+            clause_height, clause_hours, clause_needed = 0, 0, 0
+            for req in clause:
+                if req >= i and not self.taken >> req & 1:  # On a prereq cycle
+                    clause_height, clause_hours = UNREACHABLE, clause_hours + UNREACHABLE_HOURS
+                    continue
+                clause_height = max(clause_height, self.height[req])
+                clause_hours += self.min_hours[req]
+                clause_needed |= self.mandatory[req]
+            base = clause_height if base is None else min(base, clause_height)
+            hours = clause_hours if hours is None else min(hours, clause_hours)
+            needed = clause_needed if needed is None else needed & clause_needed
+        base, hours, needed = base or 0, hours or 0, needed or 0
+        if credits == 0:  # Higher level requirements are done as soon as their clause is
+            self.height[i] = min(base, UNREACHABLE)
+        else:
+            self.height[i] = next((t for t in index.offered[i] if t > base), UNREACHABLE)
+            needed |= 1 << i
+        self.min_hours[i] = credits + hours
+        self.mandatory[i] = needed
+
+    def course_height(self, course: cd.Course) -> int:
+        return self.height[self.index.ids[course]]
+
+    def course_min_hours(self, course: cd.Course) -> int:
+        return self.min_hours[self.index.ids[course]]
+
+
+class CatalogCache:
+    """
+    Things built from a catalog, for the catalogs used most recently. Catalogs are told apart by identity, since they
+    are dicts, and an entry keeps its catalog alive, so at most size catalogs are kept: a caller that loads a fresh dict
+    for every request gets a rebuild each time instead of a leak. A catalog must not be changed once it has been used,
+    pass a new dict instead; one whose number of courses changed is rebuilt, but other changes go unnoticed.
+    """
+
+    def __init__(self, build, size: int = 4):
+        self.build = build
+        self.size = size
+        self._entries: 'OrderedDict[tuple, tuple]' = OrderedDict()  # (id, args) -> (catalog, courses, built)
+        self._lock = threading.Lock()
+
+    def get(self, course_descriptions: Dict[cd.Course, cd.CourseInfo], *args):
+        """Returns what build(course_descriptions, *args) built, building it if it isn't cached."""
+        key = (id(course_descriptions),) + args
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is course_descriptions and entry[1] == len(course_descriptions):
+                self._entries.move_to_end(key)
+                return entry[2]
+            # Built holding the lock, so racing threads don't build it twice
+            built = self.build(course_descriptions, *args)
+            self._entries[key] = (course_descriptions, len(course_descriptions), built)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return built
+
+    def discard(self, course_descriptions: Dict[cd.Course, cd.CourseInfo]):
+        """Drops everything built from a catalog, so it can be freed."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] is course_descriptions]:
+                del self._entries[key]
+
+
+prereq_indexes = CatalogCache(PrereqIndex)
+
+
+def prereq_index(course_descriptions: Dict[cd.Course, cd.CourseInfo]) -> PrereqIndex:
+    """Returns the index of a catalog, building it the first time the catalog is seen."""
+    return prereq_indexes.get(course_descriptions)
@@ -1,50 +1,203 @@
+import os
 from pprint import pprint
-from typing import List, Dict, Tuple
-import spacy
-from spacy import displacy
+from typing import List, Tuple
+import numpy as np
 
 import course_dictionary as cd
-import sameerpuri_matcher as spm
+import sameerpuri_ann as spa
+import sameerpuri_context as spc
+import sameerpuri_search as spse
+import sameerpuri_vectorcache as spv
+import sameerpuri_wordvectors as spw
 from pathlib import Path
 
-course_infos: Dict[cd.Course, cd.CourseInfo] = cd.create_course_dict()
-course_descs: Dict[cd.Course, spm.CourseDesc] = spm.create_course_desc_dict(course_infos)
+# Nothing is loaded at import: the catalog, vectors and indexes are built by the shared context the first time a
+# recommendation needs them, see sameerpuri_context.
+MODEL_NAME = 'en_core_web_lg'
 
-print('Loading...')
-print('Reading english word vector information...')
-nlp = spacy.load('en_core_web_lg')
-print('Analyzing course descriptions...')
-course_nlp_descs = {}
-course_nlp_names = {}
-for course in course_descs.keys():
-    course_nlp_descs[course] = nlp(course_descs[course].summary)
-    course_nlp_names[course] = nlp(course_descs[course].name)
-print('Loaded!')
+# Search text vectors come from the table of word vectors saved with the vector cache, or from the spaCy model itself
+WORD_VECTOR_BACKEND = os.environ.get('WORD_VECTOR_BACKEND', 'table')
+WORD_TABLE_DTYPE = os.environ.get('WORD_TABLE_DTYPE', 'float16')  # float32, float16 or int8
+WORD_TABLE_COMMON_WORDS = 50000  # Most frequent words of the model kept in the table besides the catalog's
 
 
-def recommend_courses_using_search_text(search_text: str, num: int) -> List:
-    search_text = nlp(search_text)
-    text_similarities_dict: Dict[float, cd.Course] = {search_text.similarity(course_nlp_descs[course]): course for course in course_nlp_descs.keys()}
-    text_similarities: List[float] = list(reversed(sorted(text_similarities_dict.keys())))
-    num = min(num, len(text_similarities))
-    return list(map(lambda flt: text_similarities_dict[flt], text_similarities[:num]))
+# The module level names the recommender used to build at import, now read from the shared context
+_CONTEXT_NAMES = {'course_infos': 'course_dict', 'course_descs': 'course_descs', 'course_keys': 'course_keys',
+                  'course_index': 'course_index', 'vectors_key': 'vectors_key', 'course_desc_matrix': 'course_desc_matrix',
+                  'course_name_matrix': 'course_name_matrix', 'nlp': 'nlp'}
+
+
+def __getattr__(name: str):
+    if name in _CONTEXT_NAMES:
+        return getattr(spc.context(), _CONTEXT_NAMES[name])
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def get_nlp():
+    """Loads the spaCy model the first time it is needed."""
+    return spc.context().nlp
+
+
+def normalized_matrix(vectors: List[np.ndarray]) -> np.ndarray:
+    """Stacks vectors into an L2-normalized float32 matrix. Rows without a vector stay zero, like Doc.similarity."""
+    matrix = np.array(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def text_vector(text: str) -> np.ndarray:
+    """The vector of a text, the mean of its word vectors."""
+    if WORD_VECTOR_BACKEND == 'spacy':
+        return get_nlp()(text).vector
+    return get_word_vectors().vector(text)
+
+
+def get_word_vectors() -> spw.WordVectors:
+    """Loads the word vector table saved with the vector cache, exporting it from the model if there is none."""
+    return spc.context().word_vectors
+
+
+def export_word_vectors(ctx: spc.CatalogContext) -> spw.WordVectors:
+    texts = (text for course in ctx.course_keys for text in (ctx.course_descs[course].name, ctx.course_descs[course].summary))
+    table = spw.WordVectors.export(ctx.nlp, texts, WORD_TABLE_COMMON_WORDS, WORD_TABLE_DTYPE)
+    table.save(spv.word_vectors_path(ctx.vectors_key))
+    return table
+
+
+def get_course_nlp_desc(course: cd.Course):
+    """Returns the parsed description of a course, reading every Doc from the vector cache on the first call."""
+    return spc.context().course_nlp_descs[course]
+
+
+def load_course_vectors(ctx: spc.CatalogContext) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (description, name) matrices of a context's catalog from the vector cache, or on a miss computes them
+    with the spaCy model and fills the cache. Row i of each holds the vector of course_keys[i], normalized, so cosine
+    similarity is a dot product.
+    """
+    print('Loading...')
+    cached_vectors = spv.load_vectors(ctx.vectors_key, ctx.course_keys)
+    if cached_vectors is not None:
+        print('Loaded!')
+        return cached_vectors
+    print('Analyzing course descriptions...')
+    desc_docs = list(ctx.nlp.pipe(ctx.course_descs[course].summary for course in ctx.course_keys))
+    name_docs = list(ctx.nlp.pipe(ctx.course_descs[course].name for course in ctx.course_keys))
+    course_desc_matrix: np.ndarray = normalized_matrix([doc.vector for doc in desc_docs])
+    course_name_matrix: np.ndarray = normalized_matrix([doc.vector for doc in name_docs])
+    spv.save(ctx.vectors_key, ctx.course_keys, course_desc_matrix, course_name_matrix, desc_docs)
+    ctx.word_vectors = export_word_vectors(ctx)  # While the model is loaded, so searches never need it
+    ctx.course_nlp_descs = dict(zip(ctx.course_keys, desc_docs))
+    print('Loaded!')
+    return course_desc_matrix, course_name_matrix
+
+
+SEARCH_NAME_WEIGHT = 2.0  # A word in a course name counts this many times one in its summary
+SEARCH_RERANK_DEPTH = 100  # Best keyword matches rescored with their description vectors
+SEARCH_KEYWORD_SHARE = 0.6  # Part of a rescored match's score that comes from its keyword score
+
+
+def get_search_index() -> spse.BM25Index:
+    return spc.context().search_index
+
+
+def recommend_courses_using_search_text(search_text: str, num: int, offset: int = 0) -> List:
+    """
+    Returns courses num at a time, starting offset courses into the results, for a search. The best keyword matches
+    on course names and summaries come first, reranked by how close their descriptions are to the search text, then
+    the courses with only some of the words, then the courses closest in meaning. Equal scores go to the course listed
+    first, so the order is the same every time.
+    """
+    ctx = spc.context()
+    keyword_scores: np.ndarray = ctx.search_index.scores(search_text)
+    dense_scores: np.ndarray = ctx.course_desc_matrix @ normalized_matrix([text_vector(search_text)])[0]
+    order: np.ndarray = spse.ranking(keyword_scores, dense_scores, SEARCH_RERANK_DEPTH, SEARCH_KEYWORD_SHARE)
+    return [ctx.course_keys[i] for i in order[max(offset, 0):max(offset, 0) + max(num, 0)]]
+
+
+ANN_MIN_COURSES = 20000  # Catalogs at least this big are searched with the index instead of scoring every course
+ANN_NPROBE = 16  # Index lists scored per query, more gives better recall and slower queries
+
+
+def get_ann_index(build: bool = False) -> spa.IVFIndex:
+    """Loads the index saved with the vector cache, building and saving it if there is none or build is set."""
+    ctx = spc.context()
+    if build:
+        ctx.ann_index = ctx.build_ann_index()
+    return ctx.ann_index
 
 
 def recommend_courses_using_liked_courses(courses_liked: List[cd.Course], num: int) -> List[Tuple]:
-    course_similarity_dict: Dict[cd.Course, float] = {}
-    for crs in course_descs.keys():
-        if crs not in courses_liked:
-            desc_similarities: List[float] = [course_nlp_descs[crs].similarity(course_nlp_descs[course_liked]) for course_liked in courses_liked]
-            name_similarities: List[float] = [course_nlp_names[crs].similarity(course_nlp_names[course_liked]) for course_liked in courses_liked]
-            course_similarity_dict[crs] = ((sum(name_similarities) / len(name_similarities)) + 2*(sum(desc_similarities) / len(desc_similarities)))/3
-    keys = list(course_similarity_dict.keys())
-    vals = list(course_similarity_dict.values())
-    recommendations_list: List[(cd.Course, float)] = []
-    for i in range (0, num if num <= len(course_similarity_dict.keys()) else len(course_similarity_dict.keys())):
-        index: int = vals.index(max(vals))
-        recommendations_list.append((keys[index], vals[index]))
-        vals[index] = 0
-    return recommendations_list
+    ctx = spc.context()
+    liked: List[int] = [ctx.course_index[course] for course in courses_liked]
+    if len(liked) == 0:
+        return []
+    if len(ctx.course_keys) >= ANN_MIN_COURSES:
+        recommendation_list = approximate_recommendations(liked, num)
+        if recommendation_list is not None:
+            return recommendation_list
+    # The mean similarity to the liked courses is the similarity to the mean of their normalized vectors
+    course_name_matrix, course_desc_matrix = ctx.course_name_matrix, ctx.course_desc_matrix
+    name_similarities: np.ndarray = course_name_matrix @ course_name_matrix[liked].mean(axis=0)
+    desc_similarities: np.ndarray = course_desc_matrix @ course_desc_matrix[liked].mean(axis=0)
+    scores: np.ndarray = (name_similarities + 2 * desc_similarities) / 3
+    scores[liked] = -np.inf
+    return top_k(scores, min(num, len(ctx.course_keys) - len(set(liked))))
+
+
+def approximate_recommendations(liked: List[int], num: int) -> List[Tuple]:
+    """
+    Scores only the courses in the index lists closest to the liked courses, the score being the same as in
+    recommend_courses_using_liked_courses. Returns None if those lists hold fewer than num other courses.
+    """
+    ctx = spc.context()
+    course_name_matrix, course_desc_matrix = ctx.course_name_matrix, ctx.course_desc_matrix
+    name_mean: np.ndarray = course_name_matrix[liked].mean(axis=0)
+    desc_mean: np.ndarray = course_desc_matrix[liked].mean(axis=0)
+    ids: np.ndarray = ctx.ann_index.candidates(np.concatenate((name_mean, 2 * desc_mean)) / 3, ANN_NPROBE)
+    ids = ids[~np.isin(ids, liked)]
+    if len(ids) < num:
+        return None
+    scores: np.ndarray = (course_name_matrix[ids] @ name_mean + 2 * (course_desc_matrix[ids] @ desc_mean)) / 3
+    order: np.ndarray = np.lexsort((ids, -scores))[:num]
+    return [(ctx.course_keys[ids[i]], float(scores[i])) for i in order]
+
+
+def recommend_courses_using_liked_courses_batch(liked_lists: List[List[cd.Course]], nums: List[int]) -> List[List[Tuple]]:
+    """
+    Gives the results of recommend_courses_using_liked_courses for many lists of liked courses at once. The scores of
+    a chunk of lists come out of one matrix product per matrix instead of one matrix-vector product per list.
+    """
+    ctx = spc.context()
+    course_name_matrix, course_desc_matrix = ctx.course_name_matrix, ctx.course_desc_matrix
+    liked: List[List[int]] = [[ctx.course_index[course] for course in courses] for courses in liked_lists]
+    results: List[List[Tuple]] = [[] for _ in liked]
+    rows: List[int] = [i for i, indices in enumerate(liked) if indices]
+    for start in range(0, len(rows), BATCH_CHUNK):
+        chunk = rows[start:start + BATCH_CHUNK]
+        name_means: np.ndarray = np.stack([course_name_matrix[liked[i]].mean(axis=0) for i in chunk])
+        desc_means: np.ndarray = np.stack([course_desc_matrix[liked[i]].mean(axis=0) for i in chunk])
+        scores: np.ndarray = (course_name_matrix @ name_means.T + 2 * (course_desc_matrix @ desc_means.T)) / 3
+        for column, i in enumerate(chunk):
+            course_scores: np.ndarray = np.array(scores[:, column])
+            course_scores[liked[i]] = -np.inf
+            results[i] = top_k(course_scores, min(nums[i], len(ctx.course_keys) - len(set(liked[i]))))
+    return results
+
+
+BATCH_CHUNK = 256  # Lists scored per matrix product, bounding the score matrix to BATCH_CHUNK columns
+
+
+def top_k(scores: np.ndarray, num: int) -> List[Tuple]:
+    """Returns the num highest scoring (course, score) pairs, best first. Ties go to the course listed first."""
+    if num <= 0:
+        return []
+    kth: float = np.partition(scores, len(scores) - num)[len(scores) - num]
+    above: np.ndarray = np.flatnonzero(scores > kth)
+    best: np.ndarray = np.concatenate((above, np.flatnonzero(scores == kth)[:num - len(above)]))
+    best = best[np.lexsort((best, -scores[best]))]
+    course_keys: List[cd.Course] = spc.context().course_keys
+    return [(course_keys[i], float(scores[i])) for i in best]
 
 
 if __name__ == '__main__':
@@ -66,18 +219,19 @@ if __name__ == '__main__':
                 pprint(recommendation_list)
 
             elif opt == 2:
-                got: str = input('Input # of desired results, a semicolon, and search text: ')
+                got: str = input('Input # of desired results, a semicolon, and search text, optionally followed by a semicolon and # of results to skip: ')
                 gotargs: List[str] = got.split(';')
                 n: int = int(gotargs[0])
-                recommendation_list = recommend_courses_using_search_text(gotargs[1], n)
+                recommendation_list = recommend_courses_using_search_text(gotargs[1], n, int(gotargs[2]) if len(gotargs) > 2 else 0)
                 pprint(recommendation_list)
 
             elif opt == 3:
                 got: str = input('Input course to generate an SVG tree for: ')
                 gotargs: List[str] = got.split(' ')
                 course: cd.Course = cd.Course(gotargs[0], gotargs[1])
+                from spacy import displacy
                 with Path(course.program + course.designation + '.svg').open('w+', encoding='utf-8') as svg:
-                    svg.write(displacy.render(course_nlp_descs[course], style='dep', options={'compact': True, 'bg': 'white', 'color': 'black', 'font': 'DejaVu Sans Mono'}))
+                    svg.write(displacy.render(get_course_nlp_desc(course), style='dep', options={'compact': True, 'bg': 'white', 'color': 'black', 'font': 'DejaVu Sans Mono'}))
 
         except Exception as e:
             print('Failed:', e)
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import course_dictionary as cd
+
+# Bumped whenever the scheduler or recommender start giving different answers, so stored results aren't reused.
+# Scheduler keys also carry sameerpuri_scheduler.SCHEDULE_VERSION, so a scheduler change only needs that bumped.
+RESULT_FORMAT_VERSION = 2
+
+_MISSING = object()
+
+
+def canonical_courses(courses: Iterable[cd.Course]) -> List[cd.Course]:
+    """Sorts and deduplicates courses, so requests that only differ in order or repeats look the same."""
+    return sorted(set(cd.Course(*course) for course in courses))
+
+
+def request_key(kind: str, **parts) -> str:
+    """Builds a cache key out of the kind of request, its version and its canonical parts, e.g. courses lists and num."""
+    version = [RESULT_FORMAT_VERSION]
+    if kind == 'scheduler':
+        import sameerpuri_scheduler as sps  # Imported already by whatever made the schedule
+        version.append(sps.SCHEDULE_VERSION)
+    return json.dumps([kind, version, sorted(parts.items())], separators=(',', ':'))
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of results with a time to live, optionally backed by an SQLite file that survives restarts and
+    is shared by every process using it. Every entry is stamped with a version, the hash of whatever the results were
+    computed from (the catalog), and entries of another version are never returned.
+    Safe to use from several threads, and from forked processes, which each open their own database connection.
+    """
+
+    def __init__(self, version: str, max_entries: int = 1024, ttl: float = 3600, path: str = None):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.entries: 'OrderedDict[str, tuple]' = OrderedDict()  # key -> (time stored, result)
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'db_hits': 0, 'evictions': 0, 'expirations': 0}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: int = None
+
+    def get(self, key: str, default=None):
+        """Returns the cached result for key, or default on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                del self.entries[key]
+                self.counters['expirations'] += 1
+            value = self._db_get(key, now)
+            if value is not _MISSING:
+                self._remember(key, now, value)
+                self.counters['hits'] += 1
+                self.counters['db_hits'] += 1
+                return value
+            self.counters['misses'] += 1
+            return default
+
+    def put(self, key: str, value):
+        """Caches a result. It has to be picklable to be stored in the database."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self._db_put(key, now, value)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            db = self._connection()
+            if db is not None:
+                with db:
+                    db.execute('DELETE FROM results')
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key: str, now: float, value):
+        self.entries[key] = (now, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        # Connections can't cross a fork, so every process opens its own
+        if self.path is None:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            try:
+                self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+                self._db.execute('PRAGMA journal_mode=WAL')
+                with self._db:
+                    self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                                     '(key TEXT PRIMARY KEY, version TEXT, created REAL, value BLOB)')
+                    self._db.execute('DELETE FROM results WHERE version != ?', (self.version,))
+                self._db_pid = os.getpid()
+            except sqlite3.Error:  # Unwritable or corrupt database, carry on with memory only
+                self.path, self._db = None, None
+        return self._db
+
+    def _db_get(self, key: str, now: float):
+        db = self._connection()
+        if db is None:
+            return _MISSING
+        try:
+            row = db.execute('SELECT created, value FROM results WHERE key = ? AND version = ?',
+                             (key, self.version)).fetchone()
+            if row is None:
+                return _MISSING
+            if now - row[0] > self.ttl:
+                with db:
+                    db.execute('DELETE FROM results WHERE key = ?', (key,))
+                self.counters['expirations'] += 1
+                return _MISSING
+            return pickle.loads(row[1])
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return _MISSING
+
+    def _db_put(self, key: str, now: float, value):
+        db = self._connection()
+        if db is None:
+            return
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                           (key, self.version, now, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        except (sqlite3.Error, pickle.PicklingError):
+            pass
+
+
+def catalog_version(*parts: str) -> str:
+    """Hashes the xlsx catalog together with any other inputs results depend on, such as the vector cache key."""
+    digest = hashlib.sha256()
+    digest.update(cd.catalog_digest() or b'no catalog')
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()[:32]
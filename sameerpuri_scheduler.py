@@ -2,22 +2,19 @@
 # Sameer Puri
 # I received help from Guimin in seeing ways that I might implement a heuristic.
 
-# The scheduler I wrote in python 3.6.2 uses a heuristic depth first search to try to find a valid schedule. It reasons
-# in terms of taken courses as "operators" that are placed in a plan. The courses in the initial state are placed in the
-# plan as though they were courses taken in the summer before freshman year. On each recursive call, the scheduler tries
-# to achieve the first goal in goal_conditions (goal_conditions[0]). It iterates through each combo of term and
-# prerequisite clause possible, ignoring terms that don't make sense. Once it finds a valid combination, it adds it to
-# the current plan and does a further recursive call, replacing goal_conditions[0] with its current clause.
-# Somewhere down the line, if a goal cannot be scheduled in any term, the course we initially tried has failed and the
-# recursion stack unwinds one by one, trying the next combo of term and prerequisite clause for the current goal until
-# and doing a recursive call again.
+# The scheduler I wrote in python 3.6.2 reasons in terms of taken courses as "operators" that are placed in a plan. The
+# courses in the initial state count as though they were taken in the summer before freshman year. Finding the plan is
+# a constraint satisfaction problem, solved by ScheduleSearch in two phases. The first phase decides which courses to
+# take, picking a prerequisite clause for every goal and then for every course in the chosen clauses. Each of those
+# courses carries a deadline, and after every decision the deadlines are propagated down the chosen clauses and the
+# search backtracks as soon as some course can't be done in time or the hours needed don't fit in the terms left. The
+# second phase assigns terms to the chosen courses, filling each term with the courses whose deadlines are earliest.
 
 # A heuristic of the "minimum requirement tree height" is used. This is the minimum number of semesters a course needs
-# for it and its prerequisites to be scheduled, given the initial state. This is used to limit the terms that are
-# evaluated in term and prereq clause combinations. A variation on the heuristic is also employed where the instead of
-# the initial state, the current plan is used. This is used to sort the prereqs of a goal so that those clauses that are
-# heuristically "closest" are tried first. It is also used to sort the requirements inside of a clause so that the
-# hardest ones are placed first.
+# for it and its prerequisites to be scheduled, given the initial state, and is the earliest term the course can be
+# done in. Together with the deadlines it bounds the terms each course can go in. The prerequisite clauses that add the
+# fewest hours to the plan are tried first. Both heuristics are precomputed for the whole catalog by sameerpuri_prereqs,
+# which keeps them between searches and only recomputes the courses affected by a different initial state.
 
 # I used the tests from Brian Gauch's autograder to evaluate my scheduler. Test cases 1 through 4 succeeded, but I
 # encountered some technical difficulties with how the grader evaluated by solution output. In some cases, it could
@@ -27,18 +24,25 @@
 # continue to make my code time out in trying to find a solution. I have tried my hardest to figure out why it recurses
 # infinitely, but I cannot find any good explanation other than there are too many open electives that it has to handle
 # so it takes ages. I am certain there isn't a solution for test case 5, so it should return the empty set, and that
-# there is a solution for test case 6.
+# there is a solution for test case 6. That depth first search has since been replaced by ScheduleSearch. On the cases
+# sameerpuri_benchmark runs, it finds a plan for a major with up to ten goals in a fraction of a second, but some goal
+# sets with ten goals, and cs_major_many, still run for minutes without a plan or a proof that there is none.
 
 # Thank you for reading, sorry if that was a bit lengthy. :)
 
+import multiprocessing
+import os
+import random
+import time
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from enum import IntEnum
-from typing import Dict, List
-import pandas as pd
-import course_dictionary as cd
-import sameerpuri_matcher as spm
-if __name__ == '__main__':
-    import sameerpuri_recommender as spr
+from typing import Dict, Iterable, List, Tuple, Union
+from sameerpuri_prereqs import MAX_TERM, MAX_HOURS, UNREACHABLE, CatalogCache, prereq_index
+
+# Bumped whenever the scheduler starts giving different schedules for the same request, e.g. a change to the search
+# order or to padding, so the result cache doesn't return schedules stored by an older build (see sameerpuri_resultcache)
+SCHEDULE_VERSION = 1
 
 # Some classes useful to the scheduler
 Course = namedtuple('Course', 'program, designation')
@@ -59,29 +63,46 @@ class Year(IntEnum):
 
 
 class Term:
-
-    def __init__(self, semester, year):
-        self.semester = semester
-        self.year = year
-        semesterNo = Semester(semester)
-        yearNo = Year(year)
-        self.termNo = int(yearNo) * 3 + int(semesterNo)
+    # Terms are flyweights: there are only 12 of them, made once below, and Term(semester, year) returns the existing
+    # one. They are ordered by termNo, which int() also gives.
+    __slots__ = ('semester', 'year', 'termNo')
+    _instances = {}
+
+    def __new__(clazz, semester, year):
+        term = clazz._instances.get((semester, year))
+        if term is None:  # Not made yet, or given plain ints
+            semesterNo = Semester(semester)
+            yearNo = Year(year)
+            term = clazz._instances[int(yearNo) * 3 + int(semesterNo)]
+        return term
 
     # Basically a second constructor
     @classmethod
     def initFromTermNo(clazz, termNo):
-        # intentional integer division
-        yearNo = int(int(termNo - 1) / int(3))
-        semesterNo = termNo - (3 * yearNo)
-        semester = Semester(semesterNo)
-        year = Year(yearNo)
-        return clazz(semester, year)
+        return clazz._instances[termNo]
+
+    @classmethod
+    def _make(clazz, semester, year):
+        term = object.__new__(clazz)
+        term.semester = semester
+        term.year = year
+        term.termNo = int(year) * 3 + int(semester)
+        clazz._instances[(semester, year)] = clazz._instances[term.termNo] = term
+
+    def __reduce__(self):  # Unpickles to the existing instance
+        return Term, (self.semester, self.year)
+
+    def __int__(self):
+        return self.termNo
+
+    def __index__(self):
+        return self.termNo
 
     def __hash__(self):
-        return hash(self.termNo)
+        return self.termNo
 
     def __eq__(self, other):
-        return other and self.termNo == other.termNo
+        return self is other or (isinstance(other, Term) and self.termNo == other.termNo)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -89,6 +110,12 @@ class Term:
     def __ge__(self, other):  # Define ge
         return self.termNo >= other.termNo
 
+    def __gt__(self, other):
+        return self.termNo > other.termNo
+
+    def __le__(self, other):
+        return self.termNo <= other.termNo
+
     def __lt__(self, other):  # Define lt
         return self.termNo < other.termNo
 
@@ -102,7 +129,14 @@ class Term:
         return "(%s, %s)" % (self.semester, self.year)
 
 
+for _year in Year:
+    for _semester in Semester:
+        Term._make(_semester, _year)
+del _year, _semester
+
+
 class ScheduledCourse:
+    __slots__ = ('course', 'courseInfo', 'term', 'clause')
 
     def __init__(self, course, courseInfo, term: Term, clause: List[Course]):
         self.course = course
@@ -129,17 +163,65 @@ class ScheduledCourse:
 
 
 def course_scheduler(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course]) -> Dict[Course, CourseInfo]:
-    # Run the internal scheduler, considering the initial state as part of an
-    # already scheduled plan
-    result_plan = internal_scheduler(course_descriptions, goal_conditions, list(
-        map(lambda course: ScheduledCourse(course, course_descriptions[course], Term(Semester.Summer, Year.Frosh), []), initial_state)), {})
-    # Filter out the initial state that was passed to the scheduler
-    result_plan = list(filter(lambda sc: sc.term != Term(Semester.Summer, Year.Frosh), result_plan))
-    # Push higher level requirements down to the semester in which they are
-    # fulfilled
-    push_higher_levels(result_plan)
+    # Search for a plan of the goals and their prerequisites, the initial state counts as already taken
+    result_plan = internal_scheduler(course_descriptions, goal_conditions, initial_state)
+    return to_schedule_dict(course_descriptions, result_plan, initial_state)
+
+
+# Anytime scheduling: like course_scheduler, but the search stops once a budget of wall clock seconds and/or search nodes
+# runs out. If no plan for every goal is found by then, or there is none, the goals are added back one at a time in the
+# order given, keeping each that a plan can still be found for, so the best partial plan is the one with the most goals
+# that fit in the budget. Plans never overload a term, so that is the only way one plan is better than another.
+# Setting the cancel Event stops it like running out of budget. A SearchTracer (see sameerpuri_trace) records every search.
+# Returns the schedule and a report of which goals were met and the search statistics.
+def anytime_scheduler(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course],
+                      time_budget: float = None, node_budget: int = None, cancel=None, tracer=None) -> Tuple[Dict[Course, CourseInfo], dict]:
+    start = time.monotonic()
+    stop_at = None if time_budget is None else start + time_budget
+    goals = list(dict.fromkeys(goal_conditions))
+    stats = {'nodes': 0, 'depth': 0, 'prunes': {}, 'searches': 0, 'exhausted': False}
+
+    def search(subgoals: List[Course], share: float) -> 'ScheduleSearch':
+        left = None if stop_at is None else max(stop_at - time.monotonic(), 0)
+        nodes = None if node_budget is None else max(node_budget - stats['nodes'], 0)
+        attempt = (ScheduleSearch if tracer is None else tracer.search)(
+            course_descriptions, subgoals, initial_state, stop_at=None if left is None else time.monotonic() + left * share,
+            max_nodes=None if nodes is None else int(nodes * share), cancel=cancel)
+        found = attempt.run()
+        attempt_stats = attempt.stats()
+        stats['nodes'] += attempt_stats['nodes']
+        stats['depth'] = max(stats['depth'], attempt_stats['depth'])
+        for reason, count in attempt_stats['prunes'].items():
+            stats['prunes'][reason] = stats['prunes'].get(reason, 0) + count
+        stats['searches'] += 1
+        stats['exhausted'] |= attempt.exhausted
+        return attempt if found else None
+
+    budgeted = time_budget is not None or node_budget is not None
+    best = search(goals, ANYTIME_FULL_SHARE if budgeted and len(goals) > 1 else 1)
+    met = goals if best is not None else []
+    if best is None:
+        for i, goal in enumerate(goals):
+            if cancel is not None and cancel.is_set():
+                break
+            attempt = search(met + [goal], 1 / (len(goals) - i))  # Split what's left between the goals left
+            if attempt is not None:
+                best, met = attempt, met + [goal]
+    schedule = to_schedule_dict(course_descriptions, best.plan() if best is not None else [], initial_state)
+    report = {'complete': len(met) == len(goals), 'goals_met': met, 'goals_missed': [goal for goal in goals if goal not in met],
+              'seconds': time.monotonic() - start}
+    report.update(stats)
+    return schedule, report
+
+
+# The part of an anytime budget the search for every goal gets, the rest is kept for finding a partial plan
+ANYTIME_FULL_SHARE = 0.5
+
+
+# Converts a plan to the dict course_scheduler returns
+def to_schedule_dict(course_descriptions: Dict[Course, CourseInfo], result_plan: List[ScheduledCourse], initial_state: List[Course]) -> Dict[Course, CourseInfo]:
     # Pads semesters below 12 hours to 12 hours.
-    result_plan = pad_to_12_hours(course_descriptions, result_plan)
+    result_plan = pad_to_12_hours(course_descriptions, result_plan, initial_state)
     # Restructure the plan to match the specification
     schedule_dict = {operator.course: CourseInfo(operator.courseInfo.credits, Term(
         operator.term.semester, operator.term.year), operator.courseInfo.prereqs) for operator in result_plan}
@@ -147,189 +229,832 @@ def course_scheduler(course_descriptions: Dict[Course, CourseInfo], goal_conditi
     return schedule_dict
 
 
-def internal_scheduler(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], current_plan: List[ScheduledCourse], memo_table_for_tree_height: Dict[Course, int], depth = 0):
-    if len(goal_conditions) == 0:  # There's nothing left to do!
-        if is_valid_plan(current_plan):  # If it's valid, return the plan, else return a failure
-            return current_plan
-        else:
-            return ()
-    # Get the initial state from the current plan
-    initial_state = list(map(lambda sc: sc.course, list(filter(lambda sc: sc.term == Term(Semester.Summer, Year.Frosh), current_plan))))
-
-    # Remove duplicates in the goal conditions
-    goal_conditions = make_unique(goal_conditions)
-
-    # Sort so the easiest goals to achieve are fulfilled first. This reduces the
-    # number of iterations necessary, though slightly counterintuitive.
-    goal_conditions = list(sorted(goal_conditions, key=lambda g: minimum_tree_hours(course_descriptions, g, initial_state[:], {})))
-    goal = goal_conditions[0]  # Consider the first goal as the current goal
-    goal_info = course_descriptions[goal]  # Get its info
-
-    # Calculate the current hours per semester
-    hours_per_term = get_hour_counts(current_plan)
-
-    # Return a failure if there aren't enough hours available to schedule current goals, 70% is a reasonable estimate.
-    number_hours_remaining = 0
-    number_hours_current_state = initial_state[:]
-    number_hours_dict = {}
-    for g in goal_conditions:
-        number_hours_remaining += minimum_tree_hours(course_descriptions, g, number_hours_current_state, number_hours_dict)
-    if 8 * 18 - sum(hours_per_term.values()) < number_hours_remaining * 0.7:
-        return ()
-    del number_hours_remaining, number_hours_current_state, number_hours_dict
-
-    # Find the min height of the requirement tree for the current goal. It
-    # can't be placed in a semester before this.
-    goal_min_height = minimum_tree_height(course_descriptions, goal, initial_state[:], {})
-
-    # Boost the minimum height for filled semesters
-    for i, (term, hours) in enumerate(hours_per_term.items(), 1):
-        if i < goal_min_height: # Not far enough
-            continue
-        if i > goal_min_height: # Gone too far
+# Incremental rescheduling: given the schedule course_scheduler made for goal_conditions and initial_state, and some
+# courses added to or removed from either, repairs the schedule instead of starting over. The repair reuses the clauses
+# of the old schedule and keeps every course of it that is still needed in the same term, so only the courses the change
+# touches move. If that fails, the courses whose prerequisites changed are let go of too, and only if that also fails
+# (or either takes more than REPAIR_NODE_BUDGET nodes) is a full search run, an anytime one if there is a time budget.
+# Returns the schedule and a report of whether the repair worked, how many courses kept their term and the goals met.
+def reschedule(course_descriptions: Dict[Course, CourseInfo], previous_schedule: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course],
+               added_initial: List[Course] = (), removed_initial: List[Course] = (), added_goals: List[Course] = (), removed_goals: List[Course] = (),
+               time_budget: float = None) -> Tuple[Dict[Course, CourseInfo], dict]:
+    start = time.monotonic()
+    stop_at = None if time_budget is None else start + time_budget
+    initial_state = [course for course in initial_state if course not in removed_initial] + [course for course in added_initial if course not in initial_state]
+    goal_conditions = [course for course in goal_conditions if course not in removed_goals] + [course for course in added_goals if course not in goal_conditions]
+    index = prereq_index(course_descriptions)
+    changed = index.mask(list(added_initial) + list(removed_initial) + list(added_goals) + list(removed_goals))
+    pins = {course: term_to_height(info.terms) for course, info in previous_schedule.items()
+            if int(info.credits) > 0 and info.terms.semester != Semester.Summer}
+    unaffected = {course: term for course, term in pins.items()
+                  if course not in index.ids or not (index.closure[index.ids[course]] | 1 << index.ids[course]) & changed}
+    nodes = 0
+    for attempt in (pins, unaffected):
+        search = ScheduleSearch(course_descriptions, goal_conditions, initial_state, pins=attempt, max_nodes=REPAIR_NODE_BUDGET, stop_at=stop_at)
+        found = search.run()
+        nodes += search.nodes
+        if found:
+            plan = keep_fillers(course_descriptions, search.plan(), previous_schedule, initial_state)
+            schedule = to_schedule_dict(course_descriptions, plan, initial_state)
+            report = {'repaired': True, 'complete': True, 'goals_met': goal_conditions, 'goals_missed': [], 'exhausted': False}
+            report.update(search.stats())
             break
-        if hours+int(goal_info.credits) > 18:
-            goal_min_height += 1
-
-    if goal in map(lambda op: op.course, current_plan):  # Course already taken
-        goal_conditions.remove(goal)
-        return internal_scheduler(course_descriptions, goal_conditions, current_plan, memo_table_for_tree_height)
-
-    # Filter the potential clauses so only the easiest ones to fulfill are tried. If there are no clauses, provide
-    # an empty clause to the for loop.
-    sorted_dnf_clauses = []
-    if len(goal_info.prereqs) != 0:
-        dnf_clauses_to_hours = {}
-        for dnf_clause in goal_info.prereqs:
-            hours = 0
-            for dnf_clause_req in dnf_clause:
-                hours += minimum_tree_hours(course_descriptions, dnf_clause_req, initial_state[:], {})
-            dnf_clauses_to_hours[dnf_clause] = hours
-        dnf_clauses_min_hours = min(dnf_clauses_to_hours.values())
-        sorted_dnf_clauses = list(filter(lambda dnf_clause: dnf_clauses_to_hours[dnf_clause] == dnf_clauses_min_hours, goal_info.prereqs))
     else:
-        sorted_dnf_clauses.append([])
-
-    # Check each possible term (excluding Summers) for non-higher-level requirements starting from the min_height until
-    # Spring of senior year. For higher level requirements, this doesn't matter because they can be scheduled any time
-    # and corrected after evaluation is complete, so we only try Spring Senior
-    # Year.
-    terms_iter = iter(map(lambda i: height_to_term(i), range(goal_min_height, 9)) if not is_higher_level_course_info(goal_info) else [Term(Semester.Spring, Year.Senior)])
-    minimum_term = height_to_term(goal_min_height)
-    for term in terms_iter:
-        if term < minimum_term:  # Minimum term is specified by a failed inner loop
+        left = None if stop_at is None else max(stop_at - time.monotonic(), 0)
+        schedule, report = anytime_scheduler(course_descriptions, goal_conditions, initial_state, time_budget=left)
+        report['repaired'] = False
+    report['nodes'] = nodes + (0 if report['repaired'] else report['nodes'])
+    report['kept'] = sum(1 for course, info in schedule.items() if course in previous_schedule and previous_schedule[course].terms == info.terms)
+    report['seconds'] = time.monotonic() - start
+    return schedule, report
+
+
+# Nodes each repair attempt may take before giving up, a repair that works needs about as many as there are courses
+REPAIR_NODE_BUDGET = 500
+
+
+# Puts the courses an old schedule was padded with back in their terms, as long as the terms stay below 12 hours, so
+# repairing a schedule doesn't swap them for other fillers
+def keep_fillers(course_descriptions: Dict[Course, CourseInfo], plan: List[ScheduledCourse], previous_schedule: Dict[Course, CourseInfo], taken: List[Course]) -> List[ScheduledCourse]:
+    in_plan = set(operator.course for operator in plan) | set(taken)
+    hours = get_hour_counts(plan)
+    for course, info in previous_schedule.items():
+        courseinfo = course_descriptions.get(course)
+        if courseinfo is None or course in in_plan or courseinfo.prereqs or info.terms not in hours:
             continue
-        if int(goal_info.credits) + hours_per_term[term] > 18:  # Too many hours
-            continue
-        if term.semester.name not in goal_info.terms:  # Not offered in this term
-            continue
-        if not is_higher_level_course_info(goal_info):  # Don't schedule in same sem or after course that uses the goal
-            violates_another = False
-            for op in current_plan:
-                if is_higher_level_course_info(op.courseInfo) or op.term.semester == Semester.Summer:
-                    continue
-                if term >= op.term and goal in op.clause:
-                    violates_another = True
+        if hours[info.terms] + int(courseinfo.credits) <= 12:
+            plan.append(ScheduledCourse(course, courseinfo, info.terms, []))
+            hours[info.terms] += int(courseinfo.credits)
+    return plan
+
+
+# Portfolio scheduling: runs ScheduleSearch with a different heuristic in each of a pool of worker processes. Which
+# ordering finds a plan fastest changes a lot between requests, so the first plan found is the answer and the other
+# workers are then cancelled. Every ordering is meant to search the same space, and they agree with an exhaustive search
+# on the small catalogs of sameerpuri_benchmark --check, but that is no proof, so a search that finds nothing doesn't
+# stop the others: there is no plan only once every worker has finished without one. The workers are forked, so they share the catalog and its prereq index with this process instead of unpickling copies.
+# The pool is forked for each call, so it is for scripts, not servers running other threads (see worker_pool).
+# Returns the schedule and a report of the heuristic that won, its statistics and whether the time budget ran out first.
+def portfolio_scheduler(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course],
+                        workers: int = None, time_budget: float = None) -> Tuple[Dict[Course, CourseInfo], dict]:
+    start = time.monotonic()
+    stop_at = None if time_budget is None else start + time_budget
+    workers = min(workers or os.cpu_count() or 1, len(HEURISTICS))
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        workers = 1
+    if workers == 1:
+        result = _run_heuristic(course_descriptions, goal_conditions, initial_state, HEURISTICS[0], stop_at, None)
+    else:
+        prereq_index(course_descriptions)  # Built before forking so the workers inherit it
+        context = multiprocessing.get_context('fork')
+        cancel = context.Event()
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(course_descriptions, cancel)) as pool:
+            futures = [pool.submit(_run_portfolio_member, goal_conditions, initial_state, heuristic, stop_at)
+                       for heuristic in HEURISTICS[:workers]]
+            results = []
+            for future in as_completed(futures):
+                results.append(future.result())
+                if results[-1]['found']:
                     break
-            if violates_another:
-                break  # Gone too far, no further iteration will find a solution
-        # Now we know scheduling the course is definitely possible...
-        next_operation = ScheduledCourse(
-            goal, goal_info, term, [])  # Construct an operator for the goal
-        # Create a copy of the current plan with the next operation in it
-        next_plan = current_plan[:]
-        next_plan.append(next_operation)
-        for i, goal_dnf_clause in enumerate(sorted_dnf_clauses):  # Try each dnf clause
-            if not is_higher_level_course_info(goal_info):  # Don't schedule in same sem or before a prerequisite course
-                violates_another = False
-                for op in current_plan:
-                    if is_higher_level_course_info(op.courseInfo) or op.term.semester == Semester.Summer:
-                        continue
-                    if op.term >= term and op.course in goal_dnf_clause:
-                        violates_another = True
-                        minimum_term = op.term  # Specify the min term to optimize outer loop
-                        break
-                if violates_another:
+            # Without a plan, report a search that finished over one that ran out of time
+            result = results[-1] if results[-1]['found'] else min(results, key=lambda member: member['exhausted'])
+            cancel.set()
+            for future in futures:
+                future.cancel()
+    plan = result.pop('plan')
+    result.update(workers=workers, seconds=time.monotonic() - start)
+    return to_schedule_dict(course_descriptions, plan, initial_state), result
+
+
+# Runs one member of a portfolio, returning its plan (empty if none was found) and statistics
+def _run_heuristic(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course],
+                   heuristic: 'Heuristic', stop_at: float, cancel) -> dict:
+    search = ScheduleSearch(course_descriptions, goal_conditions, initial_state, stop_at=stop_at, heuristic=heuristic, cancel=cancel)
+    found = search.run()
+    result = {'heuristic': heuristic.name, 'found': found, 'exhausted': search.exhausted, 'plan': search.plan() if found else []}
+    result.update(search.stats())
+    return result
+
+
+# The catalog and cancel event of a pool worker, inherited when the pool forks it
+_worker_catalog: Dict[Course, CourseInfo] = None
+_worker_cancel = None
+
+
+def _init_worker(course_descriptions: Dict[Course, CourseInfo], cancel):
+    global _worker_catalog, _worker_cancel
+    _worker_catalog, _worker_cancel = course_descriptions, cancel
+
+
+def _run_portfolio_member(goal_conditions: List[Course], initial_state: List[Course], heuristic: 'Heuristic', stop_at: float) -> dict:
+    return _run_heuristic(_worker_catalog, goal_conditions, initial_state, heuristic, stop_at, _worker_cancel)
+
+
+# A pool of forked workers that have the catalog, for schedule_many and cohort_scheduler to share between calls. A
+# process only forks safely while none of its other threads holds a lock, or the children can deadlock on it, so make
+# the pool before starting any, e.g. in gunicorn's post_fork, and keep it for the life of the process. Every worker is
+# started here rather than on first use.
+def worker_pool(course_descriptions: Dict[Course, CourseInfo], workers: int = None) -> ProcessPoolExecutor:
+    workers = workers or os.cpu_count() or 1
+    pool = _fork_pool(course_descriptions, workers)
+    list(pool.map(abs, range(workers)))
+    return pool
+
+
+def _fork_pool(course_descriptions: Dict[Course, CourseInfo], workers: int) -> ProcessPoolExecutor:
+    prereq_index(course_descriptions)  # Built before forking so the workers inherit it
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'), initializer=_init_worker,
+                               initargs=(course_descriptions, None))
+
+
+# Batch scheduling: schedules many (goal_conditions, initial_state) requests with anytime_scheduler, fanned out over a
+# pool of forked worker processes. Yields (position in requests, schedule, report) as each one finishes, so callers
+# can pass results on before the slowest is done. Every request gets the whole time budget, counted from when a worker
+# starts on it. Without a pool from worker_pool, one is forked for the call, which scripts can do but servers running
+# other threads shouldn't.
+def schedule_many(course_descriptions: Dict[Course, CourseInfo], requests: List[Tuple[List[Course], List[Course]]],
+                  workers: int = None, time_budget: float = None, pool: ProcessPoolExecutor = None):
+    workers = min(workers or os.cpu_count() or 1, max(len(requests), 1))
+    if pool is None and (workers == 1 or 'fork' not in multiprocessing.get_all_start_methods()):
+        for i, (goal_conditions, initial_state) in enumerate(requests):
+            yield (i,) + anytime_scheduler(course_descriptions, goal_conditions, initial_state, time_budget=time_budget)
+        return
+    own_pool = pool is None
+    if own_pool:
+        pool = _fork_pool(course_descriptions, workers)
+    futures = {pool.submit(_run_batch_member, goal_conditions, initial_state, time_budget): i
+               for i, (goal_conditions, initial_state) in enumerate(requests)}
+    try:
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
+    finally:  # The caller stopped early, don't start on the rest
+        for future in futures:
+            future.cancel()
+        if own_pool:
+            pool.shutdown()
+
+
+def _run_batch_member(goal_conditions: List[Course], initial_state: List[Course], time_budget: float) -> Tuple[Dict[Course, CourseInfo], dict]:
+    return anytime_scheduler(_worker_catalog, goal_conditions, initial_state, time_budget=time_budget)
+
+
+# Cohort scheduling: schedules many students, each a (goal_conditions, initial_state) request, so that no course has
+# more students in a term than it has seats. capacity maps courses to their seats, the same number every term or a dict
+# of term number (1 to 8) to seats; courses left out have no limit. Every student is first scheduled alone, fanned out
+# over a pool of forked workers like schedule_many. Then, in order, each student keeps their plan if every course-term
+# in it has a seat left, and takes those seats. The others are scheduled again, a pool's worth at a time, with the
+# course-terms that are full closed to them, until everyone has seats or can't be scheduled without overloading a
+# course-term; those keep their first plan. Only the courses goals need take seats, not the ones terms are padded with.
+# Like schedule_many, it forks a pool for the call unless given one from worker_pool.
+# Returns a schedule per student and a report of the rounds, searches, the students over capacity or without any plan,
+# and every overloaded course-term with the number of students in it and its seats.
+def cohort_scheduler(course_descriptions: Dict[Course, CourseInfo], students: List[Tuple[List[Course], List[Course]]],
+                     capacity: Dict[Course, Union[int, Dict[int, int]]], workers: int = None,
+                     time_budget: float = None, pool: ProcessPoolExecutor = None) -> Tuple[List[Dict[Course, CourseInfo]], dict]:
+    start = time.monotonic()
+    seats: Dict[Tuple[Course, int], int] = {}
+    for course, course_seats in capacity.items():
+        for term in range(1, MAX_TERM + 1):
+            term_seats = course_seats.get(term) if isinstance(course_seats, dict) else course_seats
+            if term_seats is not None:
+                seats[course, term] = int(term_seats)
+    workers = min(workers or os.cpu_count() or 1, max(len(students), 1))
+    if pool is None and 'fork' not in multiprocessing.get_all_start_methods():
+        workers = 1
+    plans: List[List[ScheduledCourse]] = [[] for _ in students]
+    first_plans: List[List[ScheduledCourse]] = [None] * len(students)
+    taken: Dict[Tuple[Course, int], int] = {}  # Seats taken in each limited course-term
+    closed: Dict[Course, set] = {}
+    over_capacity, failed = [], []
+    todo, rounds, searches = list(range(len(students))), 0, 0
+    own_pool = pool is None and workers > 1
+    if own_pool:
+        pool = _fork_pool(course_descriptions, workers)
+    try:
+        while todo:
+            rounds += 1
+            batch, todo = (todo, []) if rounds == 1 else (todo[:workers], todo[workers:])
+            args = [(students[i][0], students[i][1], {course: frozenset(terms) for course, terms in closed.items()}, time_budget)
+                    for i in batch]
+            if pool is None:
+                results = [_cohort_plan(course_descriptions, *arg) for arg in args]
+            else:
+                results = pool.map(_run_cohort_member, *zip(*args), chunksize=max(1, len(args) // (workers * 4)))
+            searches += len(batch)
+            bumped = []
+            for i, plan in zip(batch, results):
+                if plan is None:  # No plan in the course-terms left
+                    (failed if first_plans[i] is None else over_capacity).append(i)
+                    continue
+                if first_plans[i] is None:
+                    first_plans[i] = plan
+                uses = [key for key in _course_terms(plan) if key in seats]
+                if any(taken.get(key, 0) >= seats[key] for key in uses):
+                    bumped.append(i)
                     continue
+                plans[i] = plan
+                for key in uses:
+                    taken[key] = taken.get(key, 0) + 1
+                    if taken[key] >= seats[key]:
+                        closed.setdefault(key[0], set()).add(key[1])
+            todo = bumped + todo
+    finally:
+        if own_pool:
+            pool.shutdown()
+    enrolled: Dict[Tuple[Course, int], int] = dict(taken)
+    for i in over_capacity:
+        plans[i] = first_plans[i]
+        for key in _course_terms(plans[i]):
+            if key in seats:
+                enrolled[key] = enrolled.get(key, 0) + 1
+    overloaded = [(course, height_to_term(term), count, seats[course, term])
+                  for (course, term), count in sorted(enrolled.items(), key=lambda item: (item[0][1], item[0][0]))
+                  if count > seats[course, term]]
+    schedules = [to_schedule_dict(course_descriptions, plan, initial_state) for plan, (_, initial_state) in zip(plans, students)]
+    report = {'students': len(students), 'rounds': rounds, 'searches': searches, 'over_capacity': sorted(over_capacity),
+              'failed': sorted(failed), 'overloaded': overloaded, 'workers': workers, 'seconds': time.monotonic() - start}
+    return schedules, report
+
+
+# The plan of one student of a cohort with some course-terms closed, or None if there is none
+def _cohort_plan(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course],
+                 closed: Dict[Course, Iterable[int]], time_budget: float) -> List[ScheduledCourse]:
+    stop_at = None if time_budget is None else time.monotonic() + time_budget
+    search = ScheduleSearch(course_descriptions, goal_conditions, initial_state, stop_at=stop_at, closed=closed)
+    return search.plan() if search.run() else None
+
+
+def _run_cohort_member(goal_conditions: List[Course], initial_state: List[Course], closed: Dict[Course, Iterable[int]],
+                       time_budget: float) -> List[ScheduledCourse]:
+    return _cohort_plan(_worker_catalog, goal_conditions, initial_state, closed, time_budget)
+
+
+# The (course, term number) of every course of a plan that takes a seat
+def _course_terms(plan: List[ScheduledCourse]) -> List[Tuple[Course, int]]:
+    return [(operator.course, term_to_height(operator.term)) for operator in plan if int(operator.courseInfo.credits) > 0]
+
+
+# Runs the search engine and returns the plan it found as a list of operators, or an empty list if there is none.
+def internal_scheduler(course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course]) -> List[ScheduledCourse]:
+    search = ScheduleSearch(course_descriptions, goal_conditions, initial_state)
+    return search.plan() if search.run() else []
+
+
+class ScheduleSearch:
+    # A constraint-propagating search for a plan, done in two phases.
+    #
+    # The first phase decides which courses to take: it picks a prereq clause for every required course, starting
+    # from the goals. Every required course carries a deadline, the last term it can be done in. Goals must be done by
+    # Spring of senior year, the clause of a course must be done before the last term the course is offered in by its
+    # deadline, and the clause of a higher level requirement must be done by the requirement's own deadline (it is
+    # fulfilled in the term its last course is taken). Deadlines are propagated down the chosen clauses after every
+    # decision, and the search backtracks as soon as
+    #   - a course can't be done by its deadline because of its prerequisite chain or the terms it is offered in
+    #   - the courses required so far, plus those the open requirements are certain to need, can't fit in the hours of
+    #     the terms between their earliest term and deadline
+    # Forced decisions are made first, and a requirement that a clause of already required courses meets tries that
+    # clause first, since it adds no courses to the plan. It still orders those courses before the requirement, which
+    # can push the requirement into terms that are already full, so the other clauses are tried after it. Requirements
+    # with many alternatives (electives) are left for last, so they are often met that way. Only one of the clauses
+    # that differ just in interchangeable courses (see PrereqIndex) is tried, since swapping those courses turns any
+    # plan using one clause into a plan using the other. Courses that are already required aren't interchangeable with
+    # ones that aren't, so clauses with them are kept.
+    #
+    # The second phase assigns terms to the chosen courses, from Fall of freshman year on. Taking a course earlier never
+    # hurts, since nothing has to come after it, so each term is filled with a maximal set of the courses available in
+    # it, trying those with the earliest deadlines first. If no assignment exists, the first phase backtracks.
+    #
+    # A search can be pinned to a previous plan: the clauses of pinned courses are tried first, and pinned courses that
+    # are still required have to be taken in the same term, so only the courses around them move.
+    #
+    # Terms can also be closed for some courses, e.g. because their sections are full. The courses are then treated as
+    # not offered in those terms, and are never merged with courses they would otherwise be interchangeable with.
+    #
+    # The search can be given a budget, a time.monotonic() time to stop at and/or a number of nodes. Once it runs out,
+    # run() gives up and returns False with exhausted set. stats() counts the nodes, the deepest decision and the prunes.
+    # Each prune also names the check that failed: a goal that can't be done in time at all ('goal'), a decision whose
+    # deadlines can't be met in the terms the courses are offered ('propagation'), a prerequisite chain too long for a
+    # deadline ('chain'), hours that don't fit a window of terms ('window'), a pinned term that can't be kept ('pin'),
+    # a course whose prerequisites push it past its deadline ('ordering') or a term load that can't fit ('term hours').
+    # TracedScheduleSearch in sameerpuri_trace records those and where the time goes.
+    #
+    # Courses are the integer ids of the catalog's PrereqIndex and sets of courses are bitmasks of them. The state of
+    # both phases lives in arrays indexed by id and in fixed per-term arrays, changed in place and undone in O(1) when
+    # backtracking, so no plan is copied and no Term is made until plan() is called.
+
+    def __init__(self, course_descriptions: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course], merge_equivalent: bool = True,
+                 stop_at: float = None, max_nodes: int = None, heuristic: 'Heuristic' = None, cancel=None,
+                 pins: Dict[Course, int] = None, closed: Dict[Course, Iterable[int]] = None):
+        self.course_descriptions = course_descriptions
+        self.merge_equivalent = merge_equivalent
+        self.stop_at = stop_at
+        self.max_nodes = max_nodes
+        self.heuristic = heuristic or HEURISTICS[0]
+        self.random = random.Random(self.heuristic.seed) if self.heuristic.seed is not None else None
+        self.cancel = cancel  # An Event that stops the search like a budget when set
+        self.index = prereq_index(course_descriptions)
+        # Terms, 1 to 8, that courses have to be taken in if they are required, used to repair a previous plan
+        self.pins: Dict[int, int] = {self.index.ids[course]: term for course, term in (pins or {}).items() if course in self.index.ids}
+        self.view = self.index.view(initial_state)
+        initial = set(initial_state)
+        self.goals: List[int] = [self.index.ids[goal] for goal in dict.fromkeys(goal_conditions) if goal not in initial]
+        # Static information, shared with the index
+        self.taken: int = self.view.taken  # The initial state
+        self.credits: List[int] = self.index.credits
+        self.offered: List[Tuple[int, ...]] = self.index.offered
+        self.prereqs: List[Tuple[Tuple[int, ...], ...]] = self.index.prereqs
+        self.classes: List[int] = self.index.classes
+        if closed:  # Copied, so the index stays as it is for other searches
+            self.offered, self.classes = list(self.offered), list(self.classes)
+            for course, terms in closed.items():
+                i = self.index.ids.get(course)
+                if i is not None:
+                    self.offered[i] = tuple(t for t in self.offered[i] if t not in terms)
+                    self.classes[i] = len(self.classes) + i  # A class of its own
+        self.earliest: List[int] = self.view.height
+        self.min_hours: List[int] = self.view.min_hours
+        self.order: Dict[int, int] = {}  # Discovery order from the goals, used to break ties deterministically
+        self._discover()
+        # First phase state, every change is recorded on the trail so it can be undone when backtracking
+        n = len(self.index.courses)
+        self.deadline: List[int] = [0] * n  # The last term each required course can be done in, 0 if not required
+        self.required: List[int] = []  # The required courses, in the order they were required
+        self.open: int = 0  # Required courses without a clause yet
+        self.clause: List[Tuple[int, ...]] = [None] * n  # The prereq clause chosen for each decided course
+        self.trail: List[Tuple[int, int]] = []
+        # Second phase state
+        self.term: List[int] = [0] * n
+        self.hours: List[int] = [0] * (MAX_TERM + 1)
+        # Statistics
+        self.nodes = 0
+        self.depth = 0  # The most decisions made at once
+        self.prunes: Dict[str, int] = {'deadline': 0, 'hours': 0, 'placement': 0}
+        self.exhausted = False
+
+    def _discover(self):
+        stack = list(reversed(self.goals))
+        while stack:
+            course = stack.pop()
+            if course in self.order or self.taken >> course & 1:
+                continue
+            self.order[course] = len(self.order)
+            stack.extend(req for clause in reversed(self.prereqs[course]) for req in reversed(clause))
+
+    # The first term after base a course can be done in. Higher level requirements are done as soon as their clause is.
+    def _first_term_after(self, course: int, base: int) -> int:
+        if self.credits[course] == 0:
+            return min(base, UNREACHABLE)
+        return next((t for t in self.offered[course] if t > base), UNREACHABLE)
+
+    # The last term by the deadline a course can be done in
+    def _last_term_by(self, course: int, deadline: int) -> int:
+        if self.credits[course] == 0:
+            return deadline
+        return next((t for t in reversed(self.offered[course]) if t <= deadline), 0)
+
+    # Searches for a plan, returning whether one was found. On success the decisions are kept for plan().
+    def run(self) -> bool:
+        try:
+            for goal in self.goals:
+                if not self._require(goal, MAX_TERM):
+                    self._prune('deadline', 'goal')
+                    return False
+            return self._search(0)
+        except SearchBudgetExceeded:
+            self.exhausted = True
+            return False
 
-            next_operation.clause = goal_dnf_clause  # Assign current dnf clause to the operator
-            goal_dnf_clause = list(goal_dnf_clause)
-                              # We need the properties of a list later on
-            # Build the next set of goal conditions, which is the goal conditions minus the goal plus the requirements
-            # of the goal's current dnf clause.
-            next_goal_conditions = goal_conditions[:]
-            next_goal_conditions.remove(goal)
-            # Put the dnf clause at the front, sorted by what's hardest first. Hard clause members define what the
-            # course layout should be, while easy ones can be fit in in the
-            # aftermath.
-            next_goal_conditions = list(sorted(remove_fulfilled(goal_dnf_clause, current_plan), key=lambda x: -minimum_tree_hours(
-                course_descriptions, x, initial_state[:], {}))) + next_goal_conditions
-            result_plan = internal_scheduler(
-                course_descriptions, next_goal_conditions, next_plan, memo_table_for_tree_height, depth+1)  # Recurse deeper
-            if not len(result_plan) == 0:  # Setting this goal as the operation didn't fail, return it
-                return result_plan
-            # Failing here means the next clause will be tried
-            # TODO: check for dnf clauses that are effectively equivalent and skip them, especially for open electives
-    return ()
-
-
-def pad_to_12_hours(course_descriptions: Dict[Course, CourseInfo], plan: List[ScheduledCourse]):
-    courses_in_plan = list(map(lambda sc: sc.course, plan))
+    def stats(self) -> dict:
+        return {'nodes': self.nodes, 'depth': self.depth, 'prunes': dict(self.prunes)}
+
+    # Counts a backtrack of one of the kinds stats() reports. detail says which check failed, for tracing.
+    def _prune(self, kind: str, detail: str):
+        self.prunes[kind] += 1
+
+    # Counts a node, giving up if the budget has run out. The clock is only read every few nodes.
+    def _expand(self):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchBudgetExceeded()
+        if self.nodes % 16 == 0 and (self.stop_at is not None and time.monotonic() > self.stop_at or
+                                     self.cancel is not None and self.cancel.is_set()):
+            raise SearchBudgetExceeded()
+
+    def _search(self, depth: int) -> bool:
+        self._expand()
+        self.depth = max(self.depth, depth)
+        if not self._fits():
+            return False
+        goal = self._select()
+        if goal is None:  # Every required course has a clause, now find the terms
+            return self._schedule()
+        mark = len(self.trail)
+        for clause in self._options(goal):
+            if self._decide(goal, clause):
+                if self._search(depth + 1):
+                    return True
+            else:
+                self._prune('deadline', 'propagation')
+            self._undo(mark)
+        return False
+
+    # Requires a course to be done by the deadline. Returns False if that is impossible given the current decisions.
+    def _require(self, course: int, deadline: int) -> bool:
+        if self.taken >> course & 1:
+            return True
+        deadline = self._last_term_by(course, deadline)
+        if deadline < self.earliest[course]:
+            return False
+        old = self.deadline[course]
+        if old and old <= deadline:
+            return True
+        self.trail.append((course, old))
+        self.deadline[course] = deadline
+        if not old:  # Newly required
+            self.required.append(course)
+            self.open |= 1 << course
+            return True
+        if self.clause[course] is not None:  # Already decided, so its clause has to be done sooner too
+            return all(self._require(req, self._clause_deadline(course)) for req in self.clause[course])
+        return True
+
+    # The deadline of the clause of a required course
+    def _clause_deadline(self, course: int) -> int:
+        return self.deadline[course] - 1 if self.credits[course] > 0 else self.deadline[course]
+
+    # Completes the goal using a prereq clause, and requires the clause
+    def _decide(self, goal: int, clause: Tuple[int, ...]) -> bool:
+        self.open &= ~(1 << goal)
+        self.clause[goal] = clause
+        self.trail.append((goal, DECIDED))
+        return all(self._require(req, self._clause_deadline(goal)) for req in clause)
+
+    def _undo(self, mark: int):
+        while len(self.trail) > mark:
+            course, old = self.trail.pop()
+            if old == DECIDED:
+                self.clause[course] = None
+                self.open |= 1 << course
+            elif old:  # A deadline was moved up
+                self.deadline[course] = old
+            else:  # The course was required, and is the last one that was
+                self.deadline[course] = 0
+                self.required.pop()
+                self.open &= ~(1 << course)
+
+    # The earliest term a required course can be done in with the clauses chosen so far
+    def _earliest_now(self, course: int, memo: Dict[int, int]) -> int:
+        if self.taken >> course & 1:
+            return 0
+        if self.clause[course] is None:
+            return self.earliest[course]
+        if course not in memo:
+            base = max((self._earliest_now(req, memo) for req in self.clause[course]), default=0)
+            memo[course] = self._first_term_after(course, base)
+        return memo[course]
+
+    # Checks that every required course can be done by its deadline, and that the courses required so far, plus those
+    # certain to be needed by the open requirements, fit in the hours of every window of terms
+    def _fits(self) -> bool:
+        memo: Dict[int, int] = {}
+        windows: Dict[Tuple[int, int], int] = {}
+        for course in self.required:
+            earliest, deadline = self._earliest_now(course, memo), self.deadline[course]
+            if earliest > deadline:
+                self._prune('deadline', 'chain')
+                return False
+            if self.credits[course] > 0:
+                windows[earliest, deadline] = windows.get((earliest, deadline), 0) + self.credits[course]
+        counted = 0
+        for goal in bits(self.open):
+            needed = self.view.mandatory[goal] & ~counted
+            counted |= needed
+            for course in bits(needed):
+                if not self.deadline[course]:
+                    window = (self.earliest[course], self.deadline[goal])
+                    windows[window] = windows.get(window, 0) + self.credits[course]
+        if not self._windows_fit(windows, 1):
+            self._prune('hours', 'window')
+            return False
+        return True
+
+    # Checks that the hours due in every window of terms from first on fit in the hours left in it. windows maps
+    # (earliest, deadline) to the hours of the courses that have to be taken between the two.
+    def _windows_fit(self, windows: Dict[Tuple[int, int], int], first: int) -> bool:
+        for start in range(first, MAX_TERM + 1):
+            due = [0] * (MAX_TERM + 1)
+            for (earliest, deadline), hours in windows.items():
+                if earliest >= start:
+                    due[deadline] += hours
+            load = available = 0
+            for end in range(start, MAX_TERM + 1):
+                load += due[end]
+                available += MAX_HOURS - self.hours[end]
+                if load > available:
+                    return False
+        return True
+
+    # A clause meets a requirement for free if its courses are already required by the deadline
+    def _free_clause(self, goal: int) -> Tuple[int, ...]:
+        deadline = self._clause_deadline(goal)
+        for clause in self.prereqs[goal]:
+            if all(self.taken >> req & 1 or 0 < self.deadline[req] <= deadline for req in clause):
+                return clause
+        return None
+
+    # Picks the next course to decide: forced and free decisions first, then the one with the fewest clauses (or the
+    # least slack between its earliest term and deadline, depending on the heuristic)
+    def _select(self) -> int:
+        best, best_key = None, None
+        by_slack = self.heuristic.select == 'slack'
+        for goal in bits(self.open):
+            if len(self.prereqs[goal]) <= 1 or self._free_clause(goal) is not None:
+                return goal
+            clauses, slack = len(self.prereqs[goal]), self.deadline[goal] - self.earliest[goal]
+            key = (slack, clauses, self.order[goal]) if by_slack else (clauses, slack, self.order[goal])
+            if best_key is None or key < best_key:
+                best, best_key = goal, key
+        return best
+
+    # Lists the clauses to try for a course: a free clause, then those adding the fewest hours first (or those that can
+    # be done earliest, depending on the heuristic). A seeded heuristic breaks ties at random.
+    def _options(self, goal: int) -> List[Tuple[int, ...]]:
+        if not self.prereqs[goal]:
+            return [()]
+
+        def cost(clause):
+            added = [req for req in clause if not self.taken >> req & 1 and not self.deadline[req]]
+            hours, earliest = sum(self.min_hours[req] for req in added), max((self.earliest[req] for req in added), default=0)
+            unpinned = sum(1 for req in added if req not in self.pins) if self.pins else 0
+            return (unpinned, earliest, hours) if self.heuristic.options == 'earliest' else (unpinned, hours, earliest)
+        clauses = self._distinct(self.prereqs[goal]) if self.merge_equivalent else list(self.prereqs[goal])
+        if self.random is not None:
+            self.random.shuffle(clauses)
+        clauses.sort(key=cost)
+        # A free clause can still push this course into a full term (see above), so the others come after it
+        free = self._free_clause(goal)
+        if free is not None:
+            clauses = [free] + [clause for clause in clauses if clause != free]
+        return clauses
+
+    # Leaves out the clauses that only differ from an earlier one in interchangeable courses that aren't required yet
+    def _distinct(self, clauses: Tuple[Tuple[int, ...], ...]) -> List[Tuple[int, ...]]:
+        distinct, seen = [], set()
+        classes = self.classes
+        for clause in clauses:
+            key = tuple(sorted(classes[req] if not self.taken >> req & 1 and not self.deadline[req] else -1 - req
+                               for req in clause))
+            if key not in seen:
+                seen.add(key)
+                distinct.append(clause)
+        return distinct
+
+    # The second phase: assigns a term to every chosen course with credits
+    def _schedule(self) -> bool:
+        courses = [course for course in self.required if self.credits[course] > 0]
+        memo: Dict[int, int] = {}
+        self.starts = {course: self._earliest_now(course, memo) for course in courses}
+        self.ends = {course: self.deadline[course] for course in courses}
+        for course, term in self.pins.items():
+            if course in self.starts:
+                if not self.starts[course] <= term <= self.ends[course] or term not in self.offered[course]:
+                    self._prune('placement', 'pin')
+                    return False
+                self.starts[course] = self.ends[course] = term
+        self.preds = {course: self._credit_prereqs(self.clause[course]) for course in courses}
+        if self.random is not None:
+            self.random.shuffle(courses)
+            courses.sort(key=lambda c: self.ends[c])
+        else:
+            courses.sort(key=lambda c: (self.ends[c], self.order[c]))
+        remaining = 0
+        for course in courses:
+            remaining |= 1 << course
+        return self._place(1, courses, remaining)
+
+    # The mask of the courses with credits that a clause needs, looking through higher level requirements
+    def _credit_prereqs(self, clause: Tuple[int, ...]) -> int:
+        mask = 0
+        for req in clause:
+            if self.taken >> req & 1:
+                continue
+            if self.credits[req] > 0:
+                mask |= 1 << req
+            else:
+                mask |= self._credit_prereqs(self.clause[req])
+        return mask
+
+    # Fills the terms from term on with the remaining courses. courses lists every course to place by deadline.
+    def _place(self, term: int, courses: List[int], remaining: int) -> bool:
+        if not remaining:
+            return True
+        if term > MAX_TERM:
+            return False
+        self._expand()
+        windows: Dict[Tuple[int, int], int] = {}
+        available: List[int] = []
+        must = 0
+        for course in courses:
+            if not remaining >> course & 1:
+                continue
+            deadline = self.ends[course]
+            if deadline < term:
+                self._prune('placement', 'ordering')
+                return False
+            start = self.starts[course]
+            window = (max(start, term), deadline)
+            windows[window] = windows.get(window, 0) + self.credits[course]
+            if start <= term and term in self.offered[course] and not self.preds[course] & remaining:
+                available.append(course)
+                if self._last_term_by(course, deadline) == term:
+                    must |= 1 << course
+        if not self._windows_fit(windows, term):
+            self._prune('placement', 'term hours')
+            return False
+        for chosen in self._term_loads(available, must, 0, MAX_HOURS, 0, MAX_HOURS + 1):
+            hours = 0
+            for course in bits(chosen):
+                self.term[course] = term
+                hours += self.credits[course]
+            self.hours[term] += hours
+            if self._place(term + 1, courses, remaining & ~chosen):
+                return True
+            self.hours[term] -= hours
+        return False
+
+    # Yields the maximal sets of available courses that fit in a term and include every course that must be taken in
+    # it, preferring the courses listed first. skipped is the fewest hours of a course left out so far.
+    def _term_loads(self, available: List[int], must: int, i: int, room: int, chosen: int, skipped: int):
+        if i == len(available):
+            if skipped > room:
+                yield chosen
+            return
+        course = available[i]
+        credits = self.credits[course]
+        if credits <= room:
+            yield from self._term_loads(available, must, i + 1, room - credits, chosen | 1 << course, skipped)
+        elif must >> course & 1:
+            return
+        if not must >> course & 1:
+            yield from self._term_loads(available, must, i + 1, room, chosen, min(skipped, credits))
+
+    # The term a course is done in, higher level requirements are done when their last course is
+    def _done(self, course: int) -> int:
+        if self.taken >> course & 1:
+            return 0
+        if self.credits[course] > 0:
+            return self.term[course]
+        return max((self._done(req) for req in self.clause[course]), default=0)
+
+    # Builds the plan of the decisions made by a successful run
+    def plan(self) -> List[ScheduledCourse]:
+        courses = self.index.courses
+        return [ScheduledCourse(courses[course], self.course_descriptions[courses[course]], height_to_term(max(self._done(course), 1)), [courses[req] for req in self.clause[course]])
+                for course in sorted(self.required, key=lambda c: self.order[c])]
+
+
+# Marks a decision on the trail of ScheduleSearch, in place of the old deadline
+DECIDED = -1
+
+
+class SearchBudgetExceeded(Exception):
+    pass
+
+
+# The ways ScheduleSearch can order its decisions. select picks the requirement to decide next, by fewest 'clauses' or
+# least 'slack'; options orders its clauses by fewest added 'hours' or 'earliest' term; a seed breaks ties at random.
+# Every ordering is meant to search the same space and find a plan if there is one, just sooner or later; on the small
+# catalogs sameerpuri_benchmark --check tries they all do, but it isn't proven.
+Heuristic = namedtuple('Heuristic', 'name, select, options, seed')
+HEURISTICS = [
+    Heuristic('cheapest', 'clauses', 'hours', None),
+    Heuristic('tightest', 'slack', 'earliest', None),
+    Heuristic('cheapest-1', 'clauses', 'hours', 1),
+    Heuristic('tightest-1', 'slack', 'earliest', 1),
+    Heuristic('cheapest-2', 'clauses', 'hours', 2),
+    Heuristic('tightest-2', 'slack', 'earliest', 2),
+    Heuristic('cheapest-3', 'clauses', 'hours', 3),
+    Heuristic('tightest-3', 'slack', 'earliest', 3),
+]
+
+
+# Yields the ids in a bitmask, lowest first
+def bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# The orders pad_to_12_hours can choose filler courses in, as sort keys of a course and its credits. Ties, and the
+# 'catalog' order itself, go by the course's row in the catalog, so the same plan is always padded the same way.
+#   catalog        the order of the catalog
+#   most_credits   the courses with the most credits first, so the fewest fillers are added
+#   least_credits  the courses with the fewest credits first, so terms go over 12 hours by the least
+#   course         alphabetical by program and designation, which doesn't change when the catalog's rows are reordered
+FILLER_ORDERS = {
+    'catalog': lambda course, credits: (),
+    'most_credits': lambda course, credits: (-credits,),
+    'least_credits': lambda course, credits: (credits,),
+    'course': lambda course, credits: (tuple(course),),
+}
+FILLER_ORDER = 'catalog'
+
+
+class FillerPool:
+    # The courses without prereqs that terms can be padded with, for each semester grouped by credits, each group
+    # sorted in a FILLER_ORDERS order. take() passes over each course of a group at most once per plan, so padding
+    # every term costs about as much as one look at each filler, instead of a scan of the catalog per term.
+    # Never changed once built, so pools are shared by every request on their catalog, see filler_pool().
+
+    def __init__(self, course_descriptions: Dict[Course, CourseInfo], order: str = FILLER_ORDER):
+        if order not in FILLER_ORDERS:
+            raise ValueError('filler order must be one of ' + ', '.join(FILLER_ORDERS))
+        key = FILLER_ORDERS[order]
+        groups: Dict[str, Dict[int, list]] = {}
+        for position, (course, courseinfo) in enumerate(course_descriptions.items()):
+            if len(courseinfo.prereqs) > 0:
+                continue
+            credits = int(courseinfo.credits)
+            for semester in set(courseinfo.terms):
+                groups.setdefault(semester, {}).setdefault(credits, []).append((key(course, credits) + (position,), course, courseinfo))
+        # Semester name -> [(credits, [(rank, course, info), ...] best first), ...] fewest credits first
+        self.groups: Dict[str, List[Tuple[int, list]]] = {
+            semester: [(credits, sorted(members, key=lambda member: member[0])) for credits, members in sorted(by_credits.items())]
+            for semester, by_credits in groups.items()}
+
+    # Chooses fillers for a term of the semester that has hours in it, best first, until it has 12 hours, never going
+    # over 18. The chosen courses are added to used, and cursors keeps how far into each group the courses are used,
+    # so pass the same used and cursors for every term of a plan.
+    def take(self, semester: str, hours: int, used: set, cursors: Dict[tuple, int]) -> List[Tuple[Course, CourseInfo]]:
+        chosen = []
+        groups = self.groups.get(semester, ())
+        while hours < 12:
+            best = None
+            for credits, members in groups:
+                if credits + hours > MAX_HOURS:
+                    break
+                i = cursors.get((semester, credits), 0)
+                while i < len(members) and members[i][1] in used:
+                    i += 1
+                cursors[(semester, credits)] = i
+                if i < len(members) and (best is None or members[i][0] < best[0]):
+                    best = members[i]
+            if best is None:
+                break
+            _, course, courseinfo = best
+            chosen.append((course, courseinfo))
+            used.add(course)
+            hours += int(courseinfo.credits)
+        return chosen
+
+
+filler_pools = CatalogCache(FillerPool)
+
+
+# Returns the filler pool of a catalog in an order, building it the first time they're asked for, like prereq_index
+def filler_pool(course_descriptions: Dict[Course, CourseInfo], order: str = FILLER_ORDER) -> FillerPool:
+    return filler_pools.get(course_descriptions, order)
+
+
+# Pads every term that has courses but fewer than 12 hours with courses that have no prereqs and are offered in it, in
+# the filler order given, FILLER_ORDER by default.
+def pad_to_12_hours(course_descriptions: Dict[Course, CourseInfo], plan: List[ScheduledCourse], taken: List[Course] = (),
+                    order: str = None):
+    pool = filler_pool(course_descriptions, order or FILLER_ORDER)
+    used = set(operator.course for operator in plan) | set(taken)
+    cursors = {}
     for term, hours in get_hour_counts(plan).items():
         if 12 > hours > 0:
-            for course, courseinfo in course_descriptions.items():
-                if hours >= 12:
-                    break
-                if len(courseinfo.prereqs) > 0 or course in courses_in_plan or int(courseinfo.credits) + hours > 18:
-                    continue
-                plan.append(
-                    ScheduledCourse((course.program, course.designation), courseinfo, term, courseinfo.prereqs))
-                courses_in_plan.append(course)
-                hours += int(courseinfo.credits)
+            for course, courseinfo in pool.take(term.semester.name, hours, used, cursors):
+                plan.append(ScheduledCourse(course, courseinfo, term, courseinfo.prereqs))
     return plan
 
 
-# This method pushes higher level courses from the semester they're in to
-# the semester in which they're fulfilled
-def push_higher_levels(plan: List[ScheduledCourse]):
-    for i, hl_op in enumerate(plan):
-        if not is_higher_level_course_info(hl_op.courseInfo):  # Ignore non-higher-level courses
-            continue
-        keep_pushing = True
-        while keep_pushing and hl_op.term != Term(Semester.Spring, Year.Senior):  # Push upward
-            for clause in hl_op.courseInfo.prereqs:
-                if not any(req in (map(lambda op: op.course, filter(lambda op: op.term == hl_op.term, plan))) for req in clause):
-                    keep_pushing = False
-                    break
-            if keep_pushing:
-                hl_op.term = Term.initFromTermNo(
-                    hl_op.term.termNo + (1 if hl_op.term.semester == Semester.Fall else 2))
-        keep_pushing = True
-        while keep_pushing and hl_op.term != Term(Semester.Fall, Year.Frosh):  # Push downward
-            for clause in hl_op.courseInfo.prereqs:
-                if any(req in (map(lambda op: op.course, filter(lambda op: op.term == hl_op.term, plan))) for req in clause):
-                    keep_pushing = False
-                    break
-            if keep_pushing:
-                hl_op.term = Term.initFromTermNo(
-                    hl_op.term.termNo - (1 if hl_op.term.semester == Semester.Spring else 2))
-
-
-# This method removes already fulfilled courses from a dnf clause to
-# simplify it
-def remove_fulfilled(dnf_clause: List[Course], plan: List[ScheduledCourse]):
-    for op in plan:
-        if op.course in dnf_clause:
-            dnf_clause.remove(op.course)
-    return dnf_clause
-
-
-# Checks if the plan is under 18 hours. If not, there is a failure.
-def is_valid_plan(current_plan: List[ScheduledCourse]):
-    for term, hours in get_hour_counts(current_plan).items():
+# This method checks a schedule returned by course_scheduler against the catalog, returning a description of every
+# problem found: goals left out, terms over 18 hours, courses in terms they aren't offered in and courses taken
+# without any prereq clause done before them (or by then, for higher level requirements).
+def check_schedule(course_descriptions: Dict[Course, CourseInfo], schedule: Dict[Course, CourseInfo], goal_conditions: List[Course], initial_state: List[Course]) -> List[str]:
+    problems = []
+    term_of = {course: info.terms for course, info in schedule.items()}
+    for goal in goal_conditions:
+        if goal not in term_of and goal not in initial_state:
+            problems.append('goal %s is not scheduled' % (goal,))
+    for term, hours in get_hour_counts([ScheduledCourse(course, info, info.terms, []) for course, info in schedule.items()]).items():
         if hours > 18:
-            return False
-    return True
+            problems.append('%s has %d hours' % (term, hours))
+    for course, info in schedule.items():
+        course_info = course_descriptions[course]
+        if is_higher_level_course_info(course_info):
+            done_in_time = lambda req: req in initial_state or (req in term_of and term_of[req] <= info.terms)
+        else:
+            if info.terms.semester.name not in course_info.terms:
+                problems.append('%s is not offered in %s' % (course, info.terms))
+            done_in_time = lambda req: req in initial_state or (req in term_of and term_of[req] < info.terms)
+        if course_info.prereqs and not any(all(done_in_time(req) for req in clause) for clause in course_info.prereqs):
+            problems.append('%s is taken without its prereqs' % (course,))
+    return problems
 
 
 # This method creates a dict mapping a term (excluding summer) to the # of
@@ -344,81 +1069,30 @@ def get_hour_counts(current_plan: List[ScheduledCourse]):
 
 
 # This method answers the question: how many semesters are needed to schedule myself and my prerequirements, given the
-# "initial_state"? The memotable is used to speed up lookup.
-def minimum_tree_height(course_descriptions: Dict[Course, CourseInfo], goal: Course, initial_state: List[Course], memo: Dict[Course, int]):
-    if goal in initial_state:  # Already fulfilled, so no depth
-        return 0
-    initial_state.append(goal)
-    if len(course_descriptions[goal].prereqs) == 0:  # Basic no req course, so only taking it requires a semester
-        return 1
-    if goal in memo:  # This has already been answered
-        return memo[goal]
-    # Calculate the minimax
-    goal_minimum = 20
-    goal_initial_state = initial_state
-    for prereq_clause in course_descriptions[goal].prereqs:  # Find the clause that is easiest to fulfill
-        this_initial_state = initial_state[:]
-        clause_maximum = 0
-        for req in prereq_clause:  # Identify the hardest part of the current clause, it is definitive of it
-            # Don't consider higher level goals to be a course.
-            # Recurse to check the height required to fulfill req.
-            subtree_height = (1 if not is_higher_level_course(course_descriptions, goal) else 0) + \
-                minimum_tree_height(
-                course_descriptions, req, this_initial_state, memo)
-            if subtree_height > clause_maximum:  # Local maximum
-                clause_maximum = subtree_height
-        if clause_maximum < goal_minimum:  # Global minimum
-            goal_minimum = clause_maximum
-            goal_initial_state = this_initial_state
-    initial_state.clear()
-    initial_state += goal_initial_state
-    memo[goal] = goal_minimum  # Memoize
-    return goal_minimum  # Done!
-
-
-def minimum_tree_hours(course_descriptions: Dict[Course, CourseInfo], goal: Course, initial_state: List[Course], memo: Dict[Course, int]):
-    if goal in initial_state:  # Already fulfilled, so no hours
-        return 0
-    initial_state.append(goal)
-    if len(course_descriptions[goal].prereqs) == 0:  # Basic no req course, so only taking it requires a semester
-        return int(course_descriptions[goal].credits)
-    if goal in memo:  # This has already been answered
-        return memo[goal]
-    # Calculate the minisum
-    goal_minimum = 1000
-    goal_initial_state = initial_state
-    for prereq_clause in course_descriptions[goal].prereqs:  # Find the clause that is easiest to fulfill
-        this_initial_state = initial_state[:]
-        clause_total = int(course_descriptions[goal].credits)
-        for req in prereq_clause:  # Sum up the hours required for each req
-            # Don't consider higher level goals to be a course.
-            # Recurse to check the height required to fulfill req.
-            subtree_hours = minimum_tree_hours(course_descriptions, req, this_initial_state, memo)
-            clause_total += subtree_hours
-        if clause_total < goal_minimum:  # Global minimum
-            goal_minimum = clause_total
-            goal_initial_state = this_initial_state
-    initial_state.clear()
-    initial_state += goal_initial_state
-
-    memo[goal] = goal_minimum  # Memoize
-    return goal_minimum # Done!s
+# "initial_state"? Counts the terms up to the first one the course is offered in after its prerequisites, or returns
+# UNREACHABLE if that is past senior year. Looked up in the catalog's prereq index.
+def minimum_tree_height(course_descriptions: Dict[Course, CourseInfo], goal: Course, initial_state: List[Course]):
+    return prereq_index(course_descriptions).view(initial_state).course_height(goal)
+
+
+# This method answers the question: how many hours does the cheapest way of taking myself and my prerequirements add
+# up to, given the "initial_state"? Looked up in the catalog's prereq index.
+def minimum_tree_hours(course_descriptions: Dict[Course, CourseInfo], goal: Course, initial_state: List[Course]):
+    return prereq_index(course_descriptions).view(initial_state).course_min_hours(goal)
 
 
 # Converts a term number, 1 to 8, to the applicable term. This is handling for the fact that the scheduler doesn't
 # consider summer terms.
 def height_to_term(height: int):
-    semester = Semester(((height + 1) % 2) + 1)  # Spring or Fall?
-    year = Year(int((height - 1) / 2))
-    return Term(semester, year)
+    return _height_terms[height]
+
+
+_height_terms = [Term(Semester(((height + 1) % 2) + 1), Year(int((height - 1) / 2))) for height in range(MAX_TERM + 1)]
 
 
-# This method makes the argument unique and returns it
-def make_unique(seq: list):
-    return list(set(seq))
-    # seen = set()
-    # seen_add = seen.add
-    # return [x for x in seq if not (x in seen or seen_add(x))]
+# Converts a term other than summer to its term number, 1 to 8. The inverse of height_to_term.
+def term_to_height(term: Term) -> int:
+    return int(term.year) * 2 + (1 if term.semester == Semester.Fall else 2)
 
 
 # This method checks if a course is higher level by credits.
@@ -450,12 +1124,15 @@ def print_schedule(plan: List[ScheduledCourse]):
 
 
 if __name__ == '__main__':
-    course_dict: Dict[Course, CourseInfo] = cd.create_course_dict()
+    import pandas as pd
+    import sameerpuri_context as spc
+    import sameerpuri_matcher as spm
+    course_dict: Dict[Course, CourseInfo] = spc.context().course_dict
     schedule_dict = course_scheduler(course_dict, goal_conditions=[Course(program='CS', designation='major'), Course('JAPN', '3891')], initial_state=[Course('CS', '1101')])
 
     df = pd.DataFrame.from_dict(schedule_dict, orient='index')
 
-    course_desc_dict: Dict[Course, spm.CourseDesc] = spm.create_course_desc_dict(course_dict)
+    course_desc_dict: Dict[Course, spm.CourseDesc] = spc.context().course_descs
     course_names: List[str] = list()
     course_sums: List[str] = list()
     for course in schedule_dict.keys():
@@ -0,0 +1,77 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset('a an and are as at be by for from has how in into is it its of on or that the their this to '
+                       'will with who what when which course courses students student topics include including'.split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words and numbers of a text, without stop words."""
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    An inverted index scoring documents with Okapi BM25. A document is a few fields of text, and each field's term
+    counts and length are multiplied by its weight before scoring, so e.g. a word in a course name can count double.
+    The postings of each term hold the ids of the documents it's in and their precomputed BM25 weights, so scoring a
+    query is one vectorized add per query term.
+    Never changed once built, so it can be shared between threads.
+    """
+
+    def __init__(self, documents: Iterable[Tuple[str, ...]], weights: Tuple[float, ...], k1: float = 1.2, b: float = 0.75):
+        counts: List[Counter] = []
+        lengths: List[float] = []
+        for fields in documents:
+            count = Counter()
+            for text, weight in zip(fields, weights):
+                for token in tokenize(text):
+                    count[token] += weight
+            counts.append(count)
+            lengths.append(sum(count.values()))
+        self.size = len(counts)
+        average = sum(lengths) / self.size if self.size else 0.0
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for doc, count in enumerate(counts):
+            norm = k1 * (1 - b + b * lengths[doc] / average) if average else k1
+            for token, tf in count.items():
+                postings.setdefault(token, []).append((doc, tf * (k1 + 1) / (tf + norm)))
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for token, entries in postings.items():
+            idf = math.log(1 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[token] = (np.array([doc for doc, _ in entries], dtype=np.int32),
+                                    np.array([weight * idf for _, weight in entries], dtype=np.float32))
+
+    def scores(self, query: str) -> np.ndarray:
+        """The BM25 score of every document for a query, 0 for documents without any of its terms."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                scores[posting[0]] += posting[1]  # A document is in a posting list once, so no add.at needed
+        return scores
+
+
+def ranking(keyword_scores: np.ndarray, dense_scores: np.ndarray, rerank_depth: int, keyword_share: float) -> np.ndarray:
+    """
+    Orders documents for a hybrid search, returning their ids best first. The rerank_depth best keyword matches come
+    first, ordered by keyword_share of their keyword score (scaled to the best match's) plus the rest of their dense
+    score. The other keyword matches follow by keyword score, then the documents without a match by dense score. The
+    order only depends on the query, never on how much of it is asked for, so pages of it never overlap or skip.
+    Ties go to the lower id.
+    """
+    ids = np.arange(len(keyword_scores))
+    matched = np.flatnonzero(keyword_scores > 0)
+    by_keyword = matched[np.lexsort((matched, -keyword_scores[matched]))]
+    head, tail = by_keyword[:rerank_depth], by_keyword[rerank_depth:]
+    if len(head):
+        hybrid = keyword_share * keyword_scores[head] / keyword_scores[head[0]] + (1 - keyword_share) * dense_scores[head]
+        head = head[np.lexsort((head, -hybrid))]
+    rest = ids[keyword_scores <= 0]
+    rest = rest[np.lexsort((rest, -dense_scores[rest]))]
+    return np.concatenate((head, tail, rest))
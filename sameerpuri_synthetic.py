@@ -0,0 +1,174 @@
+#!/bin/python
+# Synthetic catalogs for scale testing the scheduler and the recommender. A generated catalog has the shape of the
+# real one: a course_dict of Course -> CourseInfo with prereqs in disjunctive normal form, and a course_descs of
+# Course -> CourseDesc with a name and summary for every course. Each program has its courses in levels, a course of
+# level n having at least one clause through a course of level n - 1, so prerequisite chains are exactly depth long,
+# plus 0 credit requirement nodes grouping courses the way 'CS mathematics' does and a 'major' node requiring them all.
+# Generation is seeded, so the same parameters always give the same catalog.
+# Run as a script it prints the statistics of a generated catalog; sameerpuri_benchmark.py --scaling uses it for curves.
+# Usage: python sameerpuri_synthetic.py [--courses 10000] [--width 2] [--depth 4] [--requirements 0.06]
+#                                       [--both-terms 0.3] [--summer 0.05] [--seed 0]
+
+import argparse
+import random
+from collections import Counter
+from typing import Dict, List, NamedTuple, Tuple
+
+import course_dictionary as cd
+import sameerpuri_matcher as spm
+
+COURSES_PER_PROGRAM = 100
+CROSS_PROGRAM_SHARE = 0.1  # Part of the prereqs taken from another program
+CREDITS = (('3', 0.8), ('1', 0.08), ('2', 0.06), ('4', 0.06))
+
+# Words the names and summaries are made of. Each program draws its subject from SUBJECTS, so courses of one program
+# read alike and the recommender has structure to find.
+SUBJECTS = ('accounting', 'anthropology', 'architecture', 'astronomy', 'biology', 'chemistry', 'classics', 'computing',
+            'dance', 'ecology', 'economics', 'education', 'engineering', 'film', 'finance', 'geology', 'history',
+            'journalism', 'language', 'law', 'linguistics', 'literature', 'management', 'marketing', 'mathematics',
+            'medicine', 'music', 'neuroscience', 'nursing', 'philosophy', 'physics', 'politics', 'psychology',
+            'religion', 'sociology', 'statistics', 'theater', 'writing')
+TOPICS = ('analysis', 'design', 'theory', 'methods', 'systems', 'practice', 'history', 'policy', 'data', 'models',
+          'networks', 'structures', 'culture', 'ethics', 'research', 'communication', 'development', 'evolution',
+          'measurement', 'computation', 'society', 'environment', 'health', 'markets', 'institutions', 'language',
+          'performance', 'security', 'energy', 'materials', 'signals', 'algorithms', 'populations', 'cities')
+LEVEL_NAMES = ('Introduction to', 'Foundations of', 'Intermediate', 'Advanced', 'Topics in', 'Seminar in',
+               'Research in')
+SENTENCES = ('Survey of {0} and {1} in {2}.', 'Emphasis on {0}, {1}, and their role in modern {2}.',
+             'Students apply {0} to problems of {1}.', 'Principles of {0} with laboratory work on {1}.',
+             'Readings in {0} and {1}, with written projects.', 'Quantitative approaches to {0} and {1}.')
+
+
+class CatalogShape(NamedTuple):
+    """The parameters of a synthetic catalog."""
+    courses: int = 2500
+    width: int = 2  # Most alternative clauses in a course's prereqs, and most courses in a clause
+    depth: int = 4  # Levels of prerequisites below the top level of each program
+    requirements: float = 0.06  # Part of the courses that are 0 credit requirement nodes
+    both_terms: float = 0.3  # Part of the courses offered in both Fall and Spring, the rest in one of them
+    summer: float = 0.05  # Part of the courses also offered in Summer
+    seed: int = 0
+
+
+def generate_catalog(shape: CatalogShape = CatalogShape()) -> Tuple[Dict[cd.Course, cd.CourseInfo],
+                                                                    Dict[cd.Course, spm.CourseDesc]]:
+    """Generates a catalog of the given shape, returning its course_dict and course_descs."""
+    rng = random.Random(shape.seed)
+    programs = max(1, round(shape.courses / COURSES_PER_PROGRAM))
+    course_dict: Dict[cd.Course, cd.CourseInfo] = {}
+    course_descs: Dict[cd.Course, spm.CourseDesc] = {}
+    # The regular courses of each program by level, made first so prereqs can point across programs
+    levels: List[List[List[cd.Course]]] = []
+    requirement_counts: List[int] = []
+    for p in range(programs):
+        size = shape.courses // programs + (p < shape.courses % programs)
+        requirement_counts.append(max(1, round(size * shape.requirements) - 1))  # The major is one of them
+        regular = max(shape.depth + 1, size - requirement_counts[p] - 1)
+        program_levels = [[] for _ in range(shape.depth + 1)]
+        for n in range(regular):
+            level = n % (shape.depth + 1) if n <= shape.depth else rng.randrange(shape.depth + 1)
+            program_levels[level].append(cd.Course(program_name(p), '%d%03d' % (level + 1, len(program_levels[level]))))
+        levels.append(program_levels)
+    for p, program_levels in enumerate(levels):
+        subject = SUBJECTS[p % len(SUBJECTS)]
+        for level, level_courses in enumerate(program_levels):
+            for course in level_courses:
+                course_dict[course] = cd.CourseInfo(_weighted(rng, CREDITS), _terms(rng, shape),
+                                                    _prereqs(rng, shape, levels, p, level))
+                course_descs[course] = _description(rng, subject, level, course_dict[course].credits)
+        # Requirement nodes, each satisfied by one of a few groups of the program's courses, and the major needing them all
+        requirements = []
+        for r in range(requirement_counts[p]):
+            requirement = cd.Course(program_name(p), 'req%d' % r)
+            clauses = tuple(tuple(sorted(set(rng.choice(program_levels[rng.randrange(len(program_levels))])
+                                             for _ in range(rng.randint(2, 3)))))
+                            for _ in range(rng.randint(1, shape.width)))
+            course_dict[requirement] = cd.CourseInfo('0', ('Spring', 'Fall'), tuple(sorted(set(clauses))))
+            course_descs[requirement] = spm.CourseDesc('%s requirement %d.' % (subject.capitalize(), r + 1), '',
+                                                       'Requirement of the %s major.' % subject, '[0]')
+            requirements.append(requirement)
+        major = cd.Course(program_name(p), 'major')
+        course_dict[major] = cd.CourseInfo('0', ('Spring', 'Fall'), (tuple(requirements),))
+        course_descs[major] = spm.CourseDesc('%s major.' % subject.capitalize(), '', 'The %s major.' % subject, '[0]')
+    return course_dict, course_descs
+
+
+def program_name(p: int) -> str:
+    """Program names are letters, like the real ones: SYA, SYB, ..., SYZ, SYBA, ..."""
+    letters = ''
+    while True:
+        letters = chr(ord('A') + p % 26) + letters
+        p //= 26
+        if p == 0:
+            return 'SY' + letters
+
+
+def _weighted(rng: random.Random, choices: Tuple[Tuple[str, float], ...]) -> str:
+    return rng.choices([value for value, _ in choices], [weight for _, weight in choices])[0]
+
+
+def _terms(rng: random.Random, shape: CatalogShape) -> Tuple[str, ...]:
+    terms = ('Spring', 'Fall') if rng.random() < shape.both_terms else (rng.choice(('Spring', 'Fall')),)
+    return ('Summer',) + terms if rng.random() < shape.summer else terms
+
+
+def _prereqs(rng: random.Random, shape: CatalogShape, levels: List[List[List[cd.Course]]], p: int,
+             level: int) -> Tuple[Tuple[cd.Course, ...], ...]:
+    """Up to width clauses of up to width courses, each led by a course one level down so the chain is level long."""
+    if level == 0:
+        return ()
+    clauses = set()
+    for _ in range(rng.randint(1, shape.width)):
+        clause = {rng.choice(levels[p][level - 1])}
+        for _ in range(rng.randint(1, shape.width) - 1):
+            other = rng.randrange(len(levels)) if rng.random() < CROSS_PROGRAM_SHARE else p
+            clause.add(rng.choice(levels[other][rng.randrange(level)]))
+        clauses.add(tuple(sorted(clause)))
+    return tuple(sorted(clauses))
+
+
+def _description(rng: random.Random, subject: str, level: int, credits: str) -> spm.CourseDesc:
+    topics = rng.sample(TOPICS, 3)
+    name = '%s %s %s.' % (LEVEL_NAMES[min(level, len(LEVEL_NAMES) - 1)], subject.capitalize(), topics[0])
+    summary = ' '.join(sentence.format(topics[i], topics[(i + 1) % 3], subject)
+                       for i, sentence in enumerate(rng.sample(SENTENCES, 2)))
+    return spm.CourseDesc(name, '', summary, '[%s]' % credits)
+
+
+def catalog_stats(course_dict: Dict[cd.Course, cd.CourseInfo]) -> dict:
+    """Counts that describe a catalog's shape, for comparing a synthetic one with the real one."""
+    import sameerpuri_prereqs as spq
+    index = spq.prereq_index(course_dict)
+    view = index.view(())
+    return {
+        'courses': len(course_dict),
+        'requirement nodes': sum(info.credits in ('0', 0) for info in course_dict.values()),
+        'with prereqs': sum(bool(info.prereqs) for info in course_dict.values()),
+        'clauses': Counter(len(info.prereqs) for info in course_dict.values() if info.prereqs),
+        'clause sizes': Counter(len(clause) for info in course_dict.values() for clause in info.prereqs),
+        'terms': Counter(info.terms for info in course_dict.values()),
+        'earliest terms': Counter(view.course_height(course) for course in course_dict),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic catalog and prints its statistics.')
+    defaults = CatalogShape()
+    parser.add_argument('--courses', type=int, default=defaults.courses, help='courses in the catalog')
+    parser.add_argument('--width', type=int, default=defaults.width, help='most clauses per course and courses per clause')
+    parser.add_argument('--depth', type=int, default=defaults.depth, help='levels of prerequisites')
+    parser.add_argument('--requirements', type=float, default=defaults.requirements, help='part that are requirement nodes')
+    parser.add_argument('--both-terms', type=float, default=defaults.both_terms, help='part offered in Fall and Spring')
+    parser.add_argument('--summer', type=float, default=defaults.summer, help='part also offered in Summer')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    args = parser.parse_args()
+    course_dict, course_descs = generate_catalog(CatalogShape(args.courses, args.width, args.depth, args.requirements,
+                                                              args.both_terms, args.summer, args.seed))
+    for name, value in catalog_stats(course_dict).items():
+        print('%-18s %s' % (name, sorted(value.items()) if isinstance(value, Counter) else value))
+    for course in list(course_dict)[:3] + [cd.Course(program_name(0), 'major')]:
+        print(course, course_dict[course], course_descs[course], sep='\n    ')
+
+
+if __name__ == '__main__':
+    main()
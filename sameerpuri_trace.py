@@ -0,0 +1,181 @@
+#!/bin/python
+# Tracing for the scheduler's search. A SearchTracer collects, over every search made with it:
+#   - the nodes at each depth of the first phase and for each term of the second,
+#   - the clauses offered at each depth (the branching factor),
+#   - the prunes by the check that failed, see ScheduleSearch,
+#   - the calls and time of the search's steps and heuristics, including building the prerequisite view that holds the
+#     minimum tree heights and hours,
+# and exports them as JSON or as folded stacks ('search;fits 1234', microseconds of self time per stack) that
+# flamegraph.pl, speedscope and the like read. Tracing is done by TracedScheduleSearch, a subclass that wraps the
+# search's methods, so searches made without a tracer run the plain ScheduleSearch and pay nothing for it.
+# Usage: python sameerpuri_trace.py [--initial 'CS 1101'] [--time-budget SECONDS] [--json FILE] [--folded FILE]
+#                                   'CS major;JAPN 3891'
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import sameerpuri_scheduler as sps
+
+
+class SearchTracer:
+    """
+    Collects the statistics of the searches made by search(). The hooks, node(), placement(), options(), prune(),
+    enter() and exit(), can be overridden to trace something else, e.g. to log every prune.
+    """
+
+    def __init__(self):
+        self.searches = 0
+        self.nodes_by_depth: Dict[int, int] = defaultdict(int)
+        self.options_by_depth: Dict[int, int] = defaultdict(int)  # Clauses offered by the nodes at each depth
+        self.placements_by_term: Dict[int, int] = defaultdict(int)
+        self.prunes: Dict[str, int] = defaultdict(int)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.seconds: Dict[str, float] = defaultdict(float)  # Time in each step, not counting recursive calls twice
+        self.folded: Dict[str, float] = defaultdict(float)  # Self time of each stack of steps
+        self._stack: List[list] = []  # [name, start, time in children] of each step being timed
+
+    def search(self, *args, **kwargs) -> 'TracedScheduleSearch':
+        """Makes a traced ScheduleSearch, taking the same arguments."""
+        self.searches += 1
+        return TracedScheduleSearch(self, *args, **kwargs)
+
+    def node(self, depth: int):
+        self.nodes_by_depth[depth] += 1
+
+    def options(self, depth: int, count: int):
+        self.options_by_depth[depth] += count
+
+    def placement(self, term: int):
+        self.placements_by_term[term] += 1
+
+    def prune(self, kind: str, detail: str):
+        self.prunes[kind + ':' + detail] += 1
+
+    def enter(self, name: str):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, start, children = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.calls[name] += 1
+        if all(frame[0] != name for frame in self._stack):
+            self.seconds[name] += elapsed
+        self.folded[';'.join([frame[0] for frame in self._stack] + [name])] += elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def to_dict(self) -> dict:
+        depths = sorted(self.nodes_by_depth)
+        return {
+            'searches': self.searches,
+            'nodes': sum(self.nodes_by_depth.values()) + sum(self.placements_by_term.values()),
+            'nodes_by_depth': {depth: self.nodes_by_depth[depth] for depth in depths},
+            'placements_by_term': dict(sorted(self.placements_by_term.items())),
+            # The clauses offered per node, and the nodes per node of the depth above, which prunes make smaller
+            'branching': {depth: {'offered': self.options_by_depth[depth] / self.nodes_by_depth[depth],
+                                  'explored': self.nodes_by_depth.get(depth + 1, 0) / self.nodes_by_depth[depth]}
+                          for depth in depths},
+            'prunes': dict(sorted(self.prunes.items())),
+            'calls': {name: {'count': self.calls[name], 'seconds': self.seconds[name]} for name in sorted(self.calls)},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_folded(self) -> str:
+        """The self time of each stack in microseconds, one 'step;step;step count' line each."""
+        return ''.join('%s %d\n' % (stack, round(seconds * 1e6)) for stack, seconds in sorted(self.folded.items())
+                       if seconds >= 0.5e-6)
+
+
+class TracedScheduleSearch(sps.ScheduleSearch):
+    """A ScheduleSearch that reports to a SearchTracer. Only the hooks differ, so it searches exactly the same way."""
+
+    def __init__(self, tracer: SearchTracer, *args, **kwargs):
+        self.tracer = tracer
+        tracer.enter('setup')  # Mostly the prerequisite view: minimum tree heights, hours and mandatory courses
+        try:
+            super().__init__(*args, **kwargs)
+        finally:
+            tracer.exit()
+        self._depth = 0
+
+    def _timed(self, name: str, method, *args):
+        self.tracer.enter(name)
+        try:
+            return method(*args)
+        finally:
+            self.tracer.exit()
+
+    def run(self) -> bool:
+        return self._timed('run', super().run)
+
+    def _search(self, depth: int) -> bool:
+        self.tracer.node(depth)
+        self._depth = depth
+        return self._timed('search', super()._search, depth)
+
+    def _prune(self, kind: str, detail: str):
+        super()._prune(kind, detail)
+        self.tracer.prune(kind, detail)
+
+    def _fits(self) -> bool:
+        return self._timed('fits', super()._fits)
+
+    def _select(self) -> int:
+        return self._timed('select', super()._select)
+
+    def _options(self, goal: int) -> List[tuple]:
+        options = self._timed('options', super()._options, goal)
+        self.tracer.options(self._depth, len(options))
+        return options
+
+    def _decide(self, goal: int, clause: tuple) -> bool:
+        return self._timed('decide', super()._decide, goal, clause)
+
+    def _earliest_now(self, course: int, memo: Dict[int, int]) -> int:
+        return self._timed('earliest_now', super()._earliest_now, course, memo)
+
+    def _schedule(self) -> bool:
+        return self._timed('schedule', super()._schedule)
+
+    def _place(self, term: int, courses: List[int], remaining: int) -> bool:
+        if remaining and term <= sps.MAX_TERM:
+            self.tracer.placement(term)
+        return self._timed('place', super()._place, term, courses, remaining)
+
+    def _windows_fit(self, windows: dict, first: int) -> bool:
+        return self._timed('windows_fit', super()._windows_fit, windows, first)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Traces the scheduler on one request.')
+    parser.add_argument('goal_conditions', help="semicolon separated goal courses, e.g. 'CS major;JAPN 3891'")
+    parser.add_argument('--initial', default='', help="semicolon separated courses already taken, e.g. 'CS 1101'")
+    parser.add_argument('--time-budget', type=float, default=10, help='seconds the search may take')
+    parser.add_argument('--json', help='write the trace as JSON to this file, - for stdout')
+    parser.add_argument('--folded', help='write folded stacks for a flame graph to this file, - for stdout')
+    args = parser.parse_args()
+    import sameerpuri_benchmark as spb
+    import sameerpuri_context as spc
+    tracer = SearchTracer()
+    schedule, report = sps.anytime_scheduler(spc.context().course_dict, spb.courses(args.goal_conditions),
+                                             spb.courses(args.initial), time_budget=args.time_budget, tracer=tracer)
+    print('%s in %.3fs, %d nodes, goals missed: %s' % ('complete' if report['complete'] else 'incomplete', report['seconds'],
+          report['nodes'], ', '.join(' '.join(goal) for goal in report['goals_missed']) or '-'), file=sys.stderr)
+    for path, text in ((args.json, tracer.to_json), (args.folded, tracer.to_folded)):
+        if path == '-':
+            sys.stdout.write(text())
+        elif path:
+            with open(path, 'w') as out:
+                out.write(text())
+    if not args.json and not args.folded:
+        sys.stdout.write(tracer.to_json())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import shutil
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import course_dictionary as cd
+import sameerpuri_matcher as spm
+
+# Every cache entry is a directory named after its key holding:
+#   courses.json  the course order shared by the rows of both matrices
+#   desc.npy      L2-normalized float32 description vectors
+#   name.npy      L2-normalized float32 name vectors
+#   descs.spacy   a DocBin of the parsed descriptions, only read to render dependency trees
+#   ivf/          the nearest neighbour index of the name and description vectors, see sameerpuri_ann
+#   words/        the model's word vectors for the catalog and common words, see sameerpuri_wordvectors
+CACHE_DIR = Path('nlp_cache')
+
+
+def cache_key(course_descs: Dict[cd.Course, spm.CourseDesc], model_name: str) -> str:
+    """Hashes the catalog text together with the model name and version, so either changing invalidates the cache."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model_name, model_version(model_name)]).encode('utf-8'))
+    for course, desc in course_descs.items():
+        digest.update(json.dumps([course, desc.name, desc.summary]).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def model_version(model_name: str) -> str:
+    """Looks up the installed version of a spaCy model package without importing spaCy."""
+    try:
+        return metadata.version(model_name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def load_vectors(key: str, course_keys: List[cd.Course]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns the (description, name) matrices cached under key, memory mapped so only the rows used get paged in.
+    Returns None on a miss or if the cached course order doesn't match course_keys.
+    """
+    entry = CACHE_DIR / key
+    try:
+        with (entry / 'courses.json').open('r', encoding='utf-8') as courses:
+            if [tuple(course) for course in json.load(courses)] != [tuple(course) for course in course_keys]:
+                return None
+        return np.load(entry / 'desc.npy', mmap_mode='r'), np.load(entry / 'name.npy', mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+
+def load_docs(key: str, vocab) -> Optional[list]:
+    """Returns the cached description Docs in course order, or None on a miss. Needs the vocab of the loaded model."""
+    from spacy.tokens import DocBin
+    try:
+        return list(DocBin().from_disk(CACHE_DIR / key / 'descs.spacy').get_docs(vocab))
+    except (OSError, ValueError):
+        return None
+
+
+def save(key: str, course_keys: List[cd.Course], desc_matrix: np.ndarray, name_matrix: np.ndarray, desc_docs: list):
+    """Writes a cache entry. It is built in a scratch directory and renamed into place, so readers never see half of one."""
+    from spacy.tokens import DocBin
+    entry = CACHE_DIR / key
+    scratch = CACHE_DIR / ('%s.%d.tmp' % (key, os.getpid()))
+    try:
+        scratch.mkdir(parents=True, exist_ok=True)
+        with (scratch / 'courses.json').open('w', encoding='utf-8') as courses:
+            json.dump(course_keys, courses)
+        np.save(scratch / 'desc.npy', np.ascontiguousarray(desc_matrix, dtype=np.float32))
+        np.save(scratch / 'name.npy', np.ascontiguousarray(name_matrix, dtype=np.float32))
+        DocBin(docs=desc_docs).to_disk(scratch / 'descs.spacy')
+        os.replace(scratch, entry)
+    except OSError:  # Another process got there first, or the cache isn't writable
+        pass
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def ann_path(key: str) -> Path:
+    """Where the nearest neighbour index of a cache entry is kept."""
+    return CACHE_DIR / key / 'ivf'
+
+
+def word_vectors_path(key: str) -> Path:
+    """Where the word vector table of a cache entry is kept."""
+    return CACHE_DIR / key / 'words'
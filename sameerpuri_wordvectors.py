@@ -0,0 +1,102 @@
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Roughly how spaCy's English tokenizer splits text: runs of letters or digits, and each punctuation mark on its own
+TOKEN = re.compile(r'\w+|[^\w\s]')
+
+DTYPES = ('float32', 'float16', 'int8')
+
+
+class WordVectors:
+    """
+    A table of the word vectors of a spaCy model, cut down to the words the recommender can meet, so text vectors can
+    be computed without loading the model. Row i of table is the vector of words[i], stored as float32, float16, or
+    int8 times the row's scale. A text's vector is the mean of the vectors of its tokens, like Doc.vector; tokens
+    without a vector count as zero, which only changes its length, and vectors are normalized before use.
+    Loaded memory mapped, so only the rows of words that come up are read. Never changed once built.
+    """
+
+    def __init__(self, words: List[str], table: np.ndarray, scales: Optional[np.ndarray]):
+        self.words = words
+        self.rows: Dict[str, int] = {word: row for row, word in enumerate(words)}
+        self.table = table
+        self.scales = scales
+
+    @classmethod
+    def export(cls, nlp, texts: Iterable[str], common_words: int, dtype: str = 'float16') -> 'WordVectors':
+        """
+        Takes the vectors of every word in texts, in the case written and in lowercase, and of the common_words most
+        frequent words of nlp's model (the first rows of its table), for the words in search queries.
+        """
+        vectors = nlp.vocab.vectors
+        words = {}
+        for doc in nlp.tokenizer.pipe(texts):
+            for token in doc:
+                words[token.orth_] = words[token.lower_] = None
+        for key, row in sorted(vectors.key2row.items(), key=lambda item: item[1])[:common_words]:
+            if key in nlp.vocab.strings:
+                words[nlp.vocab.strings[key]] = None
+        words = [word for word in words if nlp.vocab.has_vector(word)]
+        matrix = np.array([nlp.vocab.get_vector(word) for word in words], dtype=np.float32).reshape(len(words), vectors.shape[1])
+        return cls.quantized(words, matrix, dtype)
+
+    @classmethod
+    def quantized(cls, words: List[str], matrix: np.ndarray, dtype: str) -> 'WordVectors':
+        if dtype not in DTYPES:
+            raise ValueError('dtype must be one of ' + ', '.join(DTYPES))
+        if dtype != 'int8':
+            return cls(words, matrix.astype(dtype), None)
+        scales = np.abs(matrix).max(axis=1) / 127
+        quantized = np.round(np.divide(matrix, scales[:, None], out=np.zeros_like(matrix), where=scales[:, None] > 0))
+        return cls(words, quantized.astype(np.int8), scales.astype(np.float32))
+
+    def vector(self, text: str) -> np.ndarray:
+        """The mean of the vectors of the text's tokens, looking up each as written then in lowercase."""
+        rows = []
+        tokens = TOKEN.findall(text)
+        for token in tokens:
+            row = self.rows.get(token)
+            if row is None:
+                row = self.rows.get(token.lower())
+            if row is not None:
+                rows.append(row)
+        if not rows:
+            return np.zeros(self.table.shape[1], dtype=np.float32)
+        vectors = self.table[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows, None]
+        return vectors.sum(axis=0) / len(tokens)
+
+    def save(self, directory: Path):
+        """Writes the table to a scratch directory and renames it into place, so readers never see half of one."""
+        scratch = directory.with_name('%s.%d.tmp' % (directory.name, os.getpid()))
+        try:
+            scratch.mkdir(parents=True, exist_ok=True)
+            with (scratch / 'words.json').open('w', encoding='utf-8') as words:
+                json.dump(self.words, words)
+            np.save(scratch / 'table.npy', self.table)
+            if self.scales is not None:
+                np.save(scratch / 'scales.npy', self.scales)
+            os.replace(scratch, directory)
+        except OSError:  # Another process got there first, or the cache isn't writable
+            pass
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional['WordVectors']:
+        """Loads a saved table memory mapped, or returns None if there isn't one."""
+        try:
+            with (directory / 'words.json').open('r', encoding='utf-8') as words:
+                word_list = json.load(words)
+            table = np.load(directory / 'table.npy', mmap_mode='r')
+            scales = np.load(directory / 'scales.npy') if (directory / 'scales.npy').exists() else None
+            return cls(word_list, table, scales)
+        except (OSError, ValueError):
+            return None